@@ -4,9 +4,16 @@ import json
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 from flask_wtf.csrf import CSRFProtect, CSRFError
-from sqlalchemy import text
 from config import Config
 from datetime import datetime  # 确保导入 datetime
+from .shared.stats_cache import stats_cache, register_invalidation_hooks
+from .shared.db_tuning import apply_session_timeouts
+from .shared.query_profiler import query_profiler
+from .shared.metrics import metrics
+from .shared.theme_cache import theme_cache
+from .shared.change_feed import change_feed, register_change_hooks
+from .shared.slot_events import register_slot_hooks, slot_events
+from .shared.json_provider import init_json_provider
 
 db = SQLAlchemy()
 login_manager = LoginManager()
@@ -14,14 +21,24 @@ login_manager.login_view = 'auth.login'
 login_manager.login_message = "Please login first"
 login_manager.login_message_category = "info"
 csrf = CSRFProtect()
+register_invalidation_hooks(db.session)
+register_change_hooks(db.session)
+register_slot_hooks(db.session)
 
 def create_app(config_class=Config):
     app = Flask(__name__)
     app.config.from_object(config_class)
+    init_json_provider(app)
 
     db.init_app(app)
     login_manager.init_app(app)
     csrf.init_app(app)
+    stats_cache.init_app(app)
+    query_profiler.init_app(app)
+    metrics.init_app(app)
+    theme_cache.init_app(app)
+    change_feed.init_app(app)
+    slot_events.init_app(app)
 
     # CSRF 错误处理
     @app.errorhandler(CSRFError)
@@ -31,18 +48,18 @@ def create_app(config_class=Config):
         return render_template('errors/csrf_error.html', reason=e.description), 400
 
     with app.app_context():
-        from app.shared.utils import get_batch_counter
-        db.create_all()
-        try:
-            db.session.execute(text(
-                "ALTER TABLE users ADD COLUMN IF NOT EXISTS password_plain VARCHAR(128);"
-            ))
-            db.session.commit()
-        except Exception:
-            db.session.rollback()
-
-        # Ensure batch counter config exists
-        get_batch_counter()
+        from app.shared.schema import check_schema, register_commands
+        from app.shared.seed import register_seed_command
+        apply_session_timeouts(
+            db.engine,
+            app.config.get('DB_STATEMENT_TIMEOUT_MS', 0),
+            app.config.get('DB_IDLE_IN_TRANSACTION_TIMEOUT_MS', 0),
+        )
+        # 建表/改表由 `flask migrate-db` 执行, 启动时只检查版本
+        if app.config.get('SCHEMA_CHECK_ON_STARTUP', True):
+            check_schema(app)
+    register_commands(app)
+    register_seed_command(app)
 
     # Register blueprints
     from .shared.auth import bp as auth_bp
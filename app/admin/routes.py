@@ -5,6 +5,8 @@ from . import bp
 from .. import db
 from ..shared.permissions import PermissionManager, require_permission
 from ..shared.decorators import admin_required
+from ..shared.stats_cache import stats_cache
+from ..shared.query_profiler import query_profiler
 from ..cell_storage.models import User
 from ..inventory.models import UserPermission
 
@@ -306,6 +308,47 @@ def api_permission_audit():
     return jsonify(result)
 
 
+@bp.route('/api/stats-cache')
+@login_required
+@admin_required
+def api_stats_cache():
+    """Hit/miss counters of the dashboard statistics cache (this worker only)"""
+    return jsonify(stats_cache.counters())
+
+
+@bp.route('/api/stats-cache', methods=['DELETE'])
+@login_required
+@admin_required
+def api_clear_stats_cache():
+    """Drop all cached dashboard statistics"""
+    stats_cache.clear()
+    return jsonify({'success': True})
+
+
+@bp.route('/perf')
+@login_required
+@admin_required
+def perf():
+    """Query profiler summary: top endpoints by DB time, N+1 findings, slow queries (this worker only)"""
+    return render_template('admin/perf.html',
+                           enabled=query_profiler.enabled,
+                           endpoints=query_profiler.top_endpoints(),
+                           n_plus_one=query_profiler.n_plus_one_findings(),
+                           slow_queries=query_profiler.slow_queries(),
+                           slow_query_ms=query_profiler.slow_query_ms,
+                           n_plus_one_threshold=query_profiler.n_plus_one_threshold)
+
+
+@bp.route('/perf/reset', methods=['POST'])
+@login_required
+@admin_required
+def reset_perf():
+    """Clear the query profiler statistics of this worker"""
+    query_profiler.reset()
+    flash('Query profiler statistics cleared.', 'success')
+    return redirect(url_for('admin.perf'))
+
+
 @bp.route('/audit/permissions')
 @login_required
 @require_permission('admin.audit_logs')
@@ -49,11 +49,9 @@ from urllib.parse import urlparse
 from sqlalchemy.exc import IntegrityError
 from datetime import datetime
 import json
-import boto3
-from botocore.exceptions import BotoCoreError, ClientError
 from . import bp
 from ... import db
-from sqlalchemy.orm import joinedload
+from sqlalchemy.orm import contains_eager
 from ...shared.decorators import admin_required
 from ..forms import (
     CellLineForm,
@@ -86,6 +84,14 @@ from ..models import (
 from ...shared.utils import log_audit, clear_database_except_admin
 from ...shared.utils import get_next_batch_id, get_batch_counter, set_batch_counter
 from ...shared.audit_utils import create_audit_log, format_audit_details
+from ...shared.stats_cache import stats_cache
+from ...shared.metrics import metrics
+from ..placement import OccupancySnapshot, plan_placement
+from ..reference_data import cell_line_choices, tower_choices, drawer_choices, box_choices
+from ..services import (InventoryAnalyticsService, VialMutationService, SelectionService, PickupService,
+                        VialPlacementService, FacetService, VialDetailsService, RDSBackupService, BackupError,
+                        VIAL_STATUSES, MAX_SELECTION_SIZE, MAX_DETAILS_BATCH,
+                        chunked, decode_id_ranges, encode_id_ranges)
 import io
 import csv
 from io import StringIO
@@ -108,7 +114,7 @@ def validate_csrf_token(token):
 @login_required # Ensure only logged-in users can access the main dashboard
 def index():
     # 基础统计
-    vial_count = CryoVial.query.count()
+    vial_count = stats_cache.get_or_compute('cell_storage.vial_count', lambda: CryoVial.query.count())
     
     # 获取预警信息
     from app.shared.utils import get_active_alerts, generate_all_alerts
@@ -382,7 +388,7 @@ def edit_tower(tower_id):
 @admin_required
 def add_drawer():
     form = DrawerForm()
-    form.tower_id.choices = [(t.id, t.name) for t in Tower.query.order_by(Tower.name).all()]
+    form.tower_id.choices = tower_choices()
     
     # Pre-select tower if tower_id is provided in URL
     if request.method == 'GET':
@@ -404,7 +410,7 @@ def add_drawer():
 def edit_drawer(drawer_id):
     drawer = Drawer.query.get_or_404(drawer_id)
     form = DrawerForm(obj=drawer)
-    form.tower_id.choices = [(t.id, t.name) for t in Tower.query.order_by(Tower.name).all()]
+    form.tower_id.choices = tower_choices()
     if form.validate_on_submit():
         drawer.name = form.name.data
         drawer.tower_id = form.tower_id.data
@@ -421,7 +427,7 @@ def edit_drawer(drawer_id):
 @admin_required
 def add_box():
     form = BoxForm()
-    form.drawer_id.choices = [(d.id, f"{d.tower_info.name} - {d.name}") for d in Drawer.query.join(Tower).order_by(Tower.name, Drawer.name).all()]
+    form.drawer_id.choices = drawer_choices()
     
     # Pre-select drawer if drawer_id is provided in URL
     if request.method == 'GET':
@@ -456,7 +462,7 @@ def add_box():
 def edit_box(box_id):
     box = Box.query.get_or_404(box_id)
     form = BoxForm(obj=box)
-    form.drawer_id.choices = [(d.id, f"{d.tower_info.name} - {d.name}") for d in Drawer.query.join(Tower).order_by(Tower.name, Drawer.name).all()]
+    form.drawer_id.choices = drawer_choices()
     if form.validate_on_submit():
         box.name = form.name.data
         box.drawer_id = form.drawer_id.data
@@ -504,22 +510,15 @@ def cryovial_inventory():
         else:
             view_all = session.get('view_all_active', False)
 
-    selected_ids = session.get('pickup_ids', [])
     if request.method == 'POST':
         if 'selected_batches' in request.form:
-            batch_ids = request.form.getlist('selected_batches')
-            added = 0
-            for bid in batch_ids:
-                try:
-                    bid_int = int(bid)
-                except ValueError:
-                    continue
-                vials_in_batch = CryoVial.query.filter_by(batch_id=bid_int, status='Available').all()
-                for vial in vials_in_batch:
-                    if vial.id not in selected_ids:
-                        selected_ids.append(vial.id)
-                        added += 1
-            session['pickup_ids'] = selected_ids
+            batch_ids = [int(bid) for bid in request.form.getlist('selected_batches') if bid.isdigit()]
+            vial_ids = [
+                vial_id for (vial_id,) in db.session.query(CryoVial.id)
+                .filter(CryoVial.batch_id.in_(batch_ids), CryoVial.status == 'Available')
+                .all()
+            ] if batch_ids else []
+            added = SelectionService.add('pickup', vial_ids) if vial_ids else 0
             if added:
                 flash(f'{added} vial(s) added to pick-up list.', 'success')
             redirect_params = {
@@ -533,23 +532,16 @@ def cryovial_inventory():
                 redirect_params['view_all'] = 'true'
             return redirect(url_for('cell_storage.cryovial_inventory', **redirect_params))
         elif 'remove_batches' in request.form:
-            remove_ids = request.form.getlist('remove_batches')
-            removed = 0
-            for rid in remove_ids:
-                try:
-                    rid_int = int(rid)
-                except ValueError:
-                    continue
-                remove_vials = CryoVial.query.filter(CryoVial.id.in_(selected_ids), CryoVial.batch_id == rid_int).all()
-                for v in remove_vials:
-                    if v.id in selected_ids:
-                        selected_ids.remove(v.id)
-                        removed += 1
+            remove_batch_ids = [int(rid) for rid in request.form.getlist('remove_batches') if rid.isdigit()]
+            vial_ids = [
+                vial_id for (vial_id,) in db.session.query(CryoVial.id)
+                .filter(CryoVial.batch_id.in_(remove_batch_ids))
+                .all()
+            ] if remove_batch_ids else []
+            added, removed, remaining = SelectionService.apply_delta('pickup', remove=vial_ids)
+            if not remaining:
+                SelectionService.clear('pickup')
             if removed:
-                if selected_ids:
-                    session['pickup_ids'] = selected_ids
-                else:
-                    session.pop('pickup_ids', None)
                 flash(f'{removed} vial(s) removed from pick-up list.', 'success')
             redirect_params = {
                 'q': search_q,
@@ -562,15 +554,9 @@ def cryovial_inventory():
                 redirect_params['view_all'] = 'true'
             return redirect(url_for('cell_storage.cryovial_inventory', **redirect_params))
 
+    selected_ids = SelectionService.get_ids('pickup')
     towers = Tower.query.order_by(Tower.name).all()
-    all_creators = User.query.order_by(User.username).all()
     inventory = {}
-    
-    # Create a color mapping for batches
-    all_batches = VialBatch.query.all()
-    batch_color_map = {}
-    for i, batch in enumerate(all_batches):
-        batch_color_map[batch.id] = i % 12  # Use 12 different colors
 
     for tower in towers:
         tower_dict = {}
@@ -587,7 +573,7 @@ def cryovial_inventory():
                         'status': vial.status,
                         'id': vial.id,
                         'batch_id': vial.batch_id,
-                        'batch_color': batch_color_map.get(vial.batch_id, 0)
+                        'batch_color': vial.batch_id % 12  # Use 12 different colors
                     }
                 drawer_boxes.append({
                     'id': box.id,
@@ -601,26 +587,12 @@ def cryovial_inventory():
             tower_dict[drawer.name] = drawer_boxes
         inventory[tower.name] = tower_dict
 
+    search_conditions = FacetService.inventory_conditions(
+        search_q, search_creator, search_fluorescence, search_resistance
+    )
     search_results = None
     if search_q or search_creator or search_fluorescence or search_resistance or view_all:
-        query = CryoVial.query.join(VialBatch).join(CellLine).join(User, VialBatch.created_by_user_id == User.id)
-        query = query.join(Box).join(Drawer).join(Tower)
-        if search_q:
-            like = f"%{search_q}%"
-            query = query.filter(
-                (CryoVial.unique_vial_id_tag.ilike(like)) |
-                (VialBatch.name.ilike(like)) |
-                (CellLine.name.ilike(like)) |
-                (CryoVial.fluorescence_tag.ilike(like)) |
-                (CryoVial.resistance.ilike(like)) |
-                (CryoVial.parental_cell_line.ilike(like))
-            )
-        if search_creator:
-            query = query.filter(User.username == search_creator)
-        if search_fluorescence:
-            query = query.filter(CryoVial.fluorescence_tag.ilike(f"%{search_fluorescence}%"))
-        if search_resistance:
-            query = query.filter(CryoVial.resistance.ilike(f"%{search_resistance}%"))
+        query = FacetService.joined(CryoVial.query).filter(*search_conditions)
         query = query.order_by(VialBatch.id, CryoVial.unique_vial_id_tag)
         vials = query.all()
         grouped = {}
@@ -665,22 +637,16 @@ def cryovial_inventory():
                     info['date_frozen'] = v.date_frozen
         selected_batches = list(grouped_sel.values())
 
-    # Get distinct values for filter dropdowns
-    all_fluorescence_tags = [
-        item[0]
-        for item in db.session.query(CryoVial.fluorescence_tag)
-        .filter(CryoVial.fluorescence_tag.isnot(None) & (CryoVial.fluorescence_tag != ''))
-        .distinct()
-        .all()
-    ]
-    all_resistances = [
-        item[0]
-        for item in db.session.query(CryoVial.resistance)
-        .filter(CryoVial.resistance.isnot(None) & (CryoVial.resistance != ''))
-        .distinct()
-        .all()
-    ]
-    
+    # Filter dropdowns: all values from the cached facets (every status, like the search),
+    # counts of the current search without the facet's own filter
+    facets = FacetService.vial_facets()
+    if search_conditions:
+        restricted = FacetService.inventory_counts(
+            search_q, search_creator, search_fluorescence, search_resistance
+        )
+        for name, values in restricted.items():
+            facets[name] = FacetService.with_counts(facets[name], values)
+
     return render_template(
         'main/cryovial_inventory.html',
         title='CryoVial Inventory',
@@ -692,11 +658,10 @@ def cryovial_inventory():
         search_resistance=search_resistance,
         selected_batches=selected_batches,
         selected_ids=selected_ids,
-        all_creators=all_creators,
-        all_fluorescence_tags=all_fluorescence_tags,
-        all_resistances=all_resistances,
-        batch_counter=get_batch_counter(),
-        batch_color_map=batch_color_map
+        creator_facet=facets['creator'],
+        fluorescence_facet=facets['fluorescence'],
+        resistance_facet=facets['resistance'],
+        batch_counter=get_batch_counter()
     )
 
 
@@ -704,95 +669,34 @@ def cryovial_inventory():
 @login_required
 def pickup_selected_vials():
     """Show selected vials and their locations for pick up."""
-    selected_ids = session.get('pickup_ids', [])
+    selected_ids = SelectionService.get_ids('pickup')
     if not selected_ids:
         flash('No vials selected for pick up.', 'info')
         return redirect(url_for('cell_storage.cryovial_inventory'))
 
-    vials = CryoVial.query.filter(CryoVial.id.in_(selected_ids)).join(Box).join(Drawer).join(Tower).join(VialBatch).join(CellLine).all()
-
-    batches = {}
-    color_map = {}
-    color_index = 0
-    for v in vials:
-        b = batches.setdefault(v.batch_id, {
-            'batch': v.batch,
-            'cell_line': v.cell_line_info.name,
-            'date_frozen': v.date_frozen,
-            'vials': []
-        })
-        if v.date_frozen < b['date_frozen']:
-            b['date_frozen'] = v.date_frozen
-        b['vials'].append(v)
-
-        if v.batch.name not in color_map:
-            color_map[v.batch.name] = color_index % 7
-            color_index += 1
+    vials = PickupService.load_vials(selected_ids)
+    batches = PickupService.group_by_batch(vials)
 
     if request.method == 'POST':
-        picked_boxes = {}
-        picked_vials = []
-        used_ids = []
-        for bid, info in batches.items():
-            qty = int(request.form.get(f'qty_{bid}', 0))
-            to_use = info['vials'][:qty]
-            for vial in to_use:
-                vial.status = 'Used'
-                vial.last_updated = datetime.utcnow()
-                used_ids.append(vial.id)
-                picked_vials.append(vial)
-                box = vial.box_location
-                pb = picked_boxes.setdefault(
-                    box.id,
-                    {
-                        'box': box,
-                        'rows': box.rows,
-                        'columns': box.columns,
-                        'cells': {},
-                    },
-                )
-                pb['cells'][(vial.row_in_box, vial.col_in_box)] = vial
-        db.session.commit()
-        batch_ids = list({v.batch_id for v in picked_vials})
-        log_audit(
-            current_user.id,
-            'PICKUP_VIALS',
-            target_type='CryoVial',
-            details={'vial_ids': used_ids, 'batch_ids': batch_ids},
-        )
-        session.pop('pickup_ids', None)
+        quantities = {bid: request.form.get(f'qty_{bid}', 0, type=int) for bid in batches}
+        picked_vials = PickupService.pick(batches, quantities, current_user.id)
+        SelectionService.clear('pickup')
         
-        # 显示拾取结果页面，包含位置信息
+        # 显示拾取结果页面，包含位置信息（按塔→抽屉→盒→行列排序的拾取清单）
         return render_template('main/pickup_confirmation.html', 
                              title='Pick Up Confirmation',
-                             picked_boxes=picked_boxes, 
+                             picked_boxes=PickupService.box_maps(picked_vials), 
                              picked_vials=picked_vials,
                              current_datetime=datetime.now())
 
     return render_template('main/pickup_selected_vials.html', batches=batches)
 
 
-def find_available_slots_in_box(box, num_slots_needed):
-    """Return up to ``num_slots_needed`` empty slots in ``box``."""
-    occupied_slots = {
-        (v.row_in_box, v.col_in_box)
-        for v in CryoVial.query.filter_by(box_id=box.id, status='Available').all()
-    }
-    available_positions = []
-    for r in range(1, box.rows + 1):
-        for c in range(1, box.columns + 1):
-            if (r, c) not in occupied_slots:
-                available_positions.append({'row': r, 'col': c})
-            if len(available_positions) >= num_slots_needed:
-                return available_positions[:num_slots_needed]
-    return available_positions
-
-
 @bp.route('/cryovial/add', methods=['GET', 'POST'])
 @login_required
 def add_cryovial():
     form = CryoVialForm()
-    form.cell_line_id.choices = [(cl.id, cl.name) for cl in CellLine.query.order_by(CellLine.name).all()]
+    form.cell_line_id.choices = cell_line_choices()
     
     if request.method == 'GET':
         # Pre-select cell line if provided in URL, for workflow improvement
@@ -800,10 +704,11 @@ def add_cryovial():
         if cell_line_id:
             form.cell_line_id.data = cell_line_id
 
-    if 'proposed_placements' in session and request.method == 'POST' and request.form.get('confirm_placement') == 'yes':
+    if request.method == 'POST' and request.form.get('confirm_placement') == 'yes':
         # Confirmation step for auto-placed vials
-        placements = session.pop('proposed_placements', [])
-        vial_common_data = session.pop('vial_common_data', {})
+        pending = SelectionService.pop_payload('placement') or {}
+        placements = pending.get('placements', [])
+        vial_common_data = pending.get('common_data', {})
 
         if not placements or not vial_common_data:
             flash('Placement confirmation data lost. Please try again.', 'danger')
@@ -818,20 +723,13 @@ def add_cryovial():
         db.session.flush()  # 确保batch ID可用但不提交
         base_tag = f"B{batch.id}"
 
-        created_vials_info = []
+        new_vials = []
         quantity_being_added = len(placements) # Get the actual number from placements
 
         for i, p in enumerate(placements):
             unique_tag_suffix = f"-{i+1}" if quantity_being_added > 1 else ""
             unique_tag = f"{base_tag}{unique_tag_suffix}"
 
-            existing_tag_vial = CryoVial.query.filter_by(unique_vial_id_tag=unique_tag).first()
-            if existing_tag_vial:
-                flash(f'Error: Generated vial tag "{unique_tag}" already exists. Please try again.', 'danger')
-                session.pop('proposed_placements', None)
-                session.pop('vial_common_data', None)
-                return redirect(url_for('cell_storage.add_cryovial'))
-
             vial = CryoVial(
                 unique_vial_id_tag=unique_tag,
                 batch_id=batch.id,
@@ -851,13 +749,16 @@ def add_cryovial():
                 notes=vial_common_data['notes'],
                 date_created=datetime.utcnow()
             )
-            db.session.add(vial)
-            created_vials_info.append(f"Vial {unique_tag} at Box ID {p['box_id']}, R{p['row']}C{p['col']}")
+            new_vials.append(vial)
 
         try:
-            db.session.flush() # Ensure vial IDs are available if batch.vials.all() needs them before commit
-            # Get vial IDs for the audit log
-            vial_ids = [v.id for v in batch.vials.all() if v.id is not None]
+            # 乐观插入：依赖部分唯一索引，位置被并发占用时自动换到下一个空位
+            moved_vials = VialPlacementService.insert_vials(new_vials)
+            vial_ids = [v.id for v in new_vials]
+            created_vials_info = [
+                f"Vial {v.unique_vial_id_tag} at Box ID {v.box_id}, R{v.row_in_box}C{v.col_in_box}"
+                for v in new_vials
+            ]
             
             # Create human-readable audit log
             readable_details = create_audit_log(
@@ -884,6 +785,12 @@ def add_cryovial():
                 + "; ".join(created_vials_info),
                 'success'
             )
+            if moved_vials:
+                flash(
+                    f"{len(moved_vials)} proposed position(s) were taken by another user in the meantime; "
+                    "those vials were placed in the next free slots shown above.",
+                    'warning'
+                )
             return redirect(url_for('cell_storage.cryovial_inventory'))
         except Exception as e:
             db.session.rollback()
@@ -907,86 +814,32 @@ def add_cryovial():
             'notes': form.notes.data
         }
 
-        # Auto-allocation logic for ANY quantity (1 or more)
-        # Modified logic: First try to find a single box that can accommodate all vials
-        # Priority: boxes with smaller numeric identifiers (1-5) regardless of tower/drawer
-        allocated_positions = []
-        selected_boxes = []
-
-        # Create a custom sorting function to prioritize boxes with numbers 1-5
-        def box_priority_key(box):
-            # Extract numeric part from box name for sorting
-            import re
-            numbers = re.findall(r'\d+', box.name)
-            if numbers:
-                # Convert first number found to integer for sorting
-                first_num = int(numbers[0])
-                # Prioritize boxes 1-5, then others
-                if 1 <= first_num <= 5:
-                    return (0, first_num)  # High priority group, sorted by number
-                else:
-                    return (1, first_num)  # Low priority group, sorted by number
-            else:
-                # Boxes without numbers go to the end
-                return (2, box.name)
-
-        all_boxes = Box.query.join(Drawer).join(Tower).all()
-        # Sort boxes by priority: numbered 1-5 first, then others
-        all_boxes_sorted = sorted(all_boxes, key=box_priority_key)
-
-        # First attempt: try to find a single box that can accommodate all vials
-        for box_candidate in all_boxes_sorted:
-            slots = find_available_slots_in_box(box_candidate, quantity)
-            if len(slots) == quantity:  # Found a box that can fit all vials
-                selected_boxes.append(box_candidate)
-                for slot in slots:
-                    allocated_positions.append({
-                        'box_id': box_candidate.id,
-                        'box_name': box_candidate.name,
-                        'tower_name': box_candidate.drawer_info.tower_info.name,
-                        'drawer_name': box_candidate.drawer_info.name,
-                        'row': slot['row'],
-                        'col': slot['col']
-                    })
-                break  # Found a single box for all vials, stop here
-
-        # If no single box can accommodate all vials, fall back to multiple boxes
-        if len(allocated_positions) < quantity:
-            allocated_positions = []
-            selected_boxes = []
-            for box_candidate in all_boxes_sorted:
-                remaining = quantity - len(allocated_positions)
-                if remaining <= 0:
-                    break
-                slots = find_available_slots_in_box(box_candidate, remaining)
-                if slots:
-                    selected_boxes.append(box_candidate)
-                    for slot in slots:
-                        allocated_positions.append({
-                            'box_id': box_candidate.id,
-                            'box_name': box_candidate.name,
-                            'tower_name': box_candidate.drawer_info.tower_info.name,
-                            'drawer_name': box_candidate.drawer_info.name,
-                            'row': slot['row'],
-                            'col': slot['col']
-                        })
+        # 自动分配位置：按配置的策略在内存占用快照上规划，不逐盒查询
+        snapshot = OccupancySnapshot.load()
+        allocated_positions, selected_boxes = plan_placement(
+            quantity,
+            strategy=current_app.config.get('PLACEMENT_STRATEGY', 'first_fit'),
+            snapshot=snapshot,
+        )
 
         if len(allocated_positions) == quantity:
-            session['proposed_placements'] = allocated_positions
-            session['vial_common_data'] = common_data_for_session
+            SelectionService.set_payload('placement', {
+                'placements': allocated_positions,
+                'common_data': common_data_for_session,
+            })
 
             boxes_details_for_map = []
             for b in selected_boxes:
                 boxes_details_for_map.append({
-                    'id': b.id,
-                    'name': b.name,
-                    'tower_name': b.drawer_info.tower_info.name,
-                    'drawer_name': b.drawer_info.name,
-                    'rows': b.rows,
-                    'columns': b.columns,
+                    'id': b['id'],
+                    'name': b['name'],
+                    'tower_name': b['tower_name'],
+                    'drawer_name': b['drawer_name'],
+                    'rows': b['rows'],
+                    'columns': b['columns'],
                     'occupied': [
-                        {'row': v.row_in_box, 'col': v.col_in_box, 'tag': v.batch_id}
-                        for v in CryoVial.query.filter_by(box_id=b.id, status='Available').all()
+                        {'row': r, 'col': c, 'tag': batch_id}
+                        for (r, c), batch_id in sorted(snapshot.occupied.get(b['id'], {}).items())
                     ]
                 })
             cell_line_name_for_confirm = CellLine.query.get(common_data_for_session['cell_line_id']).name
@@ -1007,8 +860,7 @@ def add_cryovial():
             )
 
     if request.method == 'GET' or not form.is_submitted():
-        session.pop('proposed_placements', None)
-        session.pop('vial_common_data', None)
+        SelectionService.clear('placement')
 
     return render_template('main/cryovial_form.html', title='Add CryoVial(s)', form=form,
                            form_action=url_for('cell_storage.add_cryovial'))
@@ -1039,14 +891,18 @@ def update_cryovial_status(vial_id):
             new_status=vial.status,
             notes=form.notes.data
         )
-        log_audit(
-            current_user.id,
-            'UPDATE_STATUS',
-            target_type='CryoVial',
-            target_id=vial.id,
-            details=readable_details
-        )
-        db.session.commit()
+        try:
+            log_audit(
+                current_user.id,
+                'UPDATE_STATUS',
+                target_type='CryoVial',
+                target_id=vial.id,
+                details=readable_details
+            )
+        except IntegrityError:
+            db.session.rollback()
+            flash('Cannot mark this vial Available: its position is already occupied by another available vial.', 'danger')
+            return redirect(url_for('cell_storage.update_cryovial_status', vial_id=vial_id))
         flash(f'Status of vial "{vial.unique_vial_id_tag}" updated to {vial.status}.', 'success')
         return redirect(url_for('cell_storage.cryovial_inventory')) # Or back to where they were (e.g., box view)
 
@@ -1067,11 +923,8 @@ def edit_cryovial(vial_id):
     #     return redirect(url_for('cell_storage.cryovial_inventory'))
 
     form = CryoVialEditForm(obj=vial)
-    form.cell_line_id.choices = [(cl.id, cl.name) for cl in CellLine.query.order_by(CellLine.name).all()]
-    form.box_id.choices = [
-        (b.id, f"{b.drawer_info.tower_info.name} - {b.drawer_info.name} - {b.name} ({b.rows}x{b.columns})")
-        for b in Box.query.join(Drawer).join(Tower).order_by(Tower.name, Drawer.name, Box.name).all()
-    ]
+    form.cell_line_id.choices = cell_line_choices()
+    form.box_id.choices = box_choices()
 
     # Ensure these fields are correctly populated on GET if obj doesn't do it perfectly for SelectFields after validation fail
     if request.method == 'GET':
@@ -1092,25 +945,11 @@ def edit_cryovial(vial_id):
         form.notes.data = vial.notes
 
     if form.validate_on_submit():
-        # Basic check for position change and occupancy, more complex if vial moves
-        if (form.box_id.data != vial.box_id or \
-            form.row_in_box.data != vial.row_in_box or \
-            form.col_in_box.data != vial.col_in_box):
-            existing_vial_at_new_pos = CryoVial.query.filter(
-                CryoVial.id != vial.id,  # Exclude the current vial
-                CryoVial.box_id == form.box_id.data,
-                CryoVial.row_in_box == form.row_in_box.data,
-                CryoVial.col_in_box == form.col_in_box.data,
-                CryoVial.status == 'Available'
-            ).first()
-            if existing_vial_at_new_pos:
-                flash(f'Error: New position {form.row_in_box.data}-{form.col_in_box.data} in selected box is already occupied by vial {existing_vial_at_new_pos.unique_vial_id_tag}.', 'danger')
-                return render_template('main/cryovial_form.html', title='Edit CryoVial', form=form, vial=vial, form_action=url_for('cell_storage.edit_cryovial', vial_id=vial.id))
-
+        # Slot occupancy is enforced by the uq_cryovials_occupied_slot index on commit
         selected_box = Box.query.get(form.box_id.data)
         if not selected_box or not (1 <= form.row_in_box.data <= selected_box.rows and 1 <= form.col_in_box.data <= selected_box.columns):
             flash(f'Error: Row/Column number is outside the dimensions of the selected box ({selected_box.rows}x{selected_box.columns}).', 'danger')
-            return render_template('main/cryovial_form.html', title='Edit CryoVial', form=form, vial=vial, form_action=url_for('cell_storage.edit_cryovial', vial_id=vial.id))
+            return render_template('main/edit_cryovial_form.html', title='Edit CryoVial', form=form, vial=vial, form_action=url_for('cell_storage.edit_cryovial', vial_id=vial.id))
 
         vial.unique_vial_id_tag = form.unique_vial_id_tag.data
         vial.cell_line_id = form.cell_line_id.data
@@ -1137,14 +976,28 @@ def edit_cryovial(vial_id):
             # You could add more specific changed fields here if desired
             # e.g., 'changed_fields': {'status': vial.status, 'notes': vial.notes}
         }
-        log_audit(
-            current_user.id,
-            'EDIT_CRYOVIAL',
-            target_type='CryoVial',
-            target_id=vial.id,
-            details=current_details_for_edit
-        )
-        db.session.commit()
+        try:
+            log_audit(
+                current_user.id,
+                'EDIT_CRYOVIAL',
+                target_type='CryoVial',
+                target_id=vial.id,
+                details=current_details_for_edit
+            )
+        except IntegrityError:
+            db.session.rollback()
+            occupant = CryoVial.query.filter(
+                CryoVial.id != vial_id,
+                CryoVial.box_id == form.box_id.data,
+                CryoVial.row_in_box == form.row_in_box.data,
+                CryoVial.col_in_box == form.col_in_box.data,
+                CryoVial.status == 'Available'
+            ).first()
+            if occupant:
+                flash(f'Error: New position {form.row_in_box.data}-{form.col_in_box.data} in selected box is already occupied by vial {occupant.unique_vial_id_tag}.', 'danger')
+            else:
+                flash(f'Error: Vial tag "{form.unique_vial_id_tag.data}" is already in use.', 'danger')
+            return render_template('main/edit_cryovial_form.html', title='Edit CryoVial', form=form, vial=vial, form_action=url_for('cell_storage.edit_cryovial', vial_id=vial_id))
         flash(f'CryoVial "{vial.unique_vial_id_tag}" updated successfully!', 'success')
         return redirect(get_smart_redirect_url('cell_storage.cryovial_inventory'))
 
@@ -1160,18 +1013,12 @@ def add_vial_at_position(box_id, row, col):
         flash('Invalid position for this box.', 'danger')
         return redirect(url_for('cell_storage.cryovial_inventory'))
 
-    existing = CryoVial.query.filter_by(
-        box_id=box.id,
-        row_in_box=row,
-        col_in_box=col,
-        status='Available'
-    ).first()
-    if existing:
+    if request.method == 'GET' and VialPlacementService.slot_is_occupied(box.id, row, col):
         flash('That position is already occupied.', 'danger')
         return redirect(url_for('cell_storage.cryovial_inventory'))
 
     form = ManualVialForm()
-    form.cell_line_id.choices = [(c.id, c.name) for c in CellLine.query.order_by(CellLine.name).all()]
+    form.cell_line_id.choices = cell_line_choices()
 
     if form.validate_on_submit():
         if form.batch_id.data:
@@ -1186,7 +1033,7 @@ def add_vial_at_position(box_id, row, col):
                 created_by_user_id=current_user.id,
             )
             db.session.add(batch)
-            db.session.commit()
+            db.session.flush()
 
         base_tag = f"B{batch.id}"
         count = batch.vials.count()
@@ -1212,7 +1059,18 @@ def add_vial_at_position(box_id, row, col):
             date_created=datetime.utcnow(),
         )
         db.session.add(vial)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError as e:
+            db.session.rollback()
+            if VialPlacementService.slot_is_occupied(box_id, row, col):
+                # 位置在填写表单期间被占用（部分唯一索引冲突）
+                flash('That position is already occupied.', 'danger')
+            else:
+                # 其他约束冲突, 如标签重复
+                current_app.logger.warning(f'Could not add vial {unique_tag}: {e}')
+                flash(f'Could not add the vial: tag {unique_tag} already exists or the data is invalid.', 'danger')
+            return redirect(url_for('cell_storage.cryovial_inventory'))
         log_audit(current_user.id, 'CREATE_CRYOVIAL', target_type='CryoVial', target_id=vial.id, details=f'box {box.id} R{row}C{col}')
         flash('Vial added.', 'success')
         return redirect(url_for('cell_storage.cryovial_inventory'))
@@ -1270,16 +1128,11 @@ def backup_database():
     db.session.commit()
     uri = current_app.config['SQLALCHEMY_DATABASE_URI']
     scheme = urlparse(uri).scheme
-    rds_identifier = os.environ.get('AWS_RDS_INSTANCE_IDENTIFIER')
+    rds_identifier = RDSBackupService.instance_identifier()
 
     if rds_identifier:
         try:
-            client = boto3.client('rds', region_name=os.environ.get('AWS_REGION'))
-            snapshot_id = f"{rds_identifier}-snapshot-{datetime.utcnow().strftime('%Y%m%d%H%M%S')}"
-            client.create_db_snapshot(
-                DBInstanceIdentifier=rds_identifier,
-                DBSnapshotIdentifier=snapshot_id,
-            )
+            snapshot_id = RDSBackupService.create_snapshot(rds_identifier)
             log_audit(
                 current_user.id,
                 'BACKUP_EXPORT',
@@ -1287,7 +1140,7 @@ def backup_database():
                 details=f'RDS snapshot {snapshot_id}',
             )
             flash('RDS snapshot initiated.', 'success')
-        except (BotoCoreError, ClientError) as exc:
+        except BackupError as exc:
             current_app.logger.error('RDS snapshot failed: %s', exc)
             flash('RDS backup failed.', 'danger')
         return redirect(url_for('cell_storage.index'))
@@ -1323,7 +1176,7 @@ def backup_database():
 @admin_required
 def restore_database():
     form = RestoreForm()
-    rds_identifier = os.environ.get('AWS_RDS_INSTANCE_IDENTIFIER')
+    rds_identifier = RDSBackupService.instance_identifier()
     rds_configured = bool(rds_identifier)
 
     if form.validate_on_submit():
@@ -1336,11 +1189,7 @@ def restore_database():
                 return redirect(url_for('cell_storage.restore_database'))
 
             try:
-                client = boto3.client('rds', region_name=os.environ.get('AWS_REGION'))
-                client.restore_db_instance_from_db_snapshot(
-                    DBInstanceIdentifier=rds_identifier,
-                    DBSnapshotIdentifier=snapshot_id,
-                )
+                RDSBackupService.restore_snapshot(rds_identifier, snapshot_id)
                 log_audit(
                     current_user.id,
                     'BACKUP_IMPORT',
@@ -1354,7 +1203,7 @@ def restore_database():
                     ),
                     'success',
                 )
-            except (BotoCoreError, ClientError) as exc:
+            except BackupError as exc:
                 current_app.logger.error('RDS restore failed: %s', exc)
                 flash(f'RDS restore failed: {exc}', 'danger')
             return redirect(url_for('cell_storage.index'))
@@ -1416,30 +1265,35 @@ def batch_edit_vials():
             flash('No valid vial tags provided.', 'danger')
             return render_template('main/batch_edit_vials.html', form=form, title='Batch Edit Vials')
 
-        vials = CryoVial.query.filter(CryoVial.unique_vial_id_tag.in_(tags)).all()
-        found_tags = {v.unique_vial_id_tag for v in vials}
+        found = db.session.query(CryoVial.id, CryoVial.unique_vial_id_tag)\
+            .filter(CryoVial.unique_vial_id_tag.in_(tags)).all()
+        found_tags = {row.unique_vial_id_tag for row in found}
         missing = [t for t in tags if t not in found_tags]
 
-        for v in vials:
-            if form.new_status.data:
-                v.status = form.new_status.data
-            if form.notes.data:
-                v.notes = (v.notes + '\n' if v.notes else '') + form.notes.data
-            v.last_updated = datetime.utcnow()
-        db.session.commit()
-        log_audit(
-            current_user.id,
-            'BATCH_EDIT_VIALS',
-            target_type='CryoVial',
-            details={
-                'vial_tags': tags,
-                'updated_status': form.new_status.data or None,
-                'notes_appended': bool(form.notes.data),
-                'missing_tags': missing,
-            },
-        )
+        values = {}
+        if form.new_status.data:
+            values['status'] = form.new_status.data
+        if form.notes.data:
+            values['notes'] = VialMutationService.append_notes_expr(form.notes.data)
+        try:
+            previous = VialMutationService.update_vials([row.id for row in found], values)
+            log_audit(
+                current_user.id,
+                'BATCH_EDIT_VIALS',
+                target_type='CryoVial',
+                details={
+                    'vial_tags': tags,
+                    'updated_status': form.new_status.data or None,
+                    'notes_appended': bool(form.notes.data),
+                    'missing_tags': missing,
+                },
+            )
+        except IntegrityError:
+            db.session.rollback()
+            flash('Some of these vials share a position with another available vial; no changes were made.', 'danger')
+            return render_template('main/batch_edit_vials.html', form=form, title='Batch Edit Vials')
 
-        flash(f'Updated {len(vials)} vial(s).', 'success')
+        flash(f'Updated {len(previous)} vial(s).', 'success')
         if missing:
             flash(f'Missing tags: {", ".join(missing)}', 'warning')
         return redirect(url_for('cell_storage.batch_edit_vials'))
@@ -1447,6 +1301,21 @@ def batch_edit_vials():
     return render_template('main/batch_edit_vials.html', form=form, title='Batch Edit Vials')
 
 
+def batch_form_values(form):
+    """Common vial attributes from an ``EditBatchForm``, as bulk UPDATE values."""
+    return {
+        'cell_line_id': form.cell_line_id.data,
+        'passage_number': form.passage_number.data,
+        'date_frozen': form.date_frozen.data,
+        'volume_ml': form.volume_ml.data,
+        'concentration': form.concentration.data,
+        'fluorescence_tag': form.fluorescence_tag.data,
+        'resistance': ','.join(form.resistance.data) if form.resistance.data else None,
+        'parental_cell_line': form.parental_cell_line.data,
+        'notes': form.notes.data,
+    }
+
+
 @bp.route('/batch/<int:batch_id>/edit', methods=['GET', 'POST'])
 @login_required
 @admin_required
@@ -1455,7 +1324,7 @@ def edit_batch(batch_id):
     batch = VialBatch.query.get_or_404(batch_id)
     vials = batch.vials.all()
     form = EditBatchForm(obj=batch)
-    form.cell_line_id.choices = [(c.id, c.name) for c in CellLine.query.order_by(CellLine.name).all()]
+    form.cell_line_id.choices = cell_line_choices()
 
     if request.method == 'GET' and vials:
         sample = vials[0]
@@ -1471,24 +1340,13 @@ def edit_batch(batch_id):
 
     if form.validate_on_submit():
         batch.name = form.batch_name.data
-        for v in vials:
-            v.cell_line_id = form.cell_line_id.data
-            v.passage_number = form.passage_number.data
-            v.date_frozen = form.date_frozen.data
-            v.volume_ml = form.volume_ml.data
-            v.concentration = form.concentration.data
-            v.fluorescence_tag = form.fluorescence_tag.data
-            v.resistance = ','.join(form.resistance.data) if form.resistance.data else None
-            v.parental_cell_line = form.parental_cell_line.data
-            v.notes = form.notes.data
-            v.last_updated = datetime.utcnow()
-        db.session.commit()
+        vial_count = VialMutationService.update_batch_vials(batch.id, batch_form_values(form))
         log_audit(
             current_user.id,
             'EDIT_BATCH_INFO',
             target_type='VialBatch',
             target_id=batch.id,
-            details={'vial_count': len(vials)},
+            details={'vial_count': vial_count},
         )
         flash('Batch updated successfully.', 'success')
         return redirect(url_for('cell_storage.inventory_summary'))
@@ -1510,6 +1368,15 @@ def manage_batch_lookup():
 @admin_required
 def manage_batch(batch_id):
     batch = VialBatch.query.get_or_404(batch_id)
+
+    if request.method == 'POST' and 'delete_batch' in request.form:
+        vial_ids = [vial_id for (vial_id,) in db.session.query(CryoVial.id).filter_by(batch_id=batch_id).all()]
+        summary = VialMutationService.delete_vials(vial_ids, batch_ids=[batch_id])
+        log_audit(current_user.id, 'DELETE_BATCH', target_type='VialBatch', target_id=batch_id,
+                  details={'vial_count': len(summary['deleted_ids']), 'vial_tags': summary['vial_tags']})
+        flash(f'Batch {batch_id} deleted.', 'success')
+        return redirect(url_for('cell_storage.manage_batch_lookup'))
+
     vials = batch.vials.order_by(CryoVial.id).all()
     boxes = {}
     for v in vials:
@@ -1526,7 +1393,7 @@ def manage_batch(batch_id):
         b['cells'][(v.row_in_box, v.col_in_box)] = v
 
     form = EditBatchForm()
-    form.cell_line_id.choices = [(c.id, c.name) for c in CellLine.query.order_by(CellLine.name).all()]
+    form.cell_line_id.choices = cell_line_choices()
 
     if request.method == 'GET':
         form.batch_name.data = batch.name
@@ -1544,31 +1411,10 @@ def manage_batch(batch_id):
 
     if form.validate_on_submit() and 'submit' in request.form:
         batch.name = form.batch_name.data
-        for v in vials:
-            v.cell_line_id = form.cell_line_id.data
-            v.passage_number = form.passage_number.data
-            v.date_frozen = form.date_frozen.data
-            v.volume_ml = form.volume_ml.data
-            v.concentration = form.concentration.data
-            v.fluorescence_tag = form.fluorescence_tag.data
-            v.resistance = ','.join(form.resistance.data) if form.resistance.data else None
-            v.parental_cell_line = form.parental_cell_line.data
-            v.notes = form.notes.data
-            v.last_updated = datetime.utcnow()
-        db.session.commit()
-        log_audit(current_user.id, 'EDIT_BATCH_INFO', target_type='VialBatch', target_id=batch.id, details={'vial_count': len(vials)})
+        vial_count = VialMutationService.update_batch_vials(batch.id, batch_form_values(form))
+        log_audit(current_user.id, 'EDIT_BATCH_INFO', target_type='VialBatch', target_id=batch.id, details={'vial_count': vial_count})
         flash('Batch updated successfully.', 'success')
-        return redirect(get_smart_redirect_url('main.manage_batch', batch_id=batch.id))
-
-    if request.method == 'POST' and 'delete_batch' in request.form:
-        count = len(vials)
-        for v in vials:
-            db.session.delete(v)
-        db.session.delete(batch)
-        db.session.commit()
-        log_audit(current_user.id, 'DELETE_BATCH', target_type='VialBatch', target_id=batch_id, details={'vial_count': count})
-        flash(f'Batch {batch_id} deleted.', 'success')
-        return redirect(url_for('cell_storage.manage_batch_lookup'))
+        return redirect(get_smart_redirect_url('cell_storage.manage_batch', batch_id=batch.id))
 
     return render_template('main/manage_batch.html', form=form, batch=batch, boxes=boxes, title='Manage Batch')
 
@@ -1589,117 +1435,7 @@ def inventory_summary():
     if current_user.is_admin:
         query = query.join(Box).join(Drawer).join(Tower)
 
-    if search_q:
-        like = f"%{search_q}%"
-        query = query.filter(
-            CryoVial.unique_vial_id_tag.ilike(like) |
-            VialBatch.name.ilike(like) |
-            CellLine.name.ilike(like)
-        )
-    if search_status:
-        query = query.filter(CryoVial.status == search_status)
-
-    # 计算总体统计数据（不受搜索筛选影响）
-    total_stats = {}
-    status_counts = db.session.query(
-        CryoVial.status, 
-        db.func.count(CryoVial.id)
-    ).group_by(CryoVial.status).all()
-    
-    total_stats = {
-        'total': sum(count for _, count in status_counts),
-        'available': 0,
-        'used': 0,
-        'depleted': 0,
-        'discarded': 0
-    }
-    
-    for status, count in status_counts:
-        if status == 'Available':
-            total_stats['available'] = count
-        elif status == 'Used':
-            total_stats['used'] = count
-        elif status == 'Depleted':
-            total_stats['depleted'] = count
-        elif status == 'Discarded':
-            total_stats['discarded'] = count
-
-    # 批次统计
-    batch_stats = {
-        'total_batches': VialBatch.query.count()
-    }
-
-    # 库存量低于2的库存记录
-    low_stock_records = db.session.query(
-        CellLine.name.label('cell_line_name'),
-        VialBatch.name.label('batch_name'),
-        VialBatch.id.label('batch_id'),
-        db.func.count(CryoVial.id).label('available_count')
-    ).join(CryoVial, CryoVial.cell_line_id == CellLine.id)\
-     .join(VialBatch, CryoVial.batch_id == VialBatch.id)\
-     .filter(CryoVial.status == 'Available')\
-     .group_by(CellLine.name, VialBatch.name, VialBatch.id)\
-     .having(db.func.count(CryoVial.id) < 2)\
-     .order_by(db.func.count(CryoVial.id).asc(), CellLine.name.asc())\
-     .all()
-    
-    low_stock_stats = {
-        'total_cell_lines': CellLine.query.count(),
-        'low_stock_records': [
-            {
-                'cell_line_name': record.cell_line_name,
-                'batch_name': record.batch_name,
-                'batch_id': record.batch_id,
-                'available_count': record.available_count
-            } for record in low_stock_records
-        ]
-    }
-
-    # 先获取批次分页，然后获取对应的冻存管
-    batch_query = db.session.query(VialBatch.id).distinct()
-    if search_q:
-        like = f"%{search_q}%"
-        batch_query = batch_query.join(CryoVial).join(CellLine).filter(
-            CryoVial.unique_vial_id_tag.ilike(like) |
-            VialBatch.name.ilike(like) |
-            CellLine.name.ilike(like)
-        )
-    if search_status:
-        batch_query = batch_query.join(CryoVial).filter(CryoVial.status == search_status)
-    
-    batch_pagination = batch_query.order_by(VialBatch.id).paginate(
-        page=page, per_page=per_page, error_out=False
-    )
-    
-    batch_ids = [b.id for b in batch_pagination.items]
-    
-    if batch_ids:
-        vials = query.filter(VialBatch.id.in_(batch_ids)).order_by(VialBatch.id, CryoVial.unique_vial_id_tag).all()
-    else:
-        vials = []
-    
-    statuses = ['Available', 'Used', 'Depleted', 'Discarded']
-
-    # Manual grouping
-    grouped_vials_dict = {}
-    for vial in vials:
-        if vial.batch.id not in grouped_vials_dict:
-            grouped_vials_dict[vial.batch.id] = {
-                'batch_obj': vial.batch,
-                'cell_line_name': vial.cell_line_info.name,
-                'passage_number': vial.passage_number,
-                'date_frozen': vial.date_frozen,
-                'vials': [],
-                'total_count': 0,
-                'status_counts': {status: 0 for status in statuses}
-            }
-        grouped_vials_dict[vial.batch.id]['vials'].append(vial)
-        grouped_vials_dict[vial.batch.id]['total_count'] += 1
-        if vial.status in grouped_vials_dict[vial.batch.id]['status_counts']:
-            grouped_vials_dict[vial.batch.id]['status_counts'][vial.status] += 1
-    
-    # 按batch_ids的顺序排列
-    grouped_vials = [grouped_vials_dict[bid] for bid in batch_ids if bid in grouped_vials_dict]
+    query = InventoryAnalyticsService.filter_vials(query, search_q, search_status)
 
     if request.args.get('export') == 'csv':
         # CSV导出逻辑保持不变，但要获取所有数据而不是分页数据
@@ -1736,7 +1472,7 @@ def inventory_summary():
                 location = (
                     f"{v.box_location.drawer_info.tower_info.name}/"
                     f"{v.box_location.drawer_info.name}/"
-                    f"{v.box_location.name} R{vial.row_in_box}C{vial.col_in_box}"
+                    f"{v.box_location.name} R{v.row_in_box}C{v.col_in_box}"
                 )
                 row_data.append(location)
             
@@ -1756,6 +1492,28 @@ def inventory_summary():
             headers={'Content-Disposition': 'attachment;filename=inventory_summary.csv'},
         )
 
+    # 计算总体统计数据（不受搜索筛选影响）
+    global_stats = stats_cache.get_or_compute('cell_storage.summary_stats', InventoryAnalyticsService.global_stats)
+    total_stats = global_stats['total_stats']
+
+    # 批次统计
+    batch_stats = {
+        'total_batches': global_stats['total_batches']
+    }
+
+    # 库存量低于2的库存记录
+    low_stock_stats = {
+        'total_cell_lines': global_stats['total_cell_lines'],
+        'low_stock_records': global_stats['low_stock_records']
+    }
+
+    statuses = VIAL_STATUSES
+
+    # 批次分页及每批次状态计数在SQL中聚合完成，冻存管列表在展开时再加载
+    batch_pagination, grouped_vials = InventoryAnalyticsService.batch_summary_page(
+        search_q, search_status, page=page, per_page=per_page
+    )
+
     return render_template(
         'main/inventory_summary.html',
         title='Analytics Dashboard',
@@ -1769,6 +1527,21 @@ def inventory_summary():
         low_stock_stats=low_stock_stats,
     )
 
+@bp.route('/inventory/summary/batch/<int:batch_id>/vials')
+@login_required
+@admin_required
+def inventory_summary_batch_vials(batch_id):
+    """Vial rows of one batch, loaded when the batch is expanded on the summary page."""
+    search_q = request.args.get('q', '').strip()
+    search_status = request.args.get('status', '').strip()
+    vials = InventoryAnalyticsService.batch_vials(batch_id, search_q, search_status)
+    return render_template(
+        'main/partials/summary_batch_vials.html',
+        vials=vials,
+        batch_id=batch_id,
+        next_url=request.referrer or url_for('cell_storage.inventory_summary'),
+    )
+
 @bp.route('/admin/import_csv', methods=['GET', 'POST'])
 @login_required
 @admin_required
@@ -2045,6 +1818,8 @@ def import_csv():
                         updated_count += 1
 
                 db.session.commit()
+                metrics.inc('cellstorage_imports_total', kind='cryovial_csv', outcome='success')
+                metrics.inc('cellstorage_import_rows_total', created_count + updated_count, kind='cryovial_csv')
                 
                 message_parts = []
                 if updated_count > 0:
@@ -2070,6 +1845,7 @@ def import_csv():
 
             except Exception as e:
                 db.session.rollback()
+                metrics.inc('cellstorage_imports_total', kind='cryovial_csv', outcome='error')
                 current_app.logger.error(f'CSV import error: {e}')
                 flash(f'An unexpected error occurred during import: {e}', 'danger')
 
@@ -2098,77 +1874,58 @@ def vial_test(vial_id):
 @login_required
 def vial_details(vial_id):
     try:
-        current_app.logger.info(f'Fetching vial details for ID {vial_id} by user {current_user.username}')
-        
-        vial = db.session.query(
-            CryoVial
-        ).options(
-            joinedload(CryoVial.cell_line_info),
-            joinedload(CryoVial.batch),
-            joinedload(CryoVial.freezer_operator),
-            joinedload(CryoVial.box_location).joinedload(Box.drawer_info).joinedload(Drawer.tower_info)
-        ).get(vial_id)
-
-        if not vial:
-            current_app.logger.warning(f'Vial not found for ID {vial_id}')
+        versions = VialDetailsService.versions([vial_id])
+        if not versions:
             return jsonify({"error": "Vial not found"}), 404
-        
-        current_app.logger.debug(f'Found vial: {vial.unique_vial_id_tag} (ID: {vial.id})')
+        etag = VialDetailsService.etag(versions, current_user.is_admin)
+        if request.if_none_match.contains(etag):
+            return _not_modified(etag)
 
-        # 安全地获取相关信息，防止None值导致的AttributeError
-        try:
-            cell_line_name = vial.cell_line_info.name if vial.cell_line_info else "Unknown"
-            current_app.logger.debug(f'Cell line name: {cell_line_name}')
-        except AttributeError as e:
-            current_app.logger.warning(f'Error getting cell line name: {e}')
-            cell_line_name = "Unknown"
-            
-        try:
-            batch_name = vial.batch.name if vial.batch else "Unknown"
-            current_app.logger.debug(f'Batch name: {batch_name}')
-        except AttributeError as e:
-            current_app.logger.warning(f'Error getting batch name: {e}')
-            batch_name = "Unknown"
-            
-        try:
-            frozen_by = vial.freezer_operator.username if vial.freezer_operator else "Unknown"
-            current_app.logger.debug(f'Frozen by: {frozen_by}')
-        except AttributeError as e:
-            current_app.logger.warning(f'Error getting frozen by: {e}')
-            frozen_by = "Unknown"
-            
-        try:
-            if vial.box_location and vial.box_location.drawer_info and vial.box_location.drawer_info.tower_info:
-                location = f"{vial.box_location.drawer_info.tower_info.name}/{vial.box_location.drawer_info.name}/{vial.box_location.name} (R{vial.row_in_box}C{vial.col_in_box})"
-            else:
-                location = "Location not available"
-            current_app.logger.debug(f'Location: {location}')
-        except AttributeError as e:
-            current_app.logger.warning(f'Error getting location: {e}')
-            location = "Location not available"
-
-        response_data = {
-            "id": vial.id,
-            "unique_vial_id_tag": vial.unique_vial_id_tag or "Unknown",
-            "cell_line": cell_line_name,
-            "batch_name": batch_name,
-            "passage_number": vial.passage_number or "N/A",
-            "date_frozen": vial.date_frozen.strftime('%Y-%m-%d') if vial.date_frozen else "N/A",
-            "frozen_by": frozen_by,
-            "status": vial.status or "Unknown",
-            "notes": vial.notes or "No notes available",
-            "location": location,
-            "is_admin": current_user.is_admin  # 添加用户权限信息
-        }
-        
-        current_app.logger.info(f'Successfully fetched vial details for ID {vial_id}')
-        return jsonify(response_data)
+        vial = VialDetailsService.load([vial_id])[0]
+        return _revalidated(jsonify(VialDetailsService.to_dict(vial, current_user.is_admin)), etag)
     except Exception as e:
         current_app.logger.error(f'Error fetching vial details for ID {vial_id}: {e}')
-        current_app.logger.error(f'Error details: {str(e)}')
         return jsonify({"error": "Unable to fetch vial details. Please try again later."}), 500
 
 
+@bp.route('/api/vials/details')
+@login_required
+def api_vial_details():
+    """批量获取冻存管详情, ids 为紧凑区间字符串 (如 ``1-81,90``)
+
+    返回 ``{"vials": {id: {...}}, "missing": [...]}``。ETag 由这些冻存管及其批次、冻存盒的
+    更新时间和所显示的名称计算, If-None-Match 命中时直接返回 304, 不加载详情。
+    """
+    try:
+        vial_ids = decode_id_ranges(request.args.get('ids', ''), limit=MAX_DETAILS_BATCH)
+    except ValueError as e:
+        return jsonify({"error": f"Invalid ids: {e}"}), 400
+    if not vial_ids:
+        return jsonify({"error": "No vial ids given"}), 400
+
+    versions = VialDetailsService.versions(vial_ids)
+    etag = VialDetailsService.etag(versions, current_user.is_admin)
+    if request.if_none_match.contains(etag):
+        return _not_modified(etag)
+
+    vials = VialDetailsService.load(list(versions))
+    return _revalidated(jsonify({
+        "vials": {str(vial.id): VialDetailsService.to_dict(vial, current_user.is_admin) for vial in vials},
+        "missing": sorted(set(vial_ids) - set(versions)),
+    }), etag)
+
+
+def _revalidated(response, etag):
+    # 浏览器可缓存, 但每次使用前都用 If-None-Match 重新验证
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def _not_modified(etag):
+    return _revalidated(current_app.response_class(status=304), etag)
+
+
 @bp.route('/vial/<int:vial_id>/delete', methods=['POST'])
 @login_required 
 @admin_required
@@ -2219,36 +1976,32 @@ def batch_delete_vials():
         if not vial_ids:
             return jsonify({"success": False, "error": "No vial IDs provided"}), 400
         
-        # 获取要删除的vials
-        vials = CryoVial.query.filter(CryoVial.id.in_(vial_ids)).all()
-        
-        if not vials:
+        try:
+            vial_ids = [int(vial_id) for vial_id in vial_ids]
+        except (TypeError, ValueError):
+            return jsonify({"success": False, "error": "Invalid vial IDs"}), 400
+
+        # 批量删除 vials，并在同一事务中删除已无 vial 的批次
+        summary = VialMutationService.delete_vials(vial_ids)
+        if not summary['deleted_ids']:
+            db.session.rollback()
             return jsonify({"success": False, "error": "No vials found"}), 404
-        
-        deleted_count = 0
-        vial_info_list = []
-        
-        for vial in vials:
-            vial_info = f"Vial {vial.unique_vial_id_tag} (Batch: {vial.batch.name if vial.batch else 'Unknown'})"
-            vial_info_list.append(vial_info)
-            
-            # 删除vial
-            db.session.delete(vial)
-            deleted_count += 1
-        
-        # 记录批量删除的总体日志
+        deleted_count = len(summary['deleted_ids'])
+
+        # 记录批量删除的总体日志（log_audit 一并提交删除操作）
         readable_details = create_audit_log(
             user_id=current_user.id,
             action='BATCH_DELETE',
             target_type='Batch',
             target_id=None,
-            vial_ids=vial_ids,
-            count=deleted_count
+            vial_ids=summary['deleted_ids'],
+            count=deleted_count,
+            vial_tags=summary['vial_tags'],
+            batch_names=summary['batch_names'],
+            deleted_batch_ids=summary['deleted_batch_ids']
         )
         log_audit(current_user.id, 'BATCH_DELETE', target_type='Batch', target_id=None, details=readable_details)
         
-        db.session.commit()
-        
         return jsonify({
             "success": True, 
             "deleted_count": deleted_count,
@@ -2524,89 +2277,29 @@ def add_search_history():
 @bp.route('/api/search/advanced')
 @login_required
 def advanced_search_api():
-    """高级搜索API"""
-    # 搜索参数
-    query = request.args.get('q', '').strip()
-    cell_line_id = request.args.get('cell_line_id', type=int)
-    status = request.args.get('status', '')
-    date_from = request.args.get('date_from', '')
-    date_to = request.args.get('date_to', '')
-    creator_id = request.args.get('creator_id', type=int)
-    fluorescence = request.args.get('fluorescence', '')
-    resistance = request.args.get('resistance', '')
-    batch_id = request.args.get('batch_id', type=int)
-    location_type = request.args.get('location_type', '')  # tower, drawer, box
-    location_id = request.args.get('location_id', type=int)
-    
-    # 基础查询
-    vial_query = CryoVial.query.join(VialBatch).join(CellLine)
-    
-    # 添加用户权限相关的表
-    vial_query = vial_query.join(User, VialBatch.created_by_user_id == User.id)
-    
-    # 添加位置相关的表
-    if current_user.is_admin:
-        vial_query = vial_query.join(Box).join(Drawer).join(Tower)
-    
-    # 应用搜索条件
-    if query:
-        like_pattern = f'%{query}%'
-        vial_query = vial_query.filter(
-            (CryoVial.unique_vial_id_tag.ilike(like_pattern)) |
-            (VialBatch.name.ilike(like_pattern)) |
-            (CellLine.name.ilike(like_pattern)) |
-            (CryoVial.fluorescence_tag.ilike(like_pattern)) |
-            (CryoVial.resistance.ilike(like_pattern)) |
-            (CryoVial.notes.ilike(like_pattern))
-        )
-    
-    if cell_line_id:
-        vial_query = vial_query.filter(CryoVial.cell_line_id == cell_line_id)
-    
-    if status:
-        vial_query = vial_query.filter(CryoVial.status == status)
-    
-    if date_from:
-        try:
-            from_date = datetime.strptime(date_from, '%Y-%m-%d').date()
-            vial_query = vial_query.filter(CryoVial.date_frozen >= from_date)
-        except ValueError:
-            pass
-    
-    if date_to:
-        try:
-            to_date = datetime.strptime(date_to, '%Y-%m-%d').date()
-            vial_query = vial_query.filter(CryoVial.date_frozen <= to_date)
-        except ValueError:
-            pass
-    
-    if creator_id:
-        vial_query = vial_query.filter(VialBatch.created_by_user_id == creator_id)
-    
-    if fluorescence:
-        vial_query = vial_query.filter(CryoVial.fluorescence_tag.ilike(f'%{fluorescence}%'))
-    
-    if resistance:
-        vial_query = vial_query.filter(CryoVial.resistance.ilike(f'%{resistance}%'))
-    
-    if batch_id:
-        vial_query = vial_query.filter(CryoVial.batch_id == batch_id)
-    
-    # 位置过滤
-    if current_user.is_admin and location_type and location_id:
-        if location_type == 'tower':
-            vial_query = vial_query.filter(Tower.id == location_id)
-        elif location_type == 'drawer':
-            vial_query = vial_query.filter(Drawer.id == location_id)
-        elif location_type == 'box':
-            vial_query = vial_query.filter(Box.id == location_id)
-    
+    """高级搜索API
+
+    除当前页结果外还返回按状态、细胞系、创建者（管理员另有冻存塔）的分面计数。
+    分页总数与结果实时计算；分面计数在一条语句中算出，并按规范化后的搜索条件
+    短时缓存 (SEARCH_FACET_CACHE_TTL)，因此可能比结果滞后几十秒。
+    """
+    params = FacetService.search_params(request.args)
+    with_location = current_user.is_admin
+    conditions = FacetService.search_conditions(params, with_location)
+
+    vial_query = FacetService.joined(CryoVial.query).filter(*conditions).options(
+        contains_eager(CryoVial.batch),
+        contains_eager(CryoVial.cell_line_info),
+        contains_eager(CryoVial.box_location).contains_eager(Box.drawer_info).contains_eager(Drawer.tower_info),
+    )
+
     # 执行查询并分页
     page = request.args.get('page', 1, type=int)
     per_page = min(request.args.get('per_page', 50, type=int), 100)
-    
+
     vials_pagination = vial_query.order_by(VialBatch.id, CryoVial.unique_vial_id_tag)\
                                 .paginate(page=page, per_page=per_page, error_out=False)
+    facets = FacetService.search_facets(params, with_location)
     
     # 格式化结果
     results = []
@@ -2639,6 +2332,7 @@ def advanced_search_api():
     
     return jsonify({
         'results': results,
+        'facets': facets,
         'pagination': {
             'page': vials_pagination.page,
             'pages': vials_pagination.pages,
@@ -2654,6 +2348,50 @@ def advanced_search_api():
 # 批量操作相关API
 # =============================================================================
 
+@bp.route('/api/selections/pickup', methods=['GET', 'POST'])
+@login_required
+def api_pickup_selection():
+    """读取或增量修改服务器端拾取列表
+
+    POST 体为 ``{"add": "1-20,31", "remove": "5"}``，id 以紧凑区间字符串（或整数列表）传递，
+    请求大小与已选数量无关。
+    """
+    if request.method == 'GET':
+        selected_ids = SelectionService.get_ids('pickup')
+        return jsonify({'success': True, 'count': len(selected_ids), 'ids': encode_id_ranges(selected_ids)})
+
+    data = request.get_json() or {}
+    try:
+        delta = {}
+        for key in ('add', 'remove'):
+            value = data.get(key) or ''
+            if isinstance(value, list):
+                value = ','.join(str(int(vial_id)) for vial_id in value)
+            delta[key] = decode_id_ranges(value, limit=MAX_SELECTION_SIZE)
+    except (TypeError, ValueError) as e:
+        return jsonify({'success': False, 'message': f'Invalid id ranges: {e}'}), 400
+
+    # 只允许加入实际存在且可用的冻存管
+    add_ids = []
+    for chunk in chunked(delta['add']):
+        add_ids.extend(
+            vial_id for (vial_id,) in db.session.query(CryoVial.id)
+            .filter(CryoVial.id.in_(chunk), CryoVial.status == 'Available')
+            .all()
+        )
+    projected = (set(SelectionService.get_ids('pickup')) | set(add_ids)) - set(delta['remove'])
+    if len(projected) > MAX_SELECTION_SIZE:
+        return jsonify({'success': False, 'message': f'Selection is limited to {MAX_SELECTION_SIZE} vials.'}), 400
+    added, removed, selected_ids = SelectionService.apply_delta('pickup', add=add_ids, remove=delta['remove'])
+    return jsonify({
+        'success': True,
+        'added': added,
+        'removed': removed,
+        'count': len(selected_ids),
+        'ids': encode_id_ranges(selected_ids),
+    })
+
+
 @bp.route('/api/vials/batch-update-status', methods=['POST'])
 @login_required
 @admin_required
@@ -2676,40 +2414,26 @@ def batch_update_vials_status():
                 'message': 'Invalid status value.'
             }), 400
         
-        # 查询要更新的冻存管
-        vials = CryoVial.query.filter(CryoVial.id.in_(vial_ids)).all()
-        
-        if not vials:
+        try:
+            vial_ids = [int(vial_id) for vial_id in vial_ids]
+        except (TypeError, ValueError):
+            return jsonify({
+                'success': False,
+                'message': 'Invalid vial IDs.'
+            }), 400
+
+        # 单条 UPDATE（按块执行）并写入一条汇总审计日志
+        summary = VialMutationService.update_status(
+            vial_ids, new_status, current_user.id,
+            details={'batch_operation': True},
+        )
+        if not summary['updated_ids']:
             return jsonify({
                 'success': False,
                 'message': 'No vials found with the provided IDs.'
             }), 404
-        
-        # 记录更新前的状态
-        old_statuses = {vial.id: vial.status for vial in vials}
-        
-        # 批量更新状态
-        updated_count = 0
-        for vial in vials:
-            old_status = vial.status
-            vial.status = new_status
-            updated_count += 1
-            
-            # 记录审计日志
-            log_audit(
-                user_id=current_user.id,
-                action='UPDATE_VIAL_STATUS',
-                target_type='CryoVial',
-                target_id=vial.id,
-                details={
-                    'old_status': old_status,
-                    'new_status': new_status,
-                    'vial_tag': vial.unique_vial_id_tag,
-                    'batch_operation': True
-                }
-            )
-        
-        db.session.commit()
+
+        updated_count = len(summary['updated_ids'])
         
         return jsonify({
             'success': True,
@@ -2717,6 +2441,12 @@ def batch_update_vials_status():
             'updated_count': updated_count
         })
         
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({
+            'success': False,
+            'message': 'Some of these positions are already occupied by another available vial.'
+        }), 409
     except Exception as e:
         db.session.rollback()
         current_app.logger.error(f'Error in batch status update: {e}')
@@ -102,6 +102,7 @@ class Box(db.Model):
     rows = db.Column(db.Integer, default=9)  # e.g., 9 for a 9x9 box
     columns = db.Column(db.Integer, default=9)  # e.g., 9 for a 9x9 box
     description = db.Column(db.Text)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
 
     cryovials = db.relationship('CryoVial', backref='box_location', lazy='dynamic')
 
@@ -118,12 +119,16 @@ class VialBatch(db.Model):
     name = db.Column(db.String(128), nullable=False)
     created_by_user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
 
     vials = db.relationship('CryoVial', backref='batch', lazy='dynamic')
 
     def __repr__(self):
         return f'<VialBatch {self.id}: {self.name}>'
 
+OCCUPIED_SLOT_INDEX = 'uq_cryovials_occupied_slot'
+
+
 class CryoVial(db.Model):
     __tablename__ = 'cryovials'
     id = db.Column(db.Integer, primary_key=True)
@@ -151,18 +156,18 @@ class CryoVial(db.Model):
     notes = db.Column(db.Text)
 
     date_created = db.Column(db.DateTime, default=datetime.utcnow)
-    last_updated = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
-
-    # REMOVE or COMMENT OUT the existing UniqueConstraint for position
-    # __table_args__ = (db.UniqueConstraint('box_id', 'row_in_box', 'col_in_box', name='_box_position_uc'),)
-
-    # If you have other table arguments, keep them, just remove the specific UniqueConstraint.
-    # If this was the only one, you can remove the line entirely.
-    # For example, if you wanted to keep other constraints (though we don't have them here for CryoVial yet):
-    # __table_args__ = (
-    #     # Other constraints here,
-    # )
-    # Or simply remove the line if it was the only one.
+    last_updated = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
+
+    # A slot may hold many used/discarded vials but only one Available vial.
+    # The partial index is created for existing databases by schema migration 1 (flask migrate-db).
+    __table_args__ = (
+        db.Index(
+            OCCUPIED_SLOT_INDEX, 'box_id', 'row_in_box', 'col_in_box',
+            unique=True,
+            sqlite_where=db.text("status = 'Available'"),
+            postgresql_where=db.text("status = 'Available'"),
+        ),
+    )
 
     def __repr__(self):
         return f'<CryoVial {self.unique_vial_id_tag} batch={self.batch_id}>'
@@ -182,6 +187,37 @@ class AuditLog(db.Model):
         return f'<AuditLog {self.action} by User ID {self.user_id} at {self.timestamp}>'
 
 
+class SelectionSet(db.Model):
+    """Server-side vial selection (or pending placement) referenced from the session by token."""
+    __tablename__ = 'selection_sets'
+    id = db.Column(db.Integer, primary_key=True)
+    token = db.Column(db.String(64), unique=True, index=True, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    kind = db.Column(db.String(32), nullable=False)  # e.g. 'pickup', 'placement'
+    id_ranges = db.Column(db.Text, default='')  # Compact id ranges, e.g. "1-40,52,60-61"
+    payload = db.Column(db.Text)  # JSON data that is not an id list
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, index=True, nullable=False)
+
+    def __repr__(self):
+        return f'<SelectionSet {self.kind} user={self.user_id}>'
+
+
+class ChangeLogEntry(db.Model):
+    """Committed change of a tracked record, read in (xid, id) order (see app/shared/change_feed.py)."""
+    __tablename__ = 'change_log'
+    __table_args__ = (db.Index('ix_change_log_xid_id', 'xid', 'id'),)
+    id = db.Column(db.Integer, primary_key=True)
+    xid = db.Column(db.BigInteger, nullable=False, default=0)  # writing transaction on PostgreSQL, else 0
+    entity = db.Column(db.String(32), nullable=False)  # 'vial', 'batch', 'box', 'item' or 'all' (database cleared)
+    entity_id = db.Column(db.Integer, nullable=False)
+    op = db.Column(db.String(8), nullable=False)  # 'upsert', 'delete' or 'reset'
+    changed_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
+
+    def __repr__(self):
+        return f'<ChangeLogEntry {self.id} {self.op} {self.entity} {self.entity_id}>'
+
+
 class AppConfig(db.Model):
     """Simple key/value store for application-wide settings."""
     __tablename__ = 'app_config'
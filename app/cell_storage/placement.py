@@ -0,0 +1,234 @@
+"""
+Placement engine for freezing new vials.
+
+Plans are computed against an ``OccupancySnapshot``: the box list
+(pre-sorted by priority and cached until boxes, drawers or towers change)
+plus one ``GROUP BY box_id`` query for the occupied count of every box.
+Strategies choose boxes from the counts; the occupied slots are then loaded
+in one query for just the boxes that were chosen.
+
+Strategies are registered in ``STRATEGIES`` with ``@register_strategy``; the
+default is chosen with the ``PLACEMENT_STRATEGY`` config key.
+"""
+
+import re
+
+from sqlalchemy import func
+
+from .. import db
+from ..shared.stats_cache import stats_cache
+from .models import Box, Drawer, Tower, CryoVial
+
+DEFAULT_STRATEGY = 'first_fit'
+
+STRATEGIES = {}
+
+_NUMBER_RE = re.compile(r'\d+')
+
+stats_cache.register('cell_storage.box_layout', ttl=300, tables=('boxes', 'drawers', 'towers'), versioned=True)
+
+
+def register_strategy(name):
+    """Register ``func(snapshot, quantity) -> [(box, row, col), ...]`` as a strategy."""
+    def decorator(func):
+        STRATEGIES[name] = func
+        return func
+    return decorator
+
+
+def box_priority_key(name):
+    """Boxes numbered 1-5 first, then other numbered boxes, then unnumbered ones."""
+    numbers = _NUMBER_RE.findall(name or '')
+    if numbers:
+        first_num = int(numbers[0])
+        return (0, first_num, '') if 1 <= first_num <= 5 else (1, first_num, '')
+    return (2, 0, name or '')
+
+
+def load_box_layout():
+    """All boxes as plain dicts, sorted by priority (cached)."""
+    def compute():
+        rows = db.session.query(
+            Box.id, Box.name, Box.rows, Box.columns,
+            Drawer.id.label('drawer_id'), Drawer.name.label('drawer_name'),
+            Tower.name.label('tower_name'),
+        ).join(Drawer, Box.drawer_id == Drawer.id).join(Tower, Drawer.tower_id == Tower.id).all()
+        boxes = [
+            {
+                'id': row.id,
+                'name': row.name,
+                'rows': row.rows,
+                'columns': row.columns,
+                'drawer_id': row.drawer_id,
+                'drawer_name': row.drawer_name,
+                'tower_name': row.tower_name,
+            } for row in rows
+        ]
+        boxes.sort(key=lambda box: (box_priority_key(box['name']), box['id']))
+        return boxes
+    return stats_cache.get_or_compute('cell_storage.box_layout', compute)
+
+
+class OccupancySnapshot:
+    """Boxes in priority order, their occupied counts, and lazily loaded occupied slots."""
+
+    def __init__(self, boxes, counts, occupied=None):
+        self.boxes = boxes
+        self.counts = counts  # box_id -> occupied slots within the box's grid
+        self.occupied = occupied if occupied is not None else {}  # box_id -> {(row, col)}, loaded boxes only
+
+    @classmethod
+    def load(cls):
+        rows = db.session.query(CryoVial.box_id, func.count(CryoVial.id)).join(
+            Box, CryoVial.box_id == Box.id
+        ).filter(
+            CryoVial.status == 'Available',
+            CryoVial.row_in_box <= Box.rows,
+            CryoVial.col_in_box <= Box.columns,
+        ).group_by(CryoVial.box_id)
+        return cls(load_box_layout(), dict(rows.all()))
+
+    def load_slots(self, boxes):
+        """Load the occupied slots of ``boxes`` not loaded yet, in one query."""
+        box_ids = [box['id'] for box in boxes if box['id'] not in self.occupied]
+        if not box_ids:
+            return
+        for box_id in box_ids:
+            self.occupied[box_id] = set()
+        for box_id, row, col in db.session.query(
+                CryoVial.box_id, CryoVial.row_in_box, CryoVial.col_in_box
+        ).filter(CryoVial.status == 'Available', CryoVial.box_id.in_(box_ids)):
+            self.occupied[box_id].add((row, col))
+
+    def mark_occupied(self, box_id, row, col):
+        """Record a slot found taken after the snapshot was loaded."""
+        taken = self.occupied.get(box_id)
+        if taken is not None:
+            if (row, col) in taken:
+                return
+            taken.add((row, col))
+        self.counts[box_id] = self.counts.get(box_id, 0) + 1
+
+    def free_count(self, box):
+        return box['rows'] * box['columns'] - self.counts.get(box['id'], 0)
+
+    def free_slots(self, box, limit, exclude=()):
+        """Up to ``limit`` free ``(row, col)`` of ``box`` in row-major order."""
+        self.load_slots([box])
+        taken = self.occupied[box['id']]
+        slots = []
+        for r in range(1, box['rows'] + 1):
+            for c in range(1, box['columns'] + 1):
+                if (r, c) not in taken and (box['id'], r, c) not in exclude:
+                    slots.append((r, c))
+                    if len(slots) >= limit:
+                        return slots
+        return slots
+
+
+def _fill(snapshot, boxes, quantity):
+    """Fill ``boxes`` in order until ``quantity`` slots are found."""
+    chosen = []
+    free = 0
+    for box in boxes:
+        if free >= quantity:
+            break
+        if snapshot.free_count(box) > 0:
+            chosen.append(box)
+            free += snapshot.free_count(box)
+    snapshot.load_slots(chosen)
+    plan = []
+    for box in chosen:
+        remaining = quantity - len(plan)
+        if remaining <= 0:
+            break
+        plan.extend((box, r, c) for r, c in snapshot.free_slots(box, remaining))
+    return plan if len(plan) == quantity else []
+
+
+@register_strategy('first_fit')
+def first_fit(snapshot, quantity):
+    """First box (by priority) that holds the whole batch, else fill boxes in priority order."""
+    for box in snapshot.boxes:
+        if snapshot.free_count(box) >= quantity:
+            return [(box, r, c) for r, c in snapshot.free_slots(box, quantity)]
+    return _fill(snapshot, snapshot.boxes, quantity)
+
+
+@register_strategy('best_fit')
+def best_fit(snapshot, quantity):
+    """Fullest box that still holds the whole batch, leaving larger gaps for larger batches.
+
+    Falls back to filling the emptiest boxes first, which spreads a large
+    batch over as few boxes as possible.
+    """
+    best = None
+    for box in snapshot.boxes:
+        free = snapshot.free_count(box)
+        if free >= quantity and (best is None or free < snapshot.free_count(best)):
+            best = box
+    if best is not None:
+        return [(best, r, c) for r, c in snapshot.free_slots(best, quantity)]
+    by_free = sorted(
+        (box for box in snapshot.boxes if snapshot.free_count(box) > 0),
+        key=snapshot.free_count,
+        reverse=True,
+    )
+    return _fill(snapshot, by_free, quantity)
+
+
+@register_strategy('same_drawer')
+def same_drawer(snapshot, quantity):
+    """Keep the batch within one drawer when no single box can hold it."""
+    for box in snapshot.boxes:
+        if snapshot.free_count(box) >= quantity:
+            return [(box, r, c) for r, c in snapshot.free_slots(box, quantity)]
+
+    drawers = {}
+    for box in snapshot.boxes:
+        drawers.setdefault(box['drawer_id'], []).append(box)
+    for boxes in drawers.values():  # drawers in order of their best box's priority
+        if sum(snapshot.free_count(box) for box in boxes) >= quantity:
+            return _fill(snapshot, boxes, quantity)
+    return _fill(snapshot, snapshot.boxes, quantity)
+
+
+def plan_placement(quantity, strategy=DEFAULT_STRATEGY, snapshot=None):
+    """Return ``(placements, boxes)`` for ``quantity`` vials, or ``([], [])`` if they do not fit.
+
+    ``placements`` are dicts with box/tower/drawer names and row/col as used
+    by the confirmation page; ``boxes`` are the box dicts used, in order.
+    """
+    if strategy not in STRATEGIES:
+        raise ValueError(f'Unknown placement strategy: {strategy}')
+    snapshot = snapshot or OccupancySnapshot.load()
+    plan = STRATEGIES[strategy](snapshot, quantity) if quantity > 0 else []
+    placements = []
+    boxes = []
+    for box, row, col in plan:
+        if not boxes or boxes[-1]['id'] != box['id']:
+            boxes.append(box)
+        placements.append({
+            'box_id': box['id'],
+            'box_name': box['name'],
+            'tower_name': box['tower_name'],
+            'drawer_name': box['drawer_name'],
+            'row': row,
+            'col': col,
+        })
+    return placements, boxes
+
+
+def next_free_slot(preferred_box_id=None, exclude=(), snapshot=None):
+    """First free ``(box_id, row, col)`` not in ``exclude``, trying ``preferred_box_id`` first."""
+    snapshot = snapshot or OccupancySnapshot.load()
+    exclude = set(exclude)
+    boxes = sorted(snapshot.boxes, key=lambda box: box['id'] != preferred_box_id)
+    for box in boxes:
+        # 只为计数上还有空位的盒子加载位置
+        if snapshot.free_count(box) <= 0:
+            continue
+        slots = snapshot.free_slots(box, 1, exclude=exclude)
+        if slots:
+            return (box['id'],) + slots[0]
+    return None
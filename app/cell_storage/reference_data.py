@@ -0,0 +1,69 @@
+"""
+Cached select choices for the small reference tables (cell lines, towers,
+drawers, boxes).
+
+Choice lists are kept in the stats cache as versioned metrics: a commit
+writing one of their tables stores a new table version in ``app_config``, and
+every worker process rebuilds a list cached under an older version. Adding or
+editing a cell line, tower, drawer or box is therefore visible on the next
+form in every worker, and ``SelectField`` validation never rejects a new id.
+Writes made with plain ``text()`` SQL must call ``mark_written()`` themselves.
+"""
+
+from .. import db
+from ..shared.stats_cache import stats_cache
+from .models import Box, CellLine, Drawer, Tower
+
+REFERENCE_TTL = 3600
+
+stats_cache.register('cell_storage.cell_line_choices', ttl=REFERENCE_TTL, tables=('cell_lines',), versioned=True)
+stats_cache.register('cell_storage.tower_choices', ttl=REFERENCE_TTL, tables=('towers',), versioned=True)
+stats_cache.register('cell_storage.drawer_choices', ttl=REFERENCE_TTL, tables=('drawers', 'towers'), versioned=True)
+stats_cache.register('cell_storage.box_choices', ttl=REFERENCE_TTL, tables=('boxes', 'drawers', 'towers'), versioned=True)
+
+
+def _cached_choices(name, compute):
+    # The sqlite backend stores JSON, which turns tuples into lists
+    return [tuple(choice) for choice in stats_cache.get_or_compute(name, compute)]
+
+
+def cell_line_choices():
+    """``[(id, name)]`` of all cell lines, by name."""
+    def compute():
+        rows = db.session.query(CellLine.id, CellLine.name).order_by(CellLine.name).all()
+        return [(row.id, row.name) for row in rows]
+    return _cached_choices('cell_storage.cell_line_choices', compute)
+
+
+def tower_choices():
+    """``[(id, name)]`` of all towers, by name."""
+    def compute():
+        rows = db.session.query(Tower.id, Tower.name).order_by(Tower.name).all()
+        return [(row.id, row.name) for row in rows]
+    return _cached_choices('cell_storage.tower_choices', compute)
+
+
+def drawer_choices():
+    """``[(id, "Tower - Drawer")]`` of all drawers, by tower and drawer name."""
+    def compute():
+        rows = db.session.query(Drawer.id, Drawer.name, Tower.name.label('tower_name')) \
+            .join(Tower, Drawer.tower_id == Tower.id) \
+            .order_by(Tower.name, Drawer.name).all()
+        return [(row.id, f"{row.tower_name} - {row.name}") for row in rows]
+    return _cached_choices('cell_storage.drawer_choices', compute)
+
+
+def box_choices():
+    """``[(id, "Tower - Drawer - Box (RxC)")]`` of all boxes, by location."""
+    def compute():
+        rows = db.session.query(
+            Box.id, Box.name, Box.rows, Box.columns,
+            Drawer.name.label('drawer_name'), Tower.name.label('tower_name'),
+        ).join(Drawer, Box.drawer_id == Drawer.id) \
+         .join(Tower, Drawer.tower_id == Tower.id) \
+         .order_by(Tower.name, Drawer.name, Box.name).all()
+        return [
+            (row.id, f"{row.tower_name} - {row.drawer_name} - {row.name} ({row.rows}x{row.columns})")
+            for row in rows
+        ]
+    return _cached_choices('cell_storage.box_choices', compute)
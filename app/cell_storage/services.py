@@ -0,0 +1,1038 @@
+import hashlib
+import json
+import os
+import secrets
+from datetime import datetime, timedelta
+from flask import current_app, session
+from flask_login import current_user
+from sqlalchemy import delete, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import contains_eager, joinedload
+from .. import db
+from ..shared.change_feed import record_changes
+from ..shared.slot_events import record_slots, slot_event
+from ..shared.stats_cache import stats_cache
+from ..shared.utils import log_audit
+from .placement import OccupancySnapshot, box_priority_key, next_free_slot
+from .models import CellLine, Tower, Box, Drawer, CryoVial, VialBatch, Alert, SelectionSet, User
+
+VIAL_STATUSES = ['Available', 'Used', 'Depleted', 'Discarded']
+
+# Upper bound for ids accepted from a client-supplied range string
+MAX_SELECTION_SIZE = 20000
+
+# Upper bound for vials in one batched details request (a few boxes)
+MAX_DETAILS_BATCH = 1000
+
+# Max ids per ``IN (...)`` list, kept below SQLite's default bind parameter limit
+MUTATION_CHUNK_SIZE = 500
+
+
+class InventoryAnalyticsService:
+    """Aggregated read queries backing the inventory summary dashboard."""
+
+    @staticmethod
+    def status_sum(status):
+        """``SUM(CASE WHEN status = :status THEN 1 ELSE 0 END)`` for one vial status."""
+        return db.func.coalesce(
+            db.func.sum(db.case((CryoVial.status == status, 1), else_=0)), 0
+        )
+
+    @staticmethod
+    def global_stats(low_stock_threshold=2):
+        """Vial status totals, batch and cell line counts, and batches below ``low_stock_threshold``."""
+        total_batches = db.select(db.func.count(VialBatch.id)).scalar_subquery()
+        total_cell_lines = db.select(db.func.count(CellLine.id)).scalar_subquery()
+        row = db.session.query(
+            db.func.count(CryoVial.id),
+            *[InventoryAnalyticsService.status_sum(status) for status in VIAL_STATUSES],
+            total_batches,
+            total_cell_lines,
+        ).select_from(CryoVial).one()
+        total, available, used, depleted, discarded, batches, cell_lines = row
+
+        available_count = db.func.count(CryoVial.id)
+        low_stock = db.session.query(
+            CellLine.name.label('cell_line_name'),
+            VialBatch.name.label('batch_name'),
+            VialBatch.id.label('batch_id'),
+            available_count.label('available_count')
+        ).join(CryoVial, CryoVial.cell_line_id == CellLine.id)\
+         .join(VialBatch, CryoVial.batch_id == VialBatch.id)\
+         .filter(CryoVial.status == 'Available')\
+         .group_by(CellLine.name, VialBatch.name, VialBatch.id)\
+         .having(available_count < low_stock_threshold)\
+         .order_by(available_count.asc(), CellLine.name.asc())\
+         .all()
+
+        return {
+            'total_stats': {
+                'total': total or 0,
+                'available': available,
+                'used': used,
+                'depleted': depleted,
+                'discarded': discarded,
+            },
+            'total_batches': batches or 0,
+            'total_cell_lines': cell_lines or 0,
+            'low_stock_records': [
+                {
+                    'cell_line_name': record.cell_line_name,
+                    'batch_name': record.batch_name,
+                    'batch_id': record.batch_id,
+                    'available_count': record.available_count
+                } for record in low_stock
+            ],
+        }
+
+    @staticmethod
+    def filter_vials(query, search_q='', search_status=''):
+        """Apply the summary page's search filters to a query joined to batches and cell lines."""
+        if search_q:
+            like = f"%{search_q}%"
+            query = query.filter(
+                CryoVial.unique_vial_id_tag.ilike(like) |
+                VialBatch.name.ilike(like) |
+                CellLine.name.ilike(like)
+            )
+        if search_status:
+            query = query.filter(CryoVial.status == search_status)
+        return query
+
+    @staticmethod
+    def batch_summary_page(search_q='', search_status='', page=1, per_page=25):
+        """Paginate batches with their per-status vial counts computed in SQL.
+
+        Only vials matching the filters are counted, so the badges agree with
+        the vial list shown when a batch is expanded.
+        """
+        query = db.session.query(
+            VialBatch.id.label('batch_id'),
+            VialBatch.name.label('batch_name'),
+            db.func.min(CellLine.name).label('cell_line_name'),
+            db.func.min(CryoVial.passage_number).label('passage_number'),
+            db.func.min(CryoVial.date_frozen).label('date_frozen'),
+            db.func.count(CryoVial.id).label('total_count'),
+            *[InventoryAnalyticsService.status_sum(status).label(f'count_{status.lower()}')
+              for status in VIAL_STATUSES],
+        ).select_from(VialBatch).join(CryoVial, CryoVial.batch_id == VialBatch.id)\
+         .join(CellLine, CryoVial.cell_line_id == CellLine.id)
+        query = InventoryAnalyticsService.filter_vials(query, search_q, search_status)
+        query = query.group_by(VialBatch.id, VialBatch.name).order_by(VialBatch.id)
+
+        pagination = query.paginate(page=page, per_page=per_page, error_out=False)
+        groups = [
+            {
+                'batch_id': row.batch_id,
+                'batch_name': row.batch_name,
+                'cell_line_name': row.cell_line_name,
+                'passage_number': row.passage_number,
+                'date_frozen': row.date_frozen,
+                'total_count': row.total_count,
+                'status_counts': {
+                    status: getattr(row, f'count_{status.lower()}') for status in VIAL_STATUSES
+                },
+            } for row in pagination.items
+        ]
+        return pagination, groups
+
+    @staticmethod
+    def batch_vials(batch_id, search_q='', search_status=''):
+        """Vials of one batch for the expanded summary row, locations eager-loaded."""
+        query = CryoVial.query.join(VialBatch).join(CellLine)\
+            .filter(CryoVial.batch_id == batch_id)\
+            .options(joinedload(CryoVial.box_location)
+                     .joinedload(Box.drawer_info)
+                     .joinedload(Drawer.tower_info))
+        query = InventoryAnalyticsService.filter_vials(query, search_q, search_status)
+        return query.order_by(CryoVial.unique_vial_id_tag).all()
+
+
+stats_cache.register(
+    'cell_storage.vial_facets', ttl=300,
+    tables=('cryovials', 'vial_batches', 'cell_lines', 'users', 'boxes', 'drawers', 'towers'),
+)
+# One entry per normalised search, TTL from SEARCH_FACET_CACHE_TTL; not invalidated by writes
+stats_cache.register('cell_storage.search_facets')
+
+
+class FacetService:
+    """Distinct filter values with vial counts (tags, resistances, creators, ...).
+
+    All facets are counted in one round trip: every facet is a ``GROUP BY``
+    over the matching vials, combined with ``UNION ALL``. Counts for a search
+    leave out the facet's own filter, so the other values of a selected facet
+    keep their counts. The unfiltered counts behind the inventory dropdowns
+    are cached until a commit writes one of the source tables; counts
+    restricted to a search are computed on demand.
+    """
+
+    # facet name -> column of the joined vial query
+    COLUMNS = {
+        'status': CryoVial.status,
+        'cell_line': CellLine.name,
+        'fluorescence': CryoVial.fluorescence_tag,
+        'resistance': CryoVial.resistance,
+        'creator': User.username,
+        'tower': Tower.name,
+    }
+
+    # facet name -> id the search API filters on (cell_line_id, creator_id, location_id)
+    KEYS = {
+        'cell_line': CellLine.id,
+        'creator': User.id,
+        'tower': Tower.id,
+    }
+
+    SEARCH_FACETS = ('status', 'cell_line', 'creator')
+    LOCATION_FACETS = ('tower',)
+
+    # facet name -> ``search_params()`` keys of its own filter
+    FACET_PARAMS = {
+        'status': ('status',),
+        'cell_line': ('cell_line_id',),
+        'creator': ('creator_id',),
+        'tower': ('location_type', 'location_id'),
+    }
+
+    @staticmethod
+    def joined(query):
+        """Join a query on ``cryovials`` to everything the facets and search filters use."""
+        return query.join(VialBatch, CryoVial.batch_id == VialBatch.id)\
+            .join(CellLine, CryoVial.cell_line_id == CellLine.id)\
+            .join(User, VialBatch.created_by_user_id == User.id)\
+            .join(Box, CryoVial.box_id == Box.id)\
+            .join(Drawer, Box.drawer_id == Drawer.id)\
+            .join(Tower, Drawer.tower_id == Tower.id)
+
+    @staticmethod
+    def inventory_conditions(search_q='', creator='', fluorescence='', resistance=''):
+        """Filters of the inventory page search as a list of SQL conditions."""
+        conditions = []
+        if search_q:
+            like = f"%{search_q}%"
+            conditions.append(
+                CryoVial.unique_vial_id_tag.ilike(like) |
+                VialBatch.name.ilike(like) |
+                CellLine.name.ilike(like) |
+                CryoVial.fluorescence_tag.ilike(like) |
+                CryoVial.resistance.ilike(like) |
+                CryoVial.parental_cell_line.ilike(like)
+            )
+        if creator:
+            conditions.append(User.username == creator)
+        if fluorescence:
+            conditions.append(CryoVial.fluorescence_tag.ilike(f"%{fluorescence}%"))
+        if resistance:
+            conditions.append(CryoVial.resistance.ilike(f"%{resistance}%"))
+        return conditions
+
+    @staticmethod
+    def search_params(args):
+        """Normalised advanced search parameters from request ``args``.
+
+        Text is stripped and lower-cased (all text filters are ``ILIKE``) and
+        invalid numbers and dates are dropped, so equivalent searches share
+        one facet cache entry.
+        """
+        def text(name):
+            return (args.get(name) or '').strip()
+
+        def number(name):
+            try:
+                return int(args.get(name)) if args.get(name) else None
+            except (TypeError, ValueError):
+                return None
+
+        def day(name):
+            try:
+                return datetime.strptime(text(name), '%Y-%m-%d').date().isoformat() if text(name) else None
+            except ValueError:
+                return None
+
+        location_type = text('location_type')
+        return {
+            'q': text('q').lower(),
+            'cell_line_id': number('cell_line_id'),
+            'status': text('status'),
+            'date_from': day('date_from'),
+            'date_to': day('date_to'),
+            'creator_id': number('creator_id'),
+            'fluorescence': text('fluorescence').lower(),
+            'resistance': text('resistance').lower(),
+            'batch_id': number('batch_id'),
+            'location_type': location_type if location_type in ('tower', 'drawer', 'box') else '',
+            'location_id': number('location_id'),
+        }
+
+    @staticmethod
+    def search_conditions(params, with_location=False):
+        """SQL conditions of the advanced search for ``search_params()`` output."""
+        conditions = []
+        if params['q']:
+            like = f"%{params['q']}%"
+            conditions.append(
+                CryoVial.unique_vial_id_tag.ilike(like) |
+                VialBatch.name.ilike(like) |
+                CellLine.name.ilike(like) |
+                CryoVial.fluorescence_tag.ilike(like) |
+                CryoVial.resistance.ilike(like) |
+                CryoVial.notes.ilike(like)
+            )
+        if params['cell_line_id']:
+            conditions.append(CryoVial.cell_line_id == params['cell_line_id'])
+        if params['status']:
+            conditions.append(CryoVial.status == params['status'])
+        if params['date_from']:
+            conditions.append(CryoVial.date_frozen >= datetime.fromisoformat(params['date_from']).date())
+        if params['date_to']:
+            conditions.append(CryoVial.date_frozen <= datetime.fromisoformat(params['date_to']).date())
+        if params['creator_id']:
+            conditions.append(VialBatch.created_by_user_id == params['creator_id'])
+        if params['fluorescence']:
+            conditions.append(CryoVial.fluorescence_tag.ilike(f"%{params['fluorescence']}%"))
+        if params['resistance']:
+            conditions.append(CryoVial.resistance.ilike(f"%{params['resistance']}%"))
+        if params['batch_id']:
+            conditions.append(CryoVial.batch_id == params['batch_id'])
+        if with_location and params['location_type'] and params['location_id']:
+            column = {'tower': Tower.id, 'drawer': Drawer.id, 'box': Box.id}[params['location_type']]
+            conditions.append(column == params['location_id'])
+        return conditions
+
+    @staticmethod
+    def search_facets(params, with_location=False):
+        """Facet counts of an advanced search, cached per normalised search.
+
+        Returns ``{facet: [{'id', 'value', 'count'}, ...]}``, computed in one
+        statement; each facet is counted without its own filter. Entries live
+        for ``SEARCH_FACET_CACHE_TTL`` seconds and are not invalidated by
+        writes, so the counts may lag behind the live result rows by that
+        much.
+        """
+        ttl = current_app.config.get('SEARCH_FACET_CACHE_TTL', 30)
+        if ttl <= 0:
+            return FacetService._search_facets(params, with_location)
+        payload = json.dumps({'params': params, 'location': with_location}, sort_keys=True)
+        return stats_cache.get_or_compute(
+            'cell_storage.search_facets',
+            lambda: FacetService._search_facets(params, with_location),
+            key=hashlib.sha1(payload.encode('utf-8')).hexdigest(),
+            ttl=ttl,
+        )
+
+    @staticmethod
+    def _search_facets(params, with_location):
+        facets = FacetService.SEARCH_FACETS + (FacetService.LOCATION_FACETS if with_location else ())
+        parts = []
+        for name in facets:
+            # 每个分面不应用自身的筛选条件, 选中一项后其他选项仍显示数量
+            others = dict(params)
+            for param in FacetService.FACET_PARAMS[name]:
+                others[param] = None
+            columns = [FacetService.COLUMNS[name].label('value')]
+            if name in FacetService.KEYS:
+                columns.append(FacetService.KEYS[name].label('id'))
+            vials = FacetService.joined(db.select(*columns).select_from(CryoVial))\
+                .where(*FacetService.search_conditions(others, with_location)).subquery(f'{name}_vials')
+            key_column = vials.c.id if name in FacetService.KEYS else db.cast(db.null(), db.Integer)
+            group_by = [vials.c.value] + ([vials.c.id] if name in FacetService.KEYS else [])
+            parts.append(
+                db.select(
+                    db.literal(name).label('facet'),
+                    key_column.label('id'),
+                    vials.c.value,
+                    db.func.count().label('count'),
+                ).where(vials.c.value.isnot(None), vials.c.value != '').group_by(*group_by)
+            )
+
+        result = {name: [] for name in facets}
+        for facet, key_id, value, count in db.session.execute(db.union_all(*parts)).all():
+            result[facet].append({'id': key_id, 'value': value, 'count': count})
+        for values in result.values():
+            values.sort(key=lambda item: (-item['count'], str(item['value']).lower()))
+        return result
+
+    @staticmethod
+    def counts(conditions=(), facets=None):
+        """``{facet: [(value, count), ...]}`` over the vials matching ``conditions``.
+
+        Values are sorted case-insensitively; NULL and empty values are left out.
+        """
+        facets = list(facets or FacetService.COLUMNS)
+        vials = FacetService.joined(
+            db.select(*[FacetService.COLUMNS[name].label(name) for name in facets]).select_from(CryoVial)
+        ).where(*conditions).cte('facet_vials')
+        parts = [
+            db.select(
+                db.literal(name).label('facet'),
+                vials.c[name].label('value'),
+                db.func.count().label('count'),
+            ).where(vials.c[name].isnot(None), vials.c[name] != '').group_by(vials.c[name])
+            for name in facets
+        ]
+        result = {name: [] for name in facets}
+        for facet, value, count in db.session.execute(db.union_all(*parts)).all():
+            result[facet].append((value, count))
+        for values in result.values():
+            values.sort(key=lambda item: str(item[0]).lower())
+        return result
+
+    @staticmethod
+    def vial_facets():
+        """Facet counts of all vials, whatever their status (cached)."""
+        def compute():
+            return FacetService.counts()
+        facets = stats_cache.get_or_compute('cell_storage.vial_facets', compute)
+        # The sqlite backend stores JSON, which turns tuples into lists
+        return {name: [tuple(item) for item in values] for name, values in facets.items()}
+
+    @staticmethod
+    def inventory_counts(search_q='', creator='', fluorescence='', resistance=''):
+        """Dropdown counts of an inventory search, ``{facet: [(value, count), ...]}``.
+
+        Each facet is counted over the vials matching every filter except its
+        own, so selecting one creator still shows how many vials the other
+        creators have. All facets are computed in one statement.
+        """
+        selected = {'creator': creator, 'fluorescence': fluorescence, 'resistance': resistance}
+        parts = []
+        for name in selected:
+            others = {key: '' if key == name else value for key, value in selected.items()}
+            vials = FacetService.joined(
+                db.select(FacetService.COLUMNS[name].label('value')).select_from(CryoVial)
+            ).where(*FacetService.inventory_conditions(search_q, **others)).subquery(f'{name}_vials')
+            parts.append(
+                db.select(db.literal(name).label('facet'), vials.c.value, db.func.count().label('count'))
+                .where(vials.c.value.isnot(None), vials.c.value != '').group_by(vials.c.value)
+            )
+        result = {name: [] for name in selected}
+        for facet, value, count in db.session.execute(db.union_all(*parts)).all():
+            result[facet].append((value, count))
+        return result
+
+    @staticmethod
+    def with_counts(options, restricted):
+        """``options`` of a facet with the counts of ``restricted`` (0 for values not in it)."""
+        restricted = dict(restricted)
+        return [(value, restricted.get(value, 0)) for value, _ in options]
+
+
+def chunked(values, size=MUTATION_CHUNK_SIZE):
+    """Yield successive ``size``-long slices of ``values``."""
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def encode_id_ranges(ids):
+    """Encode ids as sorted ranges: ``[1, 2, 3, 7, 9, 10]`` -> ``"1-3,7,9-10"``."""
+    parts = []
+    start = prev = None
+    for vial_id in sorted(set(ids)):
+        if prev is not None and vial_id == prev + 1:
+            prev = vial_id
+            continue
+        if start is not None:
+            parts.append(str(start) if start == prev else f'{start}-{prev}')
+        start = prev = vial_id
+    if start is not None:
+        parts.append(str(start) if start == prev else f'{start}-{prev}')
+    return ','.join(parts)
+
+
+def decode_id_ranges(text, limit=None):
+    """Inverse of ``encode_id_ranges``.
+
+    Raises ``ValueError`` on malformed input or when more than ``limit`` ids
+    would be produced.
+    """
+    ids = []
+    for part in (text or '').split(','):
+        part = part.strip()
+        if not part:
+            continue
+        start, _, end = part.partition('-')
+        start = int(start)
+        end = int(end) if end else start
+        if end < start:
+            raise ValueError(f'Invalid id range: {part}')
+        if limit is not None and len(ids) + end - start + 1 > limit:
+            raise ValueError(f'Selection exceeds {limit} ids')
+        ids.extend(range(start, end + 1))
+    return ids
+
+
+class SelectionService:
+    """Vial selections stored in ``selection_sets`` instead of the cookie session.
+
+    The session only carries one opaque token per selection kind, so cookie
+    size stays constant however many vials are selected. Sets expire after
+    ``SELECTION_TTL_HOURS`` and expired rows are purged whenever a new set is
+    created. Every mutating call commits.
+    """
+
+    SESSION_KEY = 'selection_tokens'
+
+    @staticmethod
+    def _get(kind):
+        token = session.get(SelectionService.SESSION_KEY, {}).get(kind)
+        if not token or not current_user.is_authenticated:
+            return None
+        return SelectionSet.query.filter(
+            SelectionSet.token == token,
+            SelectionSet.kind == kind,
+            SelectionSet.user_id == current_user.id,
+            SelectionSet.expires_at > datetime.utcnow(),
+        ).first()
+
+    @staticmethod
+    def _get_or_create(kind):
+        selection = SelectionService._get(kind)
+        if selection is None:
+            SelectionService.purge_expired()
+            selection = SelectionSet(
+                token=secrets.token_urlsafe(24),
+                user_id=current_user.id,
+                kind=kind,
+                id_ranges='',
+            )
+            db.session.add(selection)
+            tokens = dict(session.get(SelectionService.SESSION_KEY, {}))
+            tokens[kind] = selection.token
+            session[SelectionService.SESSION_KEY] = tokens
+        ttl = current_app.config.get('SELECTION_TTL_HOURS', 12)
+        selection.expires_at = datetime.utcnow() + timedelta(hours=ttl)
+        return selection
+
+    @staticmethod
+    def get_ids(kind):
+        selection = SelectionService._get(kind)
+        return decode_id_ranges(selection.id_ranges) if selection else []
+
+    @staticmethod
+    def apply_delta(kind, add=(), remove=()):
+        """Add and remove ids in one write; returns ``(added, removed, ids)``."""
+        selection = SelectionService._get_or_create(kind)
+        current = set(decode_id_ranges(selection.id_ranges))
+        add, remove = set(add), set(remove)
+        added = len(add - current)
+        removed = len(current & remove)
+        current = (current | add) - remove
+        selection.id_ranges = encode_id_ranges(current)
+        db.session.commit()
+        return added, removed, sorted(current)
+
+    @staticmethod
+    def add(kind, ids):
+        return SelectionService.apply_delta(kind, add=ids)[0]
+
+    @staticmethod
+    def remove(kind, ids):
+        return SelectionService.apply_delta(kind, remove=ids)[1]
+
+    @staticmethod
+    def get_payload(kind):
+        selection = SelectionService._get(kind)
+        return json.loads(selection.payload) if selection and selection.payload else None
+
+    @staticmethod
+    def set_payload(kind, payload):
+        selection = SelectionService._get_or_create(kind)
+        selection.payload = json.dumps(payload)
+        db.session.commit()
+
+    @staticmethod
+    def pop_payload(kind):
+        payload = SelectionService.get_payload(kind)
+        SelectionService.clear(kind)
+        return payload
+
+    @staticmethod
+    def clear(kind):
+        tokens = dict(session.get(SelectionService.SESSION_KEY, {}))
+        token = tokens.pop(kind, None)
+        if token:
+            SelectionSet.query.filter_by(token=token).delete(synchronize_session=False)
+            db.session.commit()
+            session[SelectionService.SESSION_KEY] = tokens
+
+    @staticmethod
+    def clear_all():
+        for kind in list(session.get(SelectionService.SESSION_KEY, {})):
+            SelectionService.clear(kind)
+        session.pop(SelectionService.SESSION_KEY, None)
+
+    @staticmethod
+    def purge_expired():
+        """Delete expired selection sets of all users."""
+        return SelectionSet.query.filter(SelectionSet.expires_at <= datetime.utcnow())\
+            .delete(synchronize_session=False)
+
+
+class VialMutationService:
+    """Set-based writes to ``cryovials`` in place of per-row ORM updates.
+
+    Statements run through the session without committing; the single
+    consolidated ``log_audit`` call commits them together with the audit
+    record. ``synchronize_session`` is disabled, so vials already loaded in
+    the session are stale until the commit expires them.
+    """
+
+    @staticmethod
+    def append_notes_expr(text):
+        """SQL equivalent of ``(v.notes + '\\n' if v.notes else '') + text``."""
+        return db.case(
+            (db.func.coalesce(CryoVial.notes, '') == '', text),
+            else_=CryoVial.notes + '\n' + text,
+        )
+
+    @staticmethod
+    def update_vials(vial_ids, values):
+        """Apply ``values`` to the given vials, ``MUTATION_CHUNK_SIZE`` ids per statement.
+
+        Returns ``{vial_id: previous_status}`` for the rows actually updated.
+        The previous statuses are read under ``FOR UPDATE`` (a no-op on
+        SQLite) because ``RETURNING`` only sees the new row values.
+        """
+        values = dict(values)
+        values.setdefault('last_updated', datetime.utcnow())
+        returning = db.session.get_bind().dialect.update_returning
+
+        previous = {}
+        for chunk in chunked(sorted(set(vial_ids))):
+            rows = db.session.query(
+                CryoVial.id, CryoVial.status, CryoVial.box_id, CryoVial.row_in_box, CryoVial.col_in_box,
+                CryoVial.batch_id,
+            ).filter(CryoVial.id.in_(chunk))\
+             .with_for_update()\
+             .all()
+            old_status = {row.id: row.status for row in rows}
+
+            stmt = update(CryoVial).where(CryoVial.id.in_(chunk)).values(**values)\
+                .execution_options(synchronize_session=False)
+            if returning:
+                updated = db.session.execute(stmt.returning(CryoVial.id)).scalars().all()
+            else:
+                db.session.execute(stmt)
+                updated = list(old_status)
+            previous.update({vial_id: old_status[vial_id] for vial_id in updated})
+            record_changes('vial', updated)
+            if 'status' in values:
+                updated = set(updated)
+                record_slots(db.session, [
+                    slot_event(row.box_id, row.row_in_box, row.col_in_box, row.id, row.batch_id, values['status'])
+                    for row in rows if row.id in updated and row.box_id is not None
+                ])
+        return previous
+
+    @staticmethod
+    def update_status(vial_ids, new_status, user_id, action='UPDATE_VIAL_STATUS', details=None):
+        """Set ``status`` on many vials and write one audit record for the whole change.
+
+        Nothing is written when none of ``vial_ids`` exist.
+        """
+        previous = VialMutationService.update_vials(vial_ids, {'status': new_status})
+        if not previous:
+            db.session.rollback()
+            return {'updated_ids': [], 'missing_ids': sorted(set(vial_ids)), 'previous_statuses': {}}
+
+        by_old_status = {}
+        for vial_id, old_status in sorted(previous.items()):
+            by_old_status.setdefault(old_status, []).append(vial_id)
+
+        summary = {
+            'updated_ids': sorted(previous),
+            'missing_ids': sorted(set(vial_ids) - set(previous)),
+            'previous_statuses': by_old_status,
+        }
+        audit_details = {
+            'new_status': new_status,
+            'vial_count': len(previous),
+            'vial_ids': summary['updated_ids'],
+            'previous_statuses': by_old_status,
+        }
+        audit_details.update(details or {})
+        log_audit(user_id, action, target_type='CryoVial', details=audit_details)
+        return summary
+
+    @staticmethod
+    def update_batch_vials(batch_id, values):
+        """Apply ``values`` to every vial of a batch in one statement; returns the row count."""
+        values = dict(values)
+        values.setdefault('last_updated', datetime.utcnow())
+        result = db.session.execute(
+            update(CryoVial).where(CryoVial.batch_id == batch_id).values(**values)
+            .execution_options(synchronize_session=False)
+        )
+        record_changes('vial', db.session.scalars(db.select(CryoVial.id).where(CryoVial.batch_id == batch_id)))
+        return result.rowcount
+
+    @staticmethod
+    def delete_vials(vial_ids, batch_ids=()):
+        """Delete vials in chunks and drop any batch left without vials.
+
+        Tags and batch names are read with one query per chunk instead of
+        lazy-loading ``vial.batch``. Batches in ``batch_ids`` are also removed
+        if they end up empty, so a batch with no vials can be deleted through
+        the same path. Alerts pointing at a removed batch are detached. Nothing
+        is committed; the returned summary feeds the caller's audit record.
+        """
+        deleted = {}
+        batch_names = {}
+        slots = []
+        for chunk in chunked(sorted(set(vial_ids))):
+            rows = db.session.query(
+                CryoVial.id, CryoVial.unique_vial_id_tag, CryoVial.batch_id, VialBatch.name,
+                CryoVial.box_id, CryoVial.row_in_box, CryoVial.col_in_box,
+            ).outerjoin(VialBatch, CryoVial.batch_id == VialBatch.id)\
+             .filter(CryoVial.id.in_(chunk))\
+             .all()
+            for vial_id, tag, batch_id, batch_name, box_id, row, col in rows:
+                deleted[vial_id] = tag
+                batch_names[batch_id] = batch_name or 'Unknown'
+                if box_id is not None:
+                    slots.append(slot_event(box_id, row, col, vial_id, batch_id, None))
+
+            db.session.execute(
+                delete(CryoVial).where(CryoVial.id.in_(chunk))
+                .execution_options(synchronize_session=False)
+            )
+
+        candidate_batches = set(batch_names) | set(batch_ids)
+        orphaned = []
+        if candidate_batches:
+            has_vials = db.session.query(CryoVial.id).filter(CryoVial.batch_id == VialBatch.id).exists()
+            orphaned = [
+                batch_id for (batch_id,) in db.session.query(VialBatch.id)
+                .filter(VialBatch.id.in_(candidate_batches), ~has_vials)
+                .all()
+            ]
+        record_changes('vial', deleted, 'delete')
+        record_slots(db.session, slots)
+        if orphaned:
+            record_changes('batch', orphaned, 'delete')
+            db.session.execute(
+                update(Alert).where(Alert.batch_id.in_(orphaned)).values(batch_id=None)
+                .execution_options(synchronize_session=False)
+            )
+            db.session.execute(
+                delete(VialBatch).where(VialBatch.id.in_(orphaned))
+                .execution_options(synchronize_session=False)
+            )
+
+        return {
+            'deleted_ids': sorted(deleted),
+            'missing_ids': sorted(set(vial_ids) - set(deleted)),
+            'vial_tags': [deleted[vial_id] for vial_id in sorted(deleted)],
+            'batch_names': {str(batch_id): name for batch_id, name in sorted(batch_names.items())},
+            'deleted_batch_ids': sorted(orphaned),
+        }
+
+
+class PickupService:
+    """Pick-up workflow built on one eager-loaded query per chunk of selected ids."""
+
+    @staticmethod
+    def load_vials(vial_ids):
+        """Available selected vials with batch, cell line and tower/drawer/box loaded.
+
+        Vials come back in pick order: tower, drawer, box, row, column.
+        """
+        vials = []
+        for chunk in chunked(sorted(set(vial_ids))):
+            vials.extend(
+                CryoVial.query
+                .join(CryoVial.box_location).join(Box.drawer_info).join(Drawer.tower_info)
+                .join(CryoVial.batch).join(CryoVial.cell_line_info)
+                .options(
+                    contains_eager(CryoVial.box_location)
+                    .contains_eager(Box.drawer_info)
+                    .contains_eager(Drawer.tower_info),
+                    contains_eager(CryoVial.batch),
+                    contains_eager(CryoVial.cell_line_info),
+                )
+                .filter(CryoVial.id.in_(chunk), CryoVial.status == 'Available')
+                .all()
+            )
+        vials.sort(key=PickupService.pick_order_key)
+        return vials
+
+    @staticmethod
+    def pick_order_key(vial):
+        # Numbered names in numeric order ("Box 2" before "Box 10"), as in placement
+        box = vial.box_location
+        names = (box.drawer_info.tower_info.name, box.drawer_info.name, box.name)
+        return tuple((box_priority_key(name), name) for name in names) + (vial.row_in_box, vial.col_in_box, vial.id)
+
+    @staticmethod
+    def group_by_batch(vials):
+        """``{batch_id: {'batch', 'cell_line', 'date_frozen', 'vials'}}`` for the quantity form."""
+        batches = {}
+        for vial in vials:
+            group = batches.setdefault(vial.batch_id, {
+                'batch': vial.batch,
+                'cell_line': vial.cell_line_info.name,
+                'date_frozen': vial.date_frozen,
+                'vials': [],
+            })
+            if vial.date_frozen < group['date_frozen']:
+                group['date_frozen'] = vial.date_frozen
+            group['vials'].append(vial)
+        return batches
+
+    @staticmethod
+    def pick_list(vials):
+        """Plain pick-list rows in freezer order, safe to render after the commit."""
+        rows = []
+        for vial in sorted(vials, key=PickupService.pick_order_key):
+            box = vial.box_location
+            rows.append({
+                'vial_id': vial.id,
+                'unique_vial_id_tag': vial.unique_vial_id_tag,
+                'batch_id': vial.batch_id,
+                'batch_name': vial.batch.name,
+                'cell_line': vial.cell_line_info.name,
+                'tower_name': box.drawer_info.tower_info.name,
+                'drawer_name': box.drawer_info.name,
+                'box_id': box.id,
+                'box_name': box.name,
+                'box_rows': box.rows,
+                'box_columns': box.columns,
+                'row': vial.row_in_box,
+                'col': vial.col_in_box,
+                'location': f"{box.drawer_info.tower_info.name}/{box.drawer_info.name}/{box.name}",
+            })
+        return rows
+
+    @staticmethod
+    def box_maps(pick_list):
+        """Group pick-list rows into per-box grids for the confirmation page."""
+        boxes = {}
+        for item in pick_list:
+            box = boxes.setdefault(item['box_id'], {
+                'tower_name': item['tower_name'],
+                'drawer_name': item['drawer_name'],
+                'box_name': item['box_name'],
+                'rows': item['box_rows'],
+                'columns': item['box_columns'],
+                'cells': {},
+            })
+            box['cells'][(item['row'], item['col'])] = item
+        return boxes
+
+    @staticmethod
+    def pick(batches, quantities, user_id):
+        """Mark ``quantities[batch_id]`` vials of each batch as Used with one bulk update.
+
+        Within a batch the vials earliest in pick order are taken. Returns the
+        pick list of the vials actually updated.
+        """
+        chosen = []
+        for batch_id, group in batches.items():
+            chosen.extend(group['vials'][:max(quantities.get(batch_id, 0), 0)])
+        pick_list = PickupService.pick_list(chosen)
+        if not pick_list:
+            return []
+
+        summary = VialMutationService.update_status(
+            [item['vial_id'] for item in pick_list], 'Used', user_id,
+            action='PICKUP_VIALS',
+            details={'batch_ids': sorted({item['batch_id'] for item in pick_list})},
+        )
+        updated = set(summary['updated_ids'])
+        return [item for item in pick_list if item['vial_id'] in updated]
+
+
+class VialDetailsService:
+    """Vial detail payloads for the freezer map, many vials per query.
+
+    The ETag of a set of vials is derived from what the payload shows: the
+    vial's ``last_updated``, which every vial write (including the set-based
+    ones in ``VialMutationService``) bumps, the ``updated_at`` of its batch
+    and box, and the cell line, operator, drawer and tower names, which have
+    no timestamp. Clients can revalidate without the details being loaded.
+    """
+
+    @staticmethod
+    def versions(vial_ids):
+        """``{vial_id: version}`` of the existing vials among ``vial_ids``."""
+        versions = {}
+        for chunk in chunked(sorted(set(vial_ids))):
+            rows = db.session.query(
+                CryoVial.id, CryoVial.last_updated, VialBatch.updated_at, Box.updated_at,
+                CellLine.name, User.username, Drawer.name, Tower.name,
+            ).select_from(CryoVial)\
+             .outerjoin(VialBatch, CryoVial.batch_id == VialBatch.id)\
+             .outerjoin(CellLine, CryoVial.cell_line_id == CellLine.id)\
+             .outerjoin(User, CryoVial.frozen_by_user_id == User.id)\
+             .outerjoin(Box, CryoVial.box_id == Box.id)\
+             .outerjoin(Drawer, Box.drawer_id == Drawer.id)\
+             .outerjoin(Tower, Drawer.tower_id == Tower.id)\
+             .filter(CryoVial.id.in_(chunk))\
+             .all()
+            versions.update((row[0], tuple(row[1:])) for row in rows)
+        return versions
+
+    @staticmethod
+    def etag(versions, is_admin):
+        payload = ';'.join(
+            f"{vial_id}:{'|'.join(str(part) for part in versions[vial_id])}" for vial_id in sorted(versions)
+        )
+        return hashlib.sha1(f'{int(is_admin)}|{payload}'.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def load(vial_ids):
+        """Vials with batch, cell line, operator and location loaded in one query per chunk."""
+        vials = []
+        for chunk in chunked(sorted(set(vial_ids))):
+            vials.extend(
+                CryoVial.query
+                .outerjoin(CryoVial.batch).outerjoin(CryoVial.cell_line_info)
+                .outerjoin(CryoVial.freezer_operator)
+                .outerjoin(CryoVial.box_location).outerjoin(Box.drawer_info).outerjoin(Drawer.tower_info)
+                .options(
+                    contains_eager(CryoVial.batch),
+                    contains_eager(CryoVial.cell_line_info),
+                    contains_eager(CryoVial.freezer_operator),
+                    contains_eager(CryoVial.box_location)
+                    .contains_eager(Box.drawer_info)
+                    .contains_eager(Drawer.tower_info),
+                )
+                .filter(CryoVial.id.in_(chunk))
+                .all()
+            )
+        return vials
+
+    @staticmethod
+    def to_dict(vial, is_admin):
+        box = vial.box_location
+        if box and box.drawer_info and box.drawer_info.tower_info:
+            location = f"{box.drawer_info.tower_info.name}/{box.drawer_info.name}/{box.name} (R{vial.row_in_box}C{vial.col_in_box})"
+        else:
+            location = "Location not available"
+        return {
+            "id": vial.id,
+            "unique_vial_id_tag": vial.unique_vial_id_tag or "Unknown",
+            "cell_line": vial.cell_line_info.name if vial.cell_line_info else "Unknown",
+            "batch_name": vial.batch.name if vial.batch else "Unknown",
+            "passage_number": vial.passage_number or "N/A",
+            "date_frozen": vial.date_frozen.strftime('%Y-%m-%d') if vial.date_frozen else "N/A",
+            "frozen_by": vial.freezer_operator.username if vial.freezer_operator else "Unknown",
+            "status": vial.status or "Unknown",
+            "notes": vial.notes or "No notes available",
+            "location": location,
+            "is_admin": is_admin,
+        }
+
+
+class VialPlacementService:
+    """Optimistic inserts of new vials against the occupied-slot unique index.
+
+    ``uq_cryovials_occupied_slot`` allows one Available vial per position, so
+    inserts are attempted without checking first. A vial that loses a race
+    for its slot is moved to the next free slot and retried.
+    """
+
+    MAX_ATTEMPTS = 5
+
+    @staticmethod
+    def slot_is_occupied(box_id, row, col):
+        return db.session.query(CryoVial.id).filter_by(
+            box_id=box_id, row_in_box=row, col_in_box=col, status='Available'
+        ).first() is not None
+
+    @staticmethod
+    def insert_vials(vials):
+        """Insert new Available vials; returns the vials that had to be moved.
+
+        All vials are flushed in one savepoint first. If that fails, they are
+        inserted one by one and a vial whose slot is taken gets the next free
+        slot from an occupancy snapshot loaded once for the whole retry loop.
+        An ``IntegrityError`` that is not a slot conflict (e.g. a
+        duplicate tag) is re-raised.
+        """
+        try:
+            with db.session.begin_nested():
+                db.session.add_all(vials)
+                db.session.flush()
+            return []
+        except IntegrityError:
+            pass
+
+        moved = []
+        snapshot = None
+        placed = set()
+        planned = {(vial.box_id, vial.row_in_box, vial.col_in_box) for vial in vials}
+        for vial in vials:
+            for attempt in range(VialPlacementService.MAX_ATTEMPTS):
+                try:
+                    with db.session.begin_nested():
+                        db.session.add(vial)
+                        db.session.flush()
+                    placed.add((vial.box_id, vial.row_in_box, vial.col_in_box))
+                    break
+                except IntegrityError:
+                    if not VialPlacementService.slot_is_occupied(vial.box_id, vial.row_in_box, vial.col_in_box):
+                        raise
+                    if snapshot is None:
+                        snapshot = OccupancySnapshot.load()
+                    else:
+                        snapshot.mark_occupied(vial.box_id, vial.row_in_box, vial.col_in_box)
+                    slot = next_free_slot(vial.box_id, exclude=placed | planned, snapshot=snapshot)
+                    if slot is None:
+                        raise
+                    vial.box_id, vial.row_in_box, vial.col_in_box = slot
+                    if vial not in moved:
+                        moved.append(vial)
+            else:
+                raise IntegrityError(
+                    'INSERT INTO cryovials', None,
+                    Exception(f'No free slot for vial {vial.unique_vial_id_tag} after retries'),
+                )
+        return moved
+
+
+class BackupError(Exception):
+    """An RDS snapshot or restore request failed."""
+
+
+class RDSBackupService:
+    """RDS snapshot backup/restore.
+
+    boto3/botocore are imported on the first call, not when the blueprint
+    loads; they are only needed when ``AWS_RDS_INSTANCE_IDENTIFIER`` is set.
+    """
+
+    @staticmethod
+    def instance_identifier():
+        return os.environ.get('AWS_RDS_INSTANCE_IDENTIFIER')
+
+    @staticmethod
+    def _call(method, **kwargs):
+        import boto3
+        from botocore.exceptions import BotoCoreError, ClientError
+        try:
+            client = boto3.client('rds', region_name=os.environ.get('AWS_REGION'))
+            return getattr(client, method)(**kwargs)
+        except (BotoCoreError, ClientError) as exc:
+            raise BackupError(str(exc)) from exc
+
+    @staticmethod
+    def create_snapshot(identifier):
+        """Start a manual snapshot of ``identifier``; returns the snapshot id."""
+        snapshot_id = f"{identifier}-snapshot-{datetime.utcnow().strftime('%Y%m%d%H%M%S')}"
+        RDSBackupService._call(
+            'create_db_snapshot',
+            DBInstanceIdentifier=identifier,
+            DBSnapshotIdentifier=snapshot_id,
+        )
+        return snapshot_id
+
+    @staticmethod
+    def restore_snapshot(identifier, snapshot_id):
+        RDSBackupService._call(
+            'restore_db_instance_from_db_snapshot',
+            DBInstanceIdentifier=identifier,
+            DBSnapshotIdentifier=snapshot_id,
+        )
@@ -0,0 +1,216 @@
+import pandas as pd
+from io import BytesIO
+from sqlalchemy import insert
+from .. import db
+from ..shared.change_feed import record_changes
+from ..shared.metrics import metrics
+from .models import InventoryItem, Supplier, Location
+
+# Spreadsheet column -> InventoryItem attribute
+IMPORT_COLUMN_MAP = {
+    '物品名称': 'name',
+    '产品编号': 'catalog_number',
+    '当前数量': 'current_quantity',
+    '单位': 'unit',
+    '最小库存': 'minimum_quantity',
+    'CAS号': 'cas_number',
+    '批次号': 'lot_number',
+    '备注': 'description',
+}
+
+
+class DataImportExportService:
+    @staticmethod
+    def import_inventory_from_file(file, user_id, default_type_id=1):
+        try:
+            df = pd.read_excel(file) if file.filename.endswith('.xlsx') else pd.read_csv(file)
+            df = DataImportExportService.normalize_columns(df)
+
+            required_columns = ['物品名称', '供应商', '当前数量', '单位']
+            errors = DataImportExportService.validate_import_data(df, required_columns)
+            if errors:
+                metrics.inc('cellstorage_imports_total', kind='inventory_spreadsheet', outcome='invalid')
+                return {'success': False, 'errors': errors}
+
+            df = DataImportExportService.resolve_suppliers(df)
+            df = DataImportExportService.resolve_locations(df)
+
+            records = DataImportExportService.build_item_records(df, user_id, default_type_id)
+            if records:
+                item_ids = db.session.scalars(insert(InventoryItem).returning(InventoryItem.id), records).all()
+                record_changes('item', item_ids)
+            db.session.commit()
+            metrics.inc('cellstorage_imports_total', kind='inventory_spreadsheet', outcome='success')
+            metrics.inc('cellstorage_import_rows_total', len(records), kind='inventory_spreadsheet')
+            return {'success': True, 'imported_count': len(records)}
+
+        except Exception as e:
+            db.session.rollback()
+            metrics.inc('cellstorage_imports_total', kind='inventory_spreadsheet', outcome='error')
+            return {'success': False, 'errors': [str(e)]}
+
+    @staticmethod
+    def normalize_columns(df):
+        """Strip whitespace and the template's required-field ``*`` marker from headers."""
+        df.columns = [str(col).strip().rstrip('*').strip() for col in df.columns]
+        return df
+
+    @staticmethod
+    def validate_import_data(df, required_columns):
+        errors = []
+        missing_columns = [col for col in required_columns if col not in df.columns]
+        if missing_columns:
+            errors.append(f"Missing required columns: {', '.join(missing_columns)}")
+
+        # Spreadsheet rows are 1-based and the header occupies the first row
+        row_numbers = pd.Series(df.index + 2, index=df.index)
+        no_problem = pd.Series(False, index=df.index)
+
+        empty_name = no_problem
+        if '物品名称' in df.columns:
+            names = df['物品名称']
+            empty_name = names.isna() | (names.astype(str).str.strip() == '')
+
+        bad_quantity = no_problem
+        if '当前数量' in df.columns:
+            quantities = df['当前数量']
+            bad_quantity = quantities.notna() & pd.to_numeric(quantities, errors='coerce').isna()
+
+        flagged = empty_name | bad_quantity
+        for row, name_missing, quantity_invalid in zip(
+                row_numbers[flagged], empty_name[flagged], bad_quantity[flagged]):
+            if name_missing:
+                errors.append(f"Row {row}: 物品名称 cannot be empty")
+            if quantity_invalid:
+                errors.append(f"Row {row}: 当前数量 must be a number")
+        return errors
+
+    @staticmethod
+    def resolve_suppliers(df):
+        """Attach ``supplier_id`` by merging against all suppliers, creating missing ones in bulk."""
+        df = df.copy()
+        names = df['供应商'].astype('string').str.strip()
+        df['供应商'] = names.where((names != '').fillna(False)).astype(object)
+
+        suppliers = DataImportExportService._supplier_frame()
+        new_names = sorted(set(df['供应商'].dropna()) - set(suppliers['supplier_name']))
+        if new_names:
+            db.session.execute(insert(Supplier), [{'name': name} for name in new_names])
+            db.session.flush()
+            suppliers = DataImportExportService._supplier_frame()
+
+        # Several suppliers may share a name; the original lookup used the first one
+        suppliers = suppliers.sort_values('supplier_id').drop_duplicates('supplier_name')
+        merged = df.merge(suppliers, how='left', left_on='供应商', right_on='supplier_name')
+        merged.index = df.index
+        return merged.drop(columns=['supplier_name'])
+
+    @staticmethod
+    def resolve_locations(df):
+        """Attach ``location_id`` by merging ``存储位置`` against the location path map."""
+        df = df.copy()
+        if '存储位置' not in df.columns:
+            df['location_id'] = None
+            return df
+
+        df['location_path'] = df['存储位置'].map(DataImportExportService.normalize_location_path)
+        locations = pd.DataFrame(
+            list(DataImportExportService.build_location_path_map().items()),
+            columns=['location_path', 'location_id'],
+        )
+        merged = df.merge(locations, how='left', on='location_path')
+        merged.index = df.index
+        return merged.drop(columns=['location_path'])
+
+    @staticmethod
+    def build_location_path_map():
+        """Return ``{full_path: location_id}`` for every location, walking the tree once.
+
+        ``Location.full_path`` is a Python property that lazily loads each
+        parent, so it cannot be used in a query and is too slow to call per row.
+        """
+        rows = db.session.query(Location.id, Location.name, Location.parent_id).all()
+        by_id = {row.id: row for row in rows}
+        paths = {}
+
+        def path_for(location_id):
+            if location_id in paths:
+                return paths[location_id]
+            parts = []
+            seen = set()
+            current = by_id.get(location_id)
+            while current is not None and current.id not in seen:
+                seen.add(current.id)
+                if current.id in paths:
+                    parts.insert(0, paths[current.id])
+                    break
+                parts.insert(0, current.name)
+                current = by_id.get(current.parent_id)
+            paths[location_id] = ' > '.join(parts)
+            return paths[location_id]
+
+        path_map = {}
+        for location_id in by_id:
+            path_map.setdefault(path_for(location_id), location_id)
+        return path_map
+
+    @staticmethod
+    def normalize_location_path(value):
+        """Normalize ``Room101>Fridge>Shelf1`` style paths to the ``full_path`` format."""
+        if pd.isna(value):
+            return None
+        parts = [part.strip() for part in str(value).split('>')]
+        return ' > '.join(part for part in parts if part) or None
+
+    @staticmethod
+    def build_item_records(df, user_id, default_type_id):
+        """Convert the resolved frame into ``InventoryItem`` insert parameter dicts."""
+        out = pd.DataFrame(index=df.index)
+        for column, attribute in IMPORT_COLUMN_MAP.items():
+            out[attribute] = df[column] if column in df.columns else None
+
+        out['current_quantity'] = pd.to_numeric(out['current_quantity'], errors='coerce')
+        out['minimum_quantity'] = pd.to_numeric(out['minimum_quantity'], errors='coerce').fillna(0)
+        if '到期日期' in df.columns:
+            out['expiration_date'] = pd.to_datetime(df['到期日期'], errors='coerce').dt.date
+        else:
+            out['expiration_date'] = None
+        out['supplier_id'] = df['supplier_id']
+        out['location_id'] = df['location_id']
+        out['type_id'] = default_type_id
+        out['created_by_user_id'] = user_id
+
+        out = out.astype(object).where(out.notna(), None)
+        for column in ('supplier_id', 'location_id'):
+            out[column] = out[column].map(lambda v: int(v) if v is not None else None)
+        return out.to_dict('records')
+
+    @staticmethod
+    def _supplier_frame():
+        rows = db.session.query(Supplier.id, Supplier.name).all()
+        return pd.DataFrame(
+            [(row.id, row.name) for row in rows],
+            columns=['supplier_id', 'supplier_name'],
+        )
+
+    @staticmethod
+    def export_template():
+        template_data = {
+            '物品名称*': ['Antibody XYZ'],
+            '产品编号': ['AB12345'],
+            '供应商*': ['ThermoFisher'],
+            '当前数量*': [10],
+            '单位*': ['mL'],
+            '最小库存': [2],
+            '到期日期': ['2024-12-31'],
+            '存储位置': ['Room101>Fridge>Shelf1'],
+            'CAS号': ['12345-67-8'],
+            '批次号': ['LOT001'],
+            '备注': ['For experiment']
+        }
+        df = pd.DataFrame(template_data)
+        output = BytesIO()
+        with pd.ExcelWriter(output, engine='openpyxl') as writer:
+            df.to_excel(writer, index=False, sheet_name='Template')
+        output.seek(0)
+        return output
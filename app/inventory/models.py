@@ -119,7 +119,7 @@ class InventoryItem(db.Model):
     custom_data = db.Column(db.Text)
     created_by_user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
 
     # NEW: Columns from development plan
     cas_number = db.Column(db.String(64))
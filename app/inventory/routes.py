@@ -6,7 +6,9 @@ from datetime import datetime, date
 from sqlalchemy import or_
 from .. import db
 from ..shared.decorators import admin_required
+from ..shared.json_provider import STREAM_CHUNK_SIZE, stream_json_array
 from ..shared.permissions import require_permission
+from ..shared.stats_cache import stats_cache
 from .models import (InventoryType, InventoryItem, Location, Supplier,
                     Order, OrderItem, UsageLog, StockAlert, ShoppingCart, PurchaseRequest, Notification)
 from ..cell_storage.models import User
@@ -43,20 +45,22 @@ class NotificationService:
 @require_permission('inventory.view')
 def index():
     """Inventory dashboard"""
-    total_items = InventoryItem.query.filter(InventoryItem.status != 'Used Up').count()
-    low_stock_items = InventoryItem.query.filter(InventoryItem.current_quantity <= InventoryItem.minimum_quantity).count()
-    expired_items = InventoryItem.query.filter(InventoryItem.expiration_date < date.today()).count()
-    pending_orders = Order.query.filter(Order.status.in_(['Submitted', 'Approved'])).count()
+    totals = stats_cache.get_or_compute('inventory.dashboard_totals', lambda: {
+        'total_items': InventoryItem.query.filter(InventoryItem.status != 'Used Up').count(),
+        'low_stock_items': InventoryItem.query.filter(InventoryItem.current_quantity <= InventoryItem.minimum_quantity).count(),
+        'expired_items': InventoryItem.query.filter(InventoryItem.expiration_date < date.today()).count(),
+        'pending_orders': Order.query.filter(Order.status.in_(['Submitted', 'Approved'])).count(),
+    })
     
     recent_usage = UsageLog.query.order_by(UsageLog.timestamp.desc()).limit(5).all()
     recent_orders = Order.query.order_by(Order.requested_date.desc()).limit(5).all()
     active_alerts = StockAlert.query.filter_by(is_active=True, is_acknowledged=False).limit(5).all()
     
     return render_template('inventory/dashboard.html',
-                         total_items=total_items,
-                         low_stock_items=low_stock_items,
-                         expired_items=expired_items,
-                         pending_orders=pending_orders,
+                         total_items=totals['total_items'],
+                         low_stock_items=totals['low_stock_items'],
+                         expired_items=totals['expired_items'],
+                         pending_orders=totals['pending_orders'],
                          recent_usage=recent_usage,
                          recent_orders=recent_orders,
                          active_alerts=active_alerts)
@@ -335,16 +339,16 @@ def shopping_cart():
 @login_required
 def shopping_cart_api():
     if request.method == 'GET':
-        cart_items = ShoppingCart.query.filter_by(user_id=current_user.id).all()
-        return jsonify([{
-            'id': item.id,
-            'item_name': item.item_name,
-            'catalog_number': item.catalog_number,
-            'supplier_name': item.supplier.name if item.supplier else '',
-            'quantity': item.quantity,
-            'unit': item.unit,
-            'estimated_price': item.estimated_price
-        } for item in cart_items])
+        # 只取列并连接供应商, 逐行编码输出, 不再逐条懒加载 supplier
+        rows = db.session.query(
+            ShoppingCart.id, ShoppingCart.item_name, ShoppingCart.catalog_number,
+            db.func.coalesce(Supplier.name, '').label('supplier_name'),
+            ShoppingCart.quantity, ShoppingCart.unit, ShoppingCart.estimated_price,
+        ).outerjoin(Supplier, ShoppingCart.supplier_id == Supplier.id)\
+         .filter(ShoppingCart.user_id == current_user.id)\
+         .order_by(ShoppingCart.id)\
+         .yield_per(STREAM_CHUNK_SIZE)
+        return stream_json_array(rows, serialize=lambda row: row._asdict())
     
     if request.method == 'POST':
         data = request.get_json()
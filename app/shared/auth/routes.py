@@ -1,5 +1,5 @@
 # In app/auth/routes.py
-from flask import render_template, redirect, url_for, flash, request, session
+from flask import render_template, redirect, url_for, flash, request
 from flask_login import login_user, logout_user, current_user, login_required
 from urllib.parse import urlparse
 
@@ -7,6 +7,7 @@ from ... import db                     # Import db from the app package (app/__i
 from . import bp                # Import bp from the current auth package (app/auth/__init__.py)
 from ...cell_storage.forms import LoginForm, UserCreationForm, ResetPasswordForm, UserEditForm
 from ...cell_storage.models import User
+from ...cell_storage.services import SelectionService
 from ..decorators import admin_required # Import our custom decorator
 
 @bp.route('/login', methods=['GET', 'POST'])
@@ -30,8 +31,8 @@ def login():
 @bp.route('/logout')
 @login_required
 def logout():
+    SelectionService.clear_all()
     logout_user()
-    session.pop('pickup_ids', None)
     flash('You have been logged out.', 'info')
     return redirect(url_for('auth.login'))
 
@@ -0,0 +1,142 @@
+"""
+Batch ID allocation.
+
+Batch IDs are handed out outside the caller's transaction so the counter is
+never locked for the length of a freeze:
+
+* On PostgreSQL the ``batch_id_seq`` sequence is used. ``nextval`` takes no
+  row lock and is not rolled back, so a failed freeze leaves a gap.
+* Elsewhere (SQLite) the ``batch_counter`` row in ``app_config`` is advanced
+  in its own short transaction. With ``BATCH_ID_BLOCK_SIZE`` > 1 each worker
+  reserves a block of IDs (hi/lo) and hands them out from memory, touching
+  the counter row once per block. IDs are then unique but not strictly in
+  creation order across workers, and unused IDs of a block are skipped when
+  the worker exits.
+
+``BATCH_ID_STRATEGY`` may force ``'sequence'`` or ``'counter'``; the default
+``'auto'`` picks the sequence on PostgreSQL.
+"""
+
+import threading
+
+from flask import current_app
+from sqlalchemy import func, select, text, update
+
+from .. import db
+from ..cell_storage.models import AppConfig, VialBatch
+
+SEQUENCE_NAME = 'batch_id_seq'
+COUNTER_KEY = 'batch_counter'
+
+
+class BatchIdAllocator:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._blocks = {}  # engine url -> [next id, end of block (exclusive)]
+        self._sequences_ready = set()
+
+    def use_sequence(self, engine=None):
+        engine = engine or db.engine
+        strategy = current_app.config.get('BATCH_ID_STRATEGY', 'auto')
+        if strategy == 'auto':
+            return engine.dialect.name == 'postgresql'
+        return strategy == 'sequence'
+
+    def next_id(self):
+        """Return a new batch ID; the allocation is committed immediately."""
+        engine = db.engine
+        if self.use_sequence(engine):
+            with engine.begin() as conn:
+                self._ensure_sequence(conn)
+                return conn.execute(text(f"SELECT nextval('{SEQUENCE_NAME}')")).scalar()
+
+        block_size = max(int(current_app.config.get('BATCH_ID_BLOCK_SIZE', 1)), 1)
+        key = str(engine.url)
+        with self._lock:
+            block = self._blocks.get(key)
+            if block is None or block[0] >= block[1]:
+                start = self._reserve(engine, block_size)
+                block = self._blocks[key] = [start, start + block_size]
+            value = block[0]
+            block[0] += 1
+            return value
+
+    def peek(self):
+        """The ID the next freeze is expected to get (display only)."""
+        engine = db.engine
+        if self.use_sequence(engine):
+            with engine.begin() as conn:
+                self._ensure_sequence(conn)
+                last_value, is_called = conn.execute(
+                    text(f'SELECT last_value, is_called FROM {SEQUENCE_NAME}')
+                ).one()
+            return last_value + 1 if is_called else last_value
+
+        with self._lock:
+            block = self._blocks.get(str(engine.url))
+            if block is not None and block[0] < block[1]:
+                return block[0]
+        with engine.begin() as conn:
+            return self._counter_value(conn)
+
+    def reset(self, value):
+        """Make ``value`` the next batch ID (admin override)."""
+        value = int(value)
+        engine = db.engine
+        if self.use_sequence(engine):
+            with engine.begin() as conn:
+                self._ensure_sequence(conn)
+                conn.execute(text(f"SELECT setval('{SEQUENCE_NAME}', :value, false)"), {'value': value})
+        with engine.begin() as conn:
+            self._counter_value(conn)
+            conn.execute(
+                update(AppConfig.__table__)
+                .where(AppConfig.__table__.c.key == COUNTER_KEY)
+                .values(value=str(value))
+            )
+        with self._lock:
+            # Blocks already reserved by other workers are used up first
+            self._blocks.pop(str(engine.url), None)
+
+    def _reserve(self, engine, size):
+        """Advance the counter row by ``size`` in its own transaction; returns the block start."""
+        with engine.begin() as conn:
+            start = self._counter_value(conn, for_update=True)
+            conn.execute(
+                update(AppConfig.__table__)
+                .where(AppConfig.__table__.c.key == COUNTER_KEY)
+                .values(value=str(start + size))
+            )
+        return start
+
+    def _counter_value(self, conn, for_update=False):
+        """Current counter value, creating the row from ``max(vial_batches.id) + 1`` if missing."""
+        table = AppConfig.__table__
+        query = select(table.c.value).where(table.c.key == COUNTER_KEY)
+        if for_update:
+            query = query.with_for_update()
+        value = conn.execute(query).scalar()
+        if value is None:
+            max_id = conn.execute(select(func.max(VialBatch.__table__.c.id))).scalar() or 0
+            conn.execute(table.insert().values(
+                key=COUNTER_KEY, value=str(max_id + 1), description='Next batch ID'
+            ))
+            return max_id + 1
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return 1
+
+    def _ensure_sequence(self, conn):
+        key = str(conn.engine.url)
+        if key in self._sequences_ready:
+            return
+        exists = conn.execute(text('SELECT to_regclass(CAST(:name AS text))'), {'name': SEQUENCE_NAME}).scalar()
+        if not exists:
+            # Continue from the legacy counter row so existing batch IDs are not reused
+            start = self._counter_value(conn)
+            conn.execute(text(f'CREATE SEQUENCE IF NOT EXISTS {SEQUENCE_NAME} START WITH {int(start)}'))
+        self._sequences_ready.add(key)
+
+
+batch_id_allocator = BatchIdAllocator()
@@ -0,0 +1,405 @@
+"""
+Incremental change feed for integrations and dashboards.
+
+``GET /api/changes?since=<cursor>`` returns the vials, batches, boxes and
+inventory items changed or deleted after the cursor, as NDJSON, followed by a
+line with the next cursor::
+
+    {"type":"vial","op":"upsert","id":12,"ts":"2025-01-01T10:00:00","data":{...}}
+    {"type":"vial","op":"delete","id":13,"ts":"2025-01-01T10:00:01"}
+    {"cursor":"...","has_more":false}
+
+Every transaction that writes a tracked row appends one ``change_log`` entry
+per row when it commits. ORM writes are picked up by session hooks, set-based
+statements call ``record_changes()``. A cursor must never move past an entry
+that a slow transaction commits later:
+
+* On PostgreSQL each entry stores the id of the writing transaction
+  (``pg_current_xact_id()``). Entries are read in ``(xid, id)`` order and only
+  below the ``xmin`` of the reader's snapshot, i.e. from transactions that
+  have all finished, so writers never wait for each other.
+* Elsewhere the entries are inserted in ``before_commit`` while holding a
+  lock on the ``change_log_lock`` row of ``app_config`` (SQLite serialises
+  writers anyway), so entry ids follow commit order and ``xid`` stays 0.
+
+Upserts carry the current compact row, so applying a line twice is harmless.
+A ``{"type":"all","op":"reset"}`` line means the database was cleared and the
+client should drop its copy.
+
+Without ``since`` the feed first pages through a snapshot of all current rows
+and then continues with the log; ``since=latest`` returns only the current
+cursor. Entries older than ``CHANGE_FEED_RETENTION_DAYS`` are pruned
+(``flask prune-change-log``, and at most hourly by the feed itself); a cursor
+from before that gets ``410 Gone`` and the client starts again without
+``since``.
+
+Clients authenticate with ``Authorization: Bearer <CHANGE_FEED_TOKEN>`` when a
+token is configured, otherwise as a logged-in user.
+"""
+
+import base64
+import json
+import time
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app, jsonify, request
+from sqlalchemy import and_, event, insert, or_, select, text
+
+from .json_provider import stream_ndjson
+
+# table name -> entity name used in the feed
+TRACKED_TABLES = {
+    'cryovials': 'vial',
+    'vial_batches': 'batch',
+    'boxes': 'box',
+    'inventory_items': 'item',
+}
+
+# app_config keys
+LOCK_KEY = 'change_log_lock'
+PRUNED_KEY = 'change_log_pruned_id'
+
+DEFAULT_LIMIT = 1000
+MAX_LIMIT = 5000
+
+# 由接口触发的清理每个进程最多每小时一次
+PRUNE_INTERVAL = 3600
+
+
+class CursorExpired(Exception):
+    """The log entries after the cursor have been pruned."""
+
+
+def _sources():
+    """entity -> (timestamp column, id column, data columns)."""
+    from ..cell_storage.models import Box, CryoVial, VialBatch
+    from ..inventory.models import InventoryItem
+    return {
+        'vial': (CryoVial.last_updated, CryoVial.id, [
+            CryoVial.unique_vial_id_tag.label('tag'), CryoVial.batch_id, CryoVial.cell_line_id,
+            CryoVial.box_id, CryoVial.row_in_box.label('row'), CryoVial.col_in_box.label('col'),
+            CryoVial.status,
+        ]),
+        'batch': (VialBatch.updated_at, VialBatch.id, [
+            VialBatch.name, VialBatch.created_by_user_id,
+        ]),
+        'box': (Box.updated_at, Box.id, [
+            Box.name, Box.drawer_id, Box.rows, Box.columns,
+        ]),
+        'item': (InventoryItem.updated_at, InventoryItem.id, [
+            InventoryItem.name, InventoryItem.barcode, InventoryItem.status,
+            InventoryItem.current_quantity, InventoryItem.minimum_quantity, InventoryItem.unit,
+            InventoryItem.location_id,
+        ]),
+    }
+
+
+def encode_cursor(position):
+    raw = json.dumps(position, separators=(',', ':'), sort_keys=True).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Inverse of ``encode_cursor``; raises ``ValueError`` on a malformed cursor.
+
+    A position is ``{'xid': x, 'seq': n}`` (the last entry read), plus
+    ``'snapshot': [entity, last_id]`` while the initial snapshot is being paged.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        position = json.loads(raw)
+        xid = int(position.get('xid', 0))
+        seq = int(position['seq'])
+        snapshot = position.get('snapshot')
+        if snapshot is not None:
+            entity, last_id = snapshot
+            if entity not in _sources():
+                raise ValueError(entity)
+            snapshot = [entity, int(last_id)]
+    except (ValueError, TypeError, KeyError, AttributeError) as e:
+        raise ValueError('Invalid cursor') from e
+    return {'xid': xid, 'seq': seq, 'snapshot': snapshot}
+
+
+def _uses_xid(bind):
+    return bind.dialect.name == 'postgresql'
+
+
+# -- writing -----------------------------------------------------------------
+
+def _pending(session):
+    # (entity, id) -> op of the current transaction; the last op wins
+    return session.info.setdefault('change_log', {})
+
+
+def record_changes(entity, ids, op='upsert', session=None):
+    """Log rows written with set-based statements; the entries are written on commit."""
+    if session is None:
+        from .. import db
+        session = db.session
+    pending = _pending(session)
+    for entity_id in ids:
+        pending[(entity, entity_id)] = op
+
+
+def record_reset(session=None):
+    """Tell feed clients that everything was deleted."""
+    record_changes('all', [0], 'reset', session)
+
+
+def register_change_hooks(session):
+    """Append the changes of tracked tables to ``change_log`` when the transaction commits."""
+
+    @event.listens_for(session, 'after_flush')
+    def _track_flush(sess, flush_context):
+        pending = _pending(sess)
+        for objects, op in ((sess.new, 'upsert'), (sess.dirty, 'upsert'), (sess.deleted, 'delete')):
+            for obj in objects:
+                table = getattr(obj, '__table__', None)
+                entity = TRACKED_TABLES.get(table.name) if table is not None else None
+                if entity and getattr(obj, 'id', None) is not None:
+                    pending[(entity, obj.id)] = op
+
+    @event.listens_for(session, 'before_commit')
+    def _write_log(sess):
+        if sess.in_nested_transaction():
+            return
+        sess.flush()  # 先 flush，最后一次 autoflush 的改动也要记录
+        pending = sess.info.pop('change_log', None)
+        if not pending:
+            return
+        from ..cell_storage.models import AppConfig, ChangeLogEntry
+        if _uses_xid(sess.get_bind()):
+            # 读取端按事务号排序并只读到快照的 xmin 为止，写入端无需加锁
+            xid = sess.execute(text('SELECT pg_current_xact_id()::text::bigint')).scalar()
+        else:
+            # 锁一直持有到提交，条目 id 的顺序即提交顺序
+            sess.execute(select(AppConfig.id).where(AppConfig.key == LOCK_KEY).with_for_update())
+            xid = 0
+        now = datetime.utcnow()
+        sess.execute(insert(ChangeLogEntry), [
+            {'entity': entity, 'entity_id': entity_id, 'op': op, 'xid': xid, 'changed_at': now}
+            for (entity, entity_id), op in pending.items()
+        ])
+
+    @event.listens_for(session, 'after_rollback')
+    def _discard(sess):
+        if sess.in_nested_transaction():
+            return
+        sess.info.pop('change_log', None)
+
+
+def _visible_entries():
+    """Entries in feed order, limited to finished transactions on PostgreSQL."""
+    from .. import db
+    from ..cell_storage.models import ChangeLogEntry
+    query = ChangeLogEntry.query
+    if _uses_xid(db.session.get_bind()):
+        horizon = db.session.execute(
+            text('SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint')
+        ).scalar()
+        query = query.filter(ChangeLogEntry.xid < horizon)
+    return query.order_by(ChangeLogEntry.xid, ChangeLogEntry.id)
+
+
+def _after(position):
+    from ..cell_storage.models import ChangeLogEntry
+    return or_(
+        ChangeLogEntry.xid > position['xid'],
+        and_(ChangeLogEntry.xid == position['xid'], ChangeLogEntry.id > position['seq']),
+    )
+
+
+def _position_key(position):
+    return position['xid'], position['seq']
+
+
+def prune(days):
+    """Delete log entries older than ``days`` days; returns how many were removed."""
+    from .. import db
+    from ..cell_storage.models import AppConfig, ChangeLogEntry
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    last = _visible_entries().filter(ChangeLogEntry.changed_at < cutoff)\
+        .order_by(None).order_by(ChangeLogEntry.xid.desc(), ChangeLogEntry.id.desc()).first()
+    if last is None:
+        return 0
+    boundary = {'xid': last.xid, 'seq': last.id}
+    removed = ChangeLogEntry.query.filter(~_after(boundary)).delete(synchronize_session=False)
+    row = AppConfig.query.filter_by(key=PRUNED_KEY).first()
+    if row is None:
+        row = AppConfig(key=PRUNED_KEY, description='Last change feed entry (xid:id) removed by retention')
+        db.session.add(row)
+    row.value = f'{last.xid}:{last.id}'
+    db.session.commit()
+    return removed
+
+
+# -- reading -----------------------------------------------------------------
+
+def latest_position():
+    """Position of the last entry a reader can see now."""
+    from ..cell_storage.models import ChangeLogEntry
+    last = _visible_entries().order_by(None)\
+        .order_by(ChangeLogEntry.xid.desc(), ChangeLogEntry.id.desc()).first()
+    return {'xid': last.xid, 'seq': last.id} if last is not None else {'xid': 0, 'seq': 0}
+
+
+def _pruned_position():
+    from .. import db
+    from ..cell_storage.models import AppConfig
+    value = db.session.execute(select(AppConfig.value).where(AppConfig.key == PRUNED_KEY)).scalar()
+    if not value:
+        return {'xid': 0, 'seq': 0}
+    xid, _, seq = value.rpartition(':')
+    return {'xid': int(xid or 0), 'seq': int(seq)}
+
+
+def _record(entity, row):
+    data = row._asdict()
+    ts = data.pop('ts')
+    return {'type': entity, 'op': 'upsert', 'id': data.pop('id'), 'ts': ts, 'data': data}
+
+
+def _current_rows(entity, ids):
+    """``{id: record}`` for the rows of ``entity`` among ``ids`` that still exist."""
+    from .. import db
+    ts_column, id_column, columns = _sources()[entity]
+    ids = sorted(ids)
+    result = {}
+    for start in range(0, len(ids), 500):
+        query = db.session.query(ts_column.label('ts'), id_column.label('id'), *columns)\
+            .filter(id_column.in_(ids[start:start + 500]))
+        for row in query:
+            result[row.id] = _record(entity, row)
+    return result
+
+
+def read_snapshot(position, limit):
+    """``(records, next_position, has_more)`` for the next page of the initial snapshot."""
+    from .. import db
+    records = []
+    entities = list(_sources())
+    entity, last_id = position['snapshot']
+    for entity in entities[entities.index(entity):]:
+        ts_column, id_column, columns = _sources()[entity]
+        rows = db.session.query(ts_column.label('ts'), id_column.label('id'), *columns)\
+            .filter(id_column > last_id)\
+            .order_by(id_column)\
+            .limit(limit - len(records))\
+            .all()
+        records.extend(_record(entity, row) for row in rows)
+        if len(records) == limit:
+            return records, dict(position, snapshot=[entity, rows[-1].id]), True
+        last_id = 0
+    # 快照期间写入的条目接在快照开始时的位置之后
+    next_position = {'xid': position['xid'], 'seq': position['seq']}
+    return records, next_position, _position_key(latest_position()) > _position_key(next_position)
+
+
+def read_changes(position, limit):
+    """``(records, next_position, has_more)`` for the log entries after ``position``."""
+    if _position_key(position) < _position_key(_pruned_position()):
+        raise CursorExpired()
+    entries = _visible_entries().filter(_after(position)).limit(limit).all()
+    if not entries:
+        return [], {'xid': position['xid'], 'seq': position['seq']}, False
+
+    # One line per record and page, in the order of its last entry
+    latest = {}
+    for entry in entries:
+        latest.pop((entry.entity, entry.entity_id), None)
+        latest[(entry.entity, entry.entity_id)] = entry
+    ids = {}
+    for entity, entity_id in latest:
+        if entity in TRACKED_TABLES.values():
+            ids.setdefault(entity, set()).add(entity_id)
+    current = {entity: _current_rows(entity, entity_ids) for entity, entity_ids in ids.items()}
+
+    records = []
+    for (entity, entity_id), entry in latest.items():
+        if entry.op == 'reset':
+            records.append({'type': entity, 'op': 'reset', 'id': entity_id, 'ts': entry.changed_at})
+            continue
+        # 以当前行为准：仍存在就发 upsert（回滚的保存点也可能留下 delete 条目），
+        # 不存在时只发 delete，upsert 之后又被删的行由后面的 delete 条目处理
+        record = current[entity].get(entity_id)
+        if record is not None:
+            records.append(record)
+        elif entry.op == 'delete':
+            records.append({'type': entity, 'op': 'delete', 'id': entity_id, 'ts': entry.changed_at})
+    return records, {'xid': entries[-1].xid, 'seq': entries[-1].id}, len(entries) == limit
+
+
+class ChangeFeed:
+    def __init__(self):
+        self.token = None
+        self.retention_days = 30
+        self._pruned_at = None
+
+    def init_app(self, app):
+        self.token = app.config.get('CHANGE_FEED_TOKEN') or None
+        self.retention_days = int(app.config.get('CHANGE_FEED_RETENTION_DAYS', 30))
+        app.extensions['change_feed'] = self
+        app.add_url_rule('/api/changes', 'change_feed', self._changes_view)
+
+        @app.cli.command('prune-change-log')
+        @click.option('--days', type=int, default=None,
+                      help='Keep this many days of entries (default: CHANGE_FEED_RETENTION_DAYS).')
+        def prune_change_log_command(days):
+            """Delete change feed entries older than the retention period."""
+            removed = prune(self.retention_days if days is None else days)
+            click.echo(f'Removed {removed} change log entries.')
+
+    def _authorised(self):
+        if self.token and request.headers.get('Authorization') == f'Bearer {self.token}':
+            return True
+        from flask_login import current_user
+        return current_user.is_authenticated
+
+    def _maybe_prune(self):
+        now = time.monotonic()
+        if self._pruned_at is not None and now - self._pruned_at < PRUNE_INTERVAL:
+            return
+        self._pruned_at = now
+        try:
+            prune(self.retention_days)
+        except Exception as e:  # 清理失败不影响读取
+            from .. import db
+            db.session.rollback()
+            current_app.logger.warning(f'Change log pruning failed: {e}')
+
+    def _changes_view(self):
+        if not self._authorised():
+            return jsonify({'error': 'Authentication required'}), 401
+        self._maybe_prune()
+
+        since = request.args.get('since', '').strip()
+        if since == 'latest':
+            cursor = encode_cursor(latest_position())
+            return self._response([{'cursor': cursor, 'has_more': False}], cursor)
+
+        try:
+            position = decode_cursor(since) if since else dict(latest_position(), snapshot=['vial', 0])
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        limit = max(1, min(request.args.get('limit', DEFAULT_LIMIT, type=int), MAX_LIMIT))
+
+        try:
+            if position['snapshot']:
+                records, next_position, has_more = read_snapshot(position, limit)
+            else:
+                records, next_position, has_more = read_changes(position, limit)
+        except CursorExpired:
+            return jsonify({'error': 'Cursor expired, start again without since'}), 410
+
+        cursor = encode_cursor(next_position)
+        records.append({'cursor': cursor, 'has_more': has_more})
+        return self._response(records, cursor)
+
+    @staticmethod
+    def _response(records, cursor):
+        return stream_ndjson(records, headers={'X-Next-Cursor': cursor, 'Cache-Control': 'no-store'})
+
+
+change_feed = ChangeFeed()
@@ -0,0 +1,38 @@
+"""
+Per-connection database settings.
+
+PostgreSQL timeouts are set once when the pool opens a connection, so they
+work the same way for the Cloud SQL connector (pg8000) and for psycopg /
+psycopg2 URLs. A value of 0 leaves the server default (no limit).
+"""
+
+import weakref
+
+from sqlalchemy import event
+
+_configured_engines = weakref.WeakSet()
+
+
+def apply_session_timeouts(engine, statement_timeout_ms=0, idle_in_transaction_timeout_ms=0):
+    """Set ``statement_timeout`` / ``idle_in_transaction_session_timeout`` on new PostgreSQL connections."""
+    if engine.dialect.name != 'postgresql' or engine in _configured_engines:
+        return
+    _configured_engines.add(engine)
+    settings = [
+        ('statement_timeout', int(statement_timeout_ms or 0)),
+        ('idle_in_transaction_session_timeout', int(idle_in_transaction_timeout_ms or 0)),
+    ]
+    settings = [(name, value) for name, value in settings if value > 0]
+    if not settings:
+        return
+
+    @event.listens_for(engine, 'connect')
+    def _set_timeouts(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in settings:
+                cursor.execute(f'SET {name} = {value}')
+        finally:
+            cursor.close()
+        # 驱动默认开启事务; 提交后设置才会保留在会话中, 不会被连接池的 rollback 撤销
+        dbapi_connection.commit()
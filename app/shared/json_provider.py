@@ -0,0 +1,144 @@
+"""
+JSON encoding for ``jsonify`` and the API routes.
+
+``init_json_provider()`` installs ``OrjsonProvider`` when the optional
+``orjson`` package is installed (and ``JSON_USE_ORJSON`` is on), otherwise
+``StdlibProvider``. Both write ``date`` / ``datetime`` values as ISO 8601
+(``2025-01-31``, ``2025-01-31T10:00:00``) instead of Flask's HTTP date format,
+and ``Decimal`` / ``UUID`` values as strings, so responses are the same with
+either provider.
+
+Large result sets do not need to be built as one list first:
+``stream_json_array()`` and ``stream_ndjson()`` encode the items of any
+iterable, e.g. ``query.yield_per(500)``, in chunks while the response is
+being sent. The request context stays open until the stream ends.
+"""
+
+import dataclasses
+import decimal
+import json
+import uuid
+from datetime import date
+
+from flask import current_app, stream_with_context
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # optional dependency
+    orjson = None
+
+# Items encoded per chunk of a streamed response
+STREAM_CHUNK_SIZE = 500
+
+
+def _default(o):
+    if isinstance(o, date):
+        return o.isoformat()
+    if isinstance(o, (decimal.Decimal, uuid.UUID)):
+        return str(o)
+    if dataclasses.is_dataclass(o) and not isinstance(o, type):
+        return dataclasses.asdict(o)
+    if hasattr(o, '__html__'):
+        return str(o.__html__())
+    raise TypeError(f'Object of type {type(o).__name__} is not JSON serializable')
+
+
+class StdlibProvider(DefaultJSONProvider):
+    """Flask's default provider with ISO 8601 dates."""
+
+    default = staticmethod(_default)
+
+    def encode(self, obj):
+        """Compact UTF-8 bytes of ``obj``."""
+        return json.dumps(
+            obj, default=_default, ensure_ascii=False, separators=(',', ':'), sort_keys=self.sort_keys
+        ).encode('utf-8')
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """orjson-backed provider; ``dumps()`` calls with stdlib options fall back to ``json``."""
+
+    default = staticmethod(_default)
+
+    def _options(self, pretty=False):
+        option = orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if pretty:
+            option |= orjson.OPT_INDENT_2
+        return option
+
+    def encode(self, obj):
+        """Compact UTF-8 bytes of ``obj``."""
+        return orjson.dumps(obj, default=_default, option=self._options())
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            # indent / separators / cls ... only exist in the stdlib encoder
+            return super().dumps(obj, **kwargs)
+        return self.encode(obj).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        pretty = self.compact is False or (self.compact is None and self._app.debug)
+        body = orjson.dumps(obj, default=_default, option=self._options(pretty) | orjson.OPT_APPEND_NEWLINE)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+def init_json_provider(app):
+    if orjson is not None and app.config.get('JSON_USE_ORJSON', True):
+        app.json = OrjsonProvider(app)
+    else:
+        app.json = StdlibProvider(app)
+
+
+def _encode(obj):
+    provider = current_app.json
+    encode = getattr(provider, 'encode', None)
+    return encode(obj) if encode else provider.dumps(obj).encode('utf-8')
+
+
+def _chunks(items, chunk_size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def stream_json_array(items, serialize=None, status=200, headers=None, chunk_size=STREAM_CHUNK_SIZE):
+    """Streamed ``application/json`` response of ``[serialize(item), ...]``."""
+
+    def generate():
+        yield b'['
+        first = True
+        for chunk in _chunks(items, chunk_size):
+            body = b','.join(_encode(serialize(item) if serialize else item) for item in chunk)
+            yield body if first else b',' + body
+            first = False
+        yield b']\n'
+
+    return current_app.response_class(
+        stream_with_context(generate()), status=status, headers=headers, mimetype='application/json'
+    )
+
+
+def stream_ndjson(items, serialize=None, status=200, headers=None, chunk_size=STREAM_CHUNK_SIZE):
+    """Streamed ``application/x-ndjson`` response, one ``serialize(item)`` per line."""
+
+    def generate():
+        for chunk in _chunks(items, chunk_size):
+            yield b''.join(_encode(serialize(item) if serialize else item) + b'\n' for item in chunk)
+
+    return current_app.response_class(
+        stream_with_context(generate()), status=status, headers=headers, mimetype='application/x-ndjson'
+    )
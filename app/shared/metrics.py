@@ -0,0 +1,330 @@
+"""
+Prometheus-style application metrics.
+
+Metrics are declared in ``METRICS`` and updated with ``metrics.inc()`` /
+``metrics.observe()``. Request hooks record, per blueprint endpoint, a
+latency histogram, the DB time reported by the query profiler and the
+response size. ``/metrics`` renders everything in the Prometheus text
+format (0.0.4).
+
+Values live in memory per process. With gunicorn, set ``METRICS_DIR`` to a
+directory shared by the workers of a host: each worker writes its values to
+``metrics_<pid>.json`` there (at most every ``METRICS_FLUSH_SECONDS`` and at
+exit), and ``/metrics`` sums the files of all workers. Counters of workers
+that have exited stay in the total: on the next scrape their files are folded
+into ``metrics_exited.json``, so the directory does not grow with every
+restarted worker.
+
+``/metrics`` requires ``Authorization: Bearer <METRICS_TOKEN>`` when a token
+is configured, otherwise a logged-in admin.
+"""
+
+import atexit
+import glob
+import json
+import os
+import re
+import threading
+import time
+
+from flask import Response, abort, g, request
+
+try:
+    import fcntl
+except ImportError:  # not on Windows; exited workers' files are then kept
+    fcntl = None
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# name -> (type, help, buckets)
+METRICS = {
+    'cellstorage_http_requests_total': (
+        'counter', 'HTTP requests by endpoint, method and status.', None),
+    'cellstorage_http_request_duration_seconds': (
+        'histogram', 'Request latency by endpoint.', LATENCY_BUCKETS),
+    'cellstorage_http_request_db_seconds': (
+        'histogram', 'Time spent in SQL statements per request, by endpoint.', LATENCY_BUCKETS),
+    'cellstorage_http_response_size_bytes': (
+        'histogram', 'Response body size by endpoint.', SIZE_BUCKETS),
+    'cellstorage_alerts_generated_total': (
+        'counter', 'Alerts created by alert generation, by alert type.', None),
+    'cellstorage_imports_total': (
+        'counter', 'Import files processed, by kind and outcome.', None),
+    'cellstorage_import_rows_total': (
+        'counter', 'Rows written by imports, by kind.', None),
+    'cellstorage_stats_cache_requests_total': (
+        'counter', 'Dashboard statistics cache lookups, by metric and result.', None),
+}
+
+_START_KEY = '_metrics_start'
+
+_WORKER_FILE_RE = re.compile(r'metrics_(\d+)\.json$')
+EXITED_FILE = 'metrics_exited.json'
+
+
+def _label_key(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = []
+    for key, value in pairs:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        escaped.append(f'{key}="{value}"')
+    return '{' + ','.join(escaped) + '}'
+
+
+def _pid_alive(pid):
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # exists, owned by another user
+    return True
+
+
+def _merge(snapshots):
+    """Sum snapshots into ``(counters, histograms)`` keyed by ``(name, labels)``."""
+    counters = {}
+    histograms = {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot['counters']:
+            key = (name, tuple(tuple(pair) for pair in labels))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, data in snapshot['histograms']:
+            key = (name, tuple(tuple(pair) for pair in labels))
+            merged = histograms.get(key)
+            if merged is None or len(merged) != len(data):
+                histograms[key] = list(data)
+            else:
+                histograms[key] = [a + b for a, b in zip(merged, data)]
+    return counters, histograms
+
+
+def _format_value(value):
+    if value == int(value):
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metrics:
+    def __init__(self):
+        self.enabled = False
+        self.directory = None
+        self.flush_seconds = 1.0
+        self.token = None
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._counters = {}    # (name, labels) -> value
+        self._histograms = {}  # (name, labels) -> [bucket counts..., +Inf count, sum]
+        self._last_flush = 0.0
+        self._atexit_registered = False
+
+    def init_app(self, app):
+        self.enabled = app.config.get('METRICS_ENABLED', True)
+        self.directory = app.config.get('METRICS_DIR') or None
+        self.flush_seconds = float(app.config.get('METRICS_FLUSH_SECONDS', 1.0))
+        self.token = app.config.get('METRICS_TOKEN') or None
+        app.extensions['metrics'] = self
+        if not self.enabled:
+            return
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            if not self._atexit_registered:
+                atexit.register(self.flush)
+                self._atexit_registered = True
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+        app.add_url_rule('/metrics', 'metrics', self._metrics_view)
+
+    # -- recording ---------------------------------------------------------
+
+    def inc(self, name, amount=1, **labels):
+        if not self.enabled or amount == 0:
+            return
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._check_fork()
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        if not self.enabled:
+            return
+        buckets = METRICS[name][2]
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._check_fork()
+            data = self._histograms.get(key)
+            if data is None:
+                data = self._histograms[key] = [0] * (len(buckets) + 2)
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    data[i] += 1
+                    break
+            else:
+                data[len(buckets)] += 1
+            data[-1] += value
+
+    def _check_fork(self):
+        # Values copied from the parent process (e.g. gunicorn --preload) belong to the parent
+        if os.getpid() != self._pid:
+            self._pid = os.getpid()
+            self._counters.clear()
+            self._histograms.clear()
+            self._last_flush = 0.0
+
+    # -- request hooks -----------------------------------------------------
+
+    def _start_request(self):
+        setattr(g, _START_KEY, time.perf_counter())
+
+    def _finish_request(self, response):
+        start = g.get(_START_KEY)
+        if start is None:
+            return response
+        # Unmatched URLs share one label so that scanners cannot blow up the series count
+        endpoint = request.endpoint or 'unmatched'
+        self.inc('cellstorage_http_requests_total', endpoint=endpoint,
+                 method=request.method, status=response.status_code)
+        self.observe('cellstorage_http_request_duration_seconds',
+                     time.perf_counter() - start, endpoint=endpoint)
+
+        from .query_profiler import query_profiler
+        profile = query_profiler.current()
+        if profile is not None:
+            self.observe('cellstorage_http_request_db_seconds', profile['db_time'], endpoint=endpoint)
+
+        if not response.is_streamed and response.content_length is not None:
+            self.observe('cellstorage_http_response_size_bytes', response.content_length, endpoint=endpoint)
+
+        if self.directory and time.time() - self._last_flush >= self.flush_seconds:
+            self.flush()
+        return response
+
+    # -- multi-process files -----------------------------------------------
+
+    def _snapshot(self):
+        with self._lock:
+            self._check_fork()
+            return {
+                'counters': [[name, list(labels), value] for (name, labels), value in self._counters.items()],
+                'histograms': [[name, list(labels), list(data)] for (name, labels), data in self._histograms.items()],
+            }
+
+    def flush(self):
+        """Write this worker's values to ``METRICS_DIR`` (no-op without a directory)."""
+        if not self.directory:
+            return
+        snapshot = self._snapshot()
+        path = os.path.join(self.directory, f'metrics_{os.getpid()}.json')
+        tmp_path = f'{path}.tmp'
+        try:
+            with open(tmp_path, 'w') as fh:
+                json.dump(snapshot, fh)
+            os.replace(tmp_path, path)
+            self._last_flush = time.time()
+        except OSError:
+            pass
+
+    def prune(self):
+        """Fold the files of exited workers into ``metrics_exited.json`` and remove them."""
+        if not self.directory or fcntl is None:
+            return
+        exited = []
+        for path in glob.glob(os.path.join(self.directory, 'metrics_*.json')):
+            match = _WORKER_FILE_RE.search(os.path.basename(path))
+            if match and not _pid_alive(int(match.group(1))):
+                exited.append(path)
+        if not exited:
+            return
+        try:
+            with open(os.path.join(self.directory, '.lock'), 'w') as lock:
+                # Serialises workers that scrape at the same time
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                snapshots = []
+                archive = os.path.join(self.directory, EXITED_FILE)
+                for path in [archive] + exited:
+                    try:
+                        with open(path) as fh:
+                            snapshots.append(json.load(fh))
+                    except FileNotFoundError:
+                        continue  # no archive yet, or already folded by another worker
+                    except ValueError:
+                        pass  # cut short when its worker died; nothing to keep
+                counters, histograms = _merge(snapshots)
+                tmp_path = f'{archive}.tmp'
+                with open(tmp_path, 'w') as fh:
+                    json.dump({
+                        'counters': [[name, list(labels), value] for (name, labels), value in counters.items()],
+                        'histograms': [[name, list(labels), data] for (name, labels), data in histograms.items()],
+                    }, fh)
+                os.replace(tmp_path, archive)
+                for path in exited:
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+        except OSError:
+            pass
+
+    def collect(self):
+        """Merged ``(counters, histograms)`` of all workers (or of this process)."""
+        if self.directory:
+            self.flush()
+            self.prune()
+            snapshots = []
+            for path in glob.glob(os.path.join(self.directory, 'metrics_*.json')):
+                try:
+                    with open(path) as fh:
+                        snapshots.append(json.load(fh))
+                except (OSError, ValueError):
+                    continue  # being replaced by its worker
+        else:
+            snapshots = [self._snapshot()]
+        return _merge(snapshots)
+
+    # -- exposition --------------------------------------------------------
+
+    def render(self):
+        counters, histograms = self.collect()
+        lines = []
+        for name, (kind, help_text, buckets) in METRICS.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            if kind == 'counter':
+                for (metric, labels), value in sorted(counters.items()):
+                    if metric == name:
+                        lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+                continue
+            for (metric, labels), data in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(buckets, data):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{_format_labels(labels, [("le", bound)])} {cumulative}')
+                count = cumulative + data[len(buckets)]
+                lines.append(f'{name}_bucket{_format_labels(labels, [("le", "+Inf")])} {count}')
+                lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(data[-1])}')
+                lines.append(f'{name}_count{_format_labels(labels)} {count}')
+        return '\n'.join(lines) + '\n'
+
+    def _metrics_view(self):
+        if self.token:
+            if request.headers.get('Authorization') != f'Bearer {self.token}':
+                abort(401)
+        else:
+            from flask_login import current_user
+            if not (current_user.is_authenticated and current_user.is_admin):
+                abort(403)
+        return Response(self.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+metrics = Metrics()
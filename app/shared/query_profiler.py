@@ -0,0 +1,179 @@
+"""
+Per-request SQL profiling and N+1 detection.
+
+Engine ``before/after_cursor_execute`` hooks count and time every statement
+issued while a request is handled. At the end of the request:
+
+* ``X-Query-Count`` and ``Server-Timing`` (``db`` and ``app``) headers are
+  added to the response;
+* statement shapes (SQL with literals and ``IN`` lists collapsed) repeated at
+  least ``N_PLUS_ONE_THRESHOLD`` times are logged as a likely N+1 pattern,
+  together with the view name;
+* statements slower than ``SLOW_QUERY_MS`` are logged when they finish.
+
+Per-endpoint totals, recent N+1 findings and slow queries are kept in memory
+per worker process and shown on ``/admin/perf``.
+"""
+
+import re
+import threading
+import time
+from collections import Counter, deque
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+_WHITESPACE_RE = re.compile(r'\s+')
+_PARAM = r'(?:\?|%\(\w+\)s|%s|\$\d+|:\w+|\d+(?:\.\d+)?|\'[^\']*\')'
+_PARAM_LIST_RE = re.compile(r'\(\s*' + _PARAM + r'(?:\s*,\s*' + _PARAM + r')*\s*\)')
+_LITERAL_RE = re.compile(r"'[^']*'|\b\d+(?:\.\d+)?\b")
+
+_PROFILE_KEY = '_query_profile'
+
+
+def statement_shape(statement):
+    """Normalise ``statement`` so that queries differing only in parameters compare equal."""
+    shape = _WHITESPACE_RE.sub(' ', statement).strip()
+    shape = _PARAM_LIST_RE.sub('(?)', shape)
+    return _LITERAL_RE.sub('?', shape)
+
+
+class QueryProfiler:
+    def __init__(self):
+        self.enabled = False
+        self.slow_query_ms = 200
+        self.n_plus_one_threshold = 5
+        self._lock = threading.Lock()
+        self._endpoints = {}
+        self._n_plus_one = deque(maxlen=50)
+        self._slow_queries = deque(maxlen=50)
+        self._listening = False
+
+    def init_app(self, app):
+        self.enabled = app.config.get('QUERY_PROFILER_ENABLED', True)
+        self.slow_query_ms = app.config.get('SLOW_QUERY_MS', 200)
+        self.n_plus_one_threshold = app.config.get('N_PLUS_ONE_THRESHOLD', 5)
+        app.extensions['query_profiler'] = self
+        if not self.enabled:
+            return
+        if not self._listening:
+            event.listen(Engine, 'before_cursor_execute', self._before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', self._after_cursor_execute)
+            self._listening = True
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+
+    # -- per request -------------------------------------------------------
+
+    @staticmethod
+    def current():
+        """Profile of the current request, or ``None`` outside a profiled request."""
+        if not has_request_context():
+            return None
+        return g.get(_PROFILE_KEY)
+
+    def _start_request(self):
+        setattr(g, _PROFILE_KEY, {
+            'start': time.perf_counter(),
+            'count': 0,
+            'db_time': 0.0,
+            'shapes': Counter(),
+        })
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start_time', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get('query_start_time')
+        if not starts:
+            return
+        elapsed = time.perf_counter() - starts.pop()
+        profile = self.current()
+        if profile is None:
+            return
+        profile['count'] += 1
+        profile['db_time'] += elapsed
+        profile['shapes'][statement_shape(statement)] += 1
+        if elapsed * 1000 >= self.slow_query_ms:
+            endpoint = request.endpoint or request.path
+            current_app.logger.warning(f'Slow query ({elapsed * 1000:.1f} ms) in {endpoint}: {statement[:500]}')
+            with self._lock:
+                self._slow_queries.appendleft({
+                    'endpoint': endpoint,
+                    'duration_ms': round(elapsed * 1000, 1),
+                    'statement': statement[:1000],
+                    'at': time.time(),
+                })
+
+    def _finish_request(self, response):
+        # The profile stays on ``g`` so later after_request hooks (metrics) can read it
+        profile = g.get(_PROFILE_KEY)
+        if profile is None:
+            return response
+        total = time.perf_counter() - profile['start']
+        db_ms = profile['db_time'] * 1000
+        response.headers['X-Query-Count'] = str(profile['count'])
+        response.headers['Server-Timing'] = (
+            f'db;dur={db_ms:.1f};desc="{profile["count"]} queries", app;dur={total * 1000:.1f}'
+        )
+
+        endpoint = request.endpoint or 'unknown'
+        repeated = [
+            (shape, count) for shape, count in profile['shapes'].most_common()
+            if count >= self.n_plus_one_threshold
+        ]
+        for shape, count in repeated:
+            current_app.logger.warning(f'Possible N+1 in {endpoint}: {count}x {shape[:300]}')
+
+        with self._lock:
+            stats = self._endpoints.setdefault(endpoint, {
+                'requests': 0, 'queries': 0, 'max_queries': 0,
+                'db_ms': 0.0, 'total_ms': 0.0, 'n_plus_one': 0,
+            })
+            stats['requests'] += 1
+            stats['queries'] += profile['count']
+            stats['max_queries'] = max(stats['max_queries'], profile['count'])
+            stats['db_ms'] += db_ms
+            stats['total_ms'] += total * 1000
+            if repeated:
+                stats['n_plus_one'] += 1
+                for shape, count in repeated:
+                    self._n_plus_one.appendleft({
+                        'endpoint': endpoint,
+                        'path': request.path,
+                        'count': count,
+                        'statement': shape[:1000],
+                        'at': time.time(),
+                    })
+        return response
+
+    # -- reporting ---------------------------------------------------------
+
+    def top_endpoints(self, limit=25):
+        """Endpoints ordered by total DB time, with per-request averages."""
+        with self._lock:
+            rows = [dict(stats, endpoint=name) for name, stats in self._endpoints.items()]
+        for row in rows:
+            row['avg_queries'] = row['queries'] / row['requests']
+            row['avg_db_ms'] = row['db_ms'] / row['requests']
+            row['avg_total_ms'] = row['total_ms'] / row['requests']
+        rows.sort(key=lambda row: row['db_ms'], reverse=True)
+        return rows[:limit]
+
+    def n_plus_one_findings(self):
+        with self._lock:
+            return list(self._n_plus_one)
+
+    def slow_queries(self):
+        with self._lock:
+            return list(self._slow_queries)
+
+    def reset(self):
+        with self._lock:
+            self._endpoints.clear()
+            self._n_plus_one.clear()
+            self._slow_queries.clear()
+
+
+query_profiler = QueryProfiler()
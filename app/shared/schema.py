@@ -0,0 +1,201 @@
+"""
+Schema management.
+
+Schema changes are applied by the ``flask migrate-db`` command instead of on
+every process start. Each migration has a version number; the highest applied
+version is stored in the ``schema_version`` row of ``app_config``.
+
+``create_app`` only reads that row. When the database is behind it runs the
+pending migrations itself if ``AUTO_MIGRATE`` is set (handy for local SQLite
+development); otherwise it raises ``SchemaOutOfDateError`` so that a server
+never starts against tables it cannot query. Flask CLI commands (``flask
+migrate-db`` itself, ``flask shell``) only log a warning.
+
+Migrations must be idempotent: databases created before this module existed
+start at version 0 and run the baseline against tables that already exist.
+"""
+
+from datetime import datetime
+
+import click
+from sqlalchemy import bindparam, inspect, select, text
+from sqlalchemy.exc import SQLAlchemyError
+
+from .. import db
+
+SCHEMA_VERSION_KEY = 'schema_version'
+
+
+class SchemaOutOfDateError(RuntimeError):
+    """The database has pending migrations."""
+
+
+class MigrationError(RuntimeError):
+    """A migration cannot be applied until the data is fixed; nothing was recorded."""
+
+# (version, description, function), in version order
+MIGRATIONS = []
+
+
+def migration(version, description):
+    """Register ``func()`` as the migration to ``version``."""
+    def decorator(func):
+        MIGRATIONS.append((version, description, func))
+        MIGRATIONS.sort(key=lambda entry: entry[0])
+        return func
+    return decorator
+
+
+def latest_version():
+    return MIGRATIONS[-1][0] if MIGRATIONS else 0
+
+
+def current_version():
+    """Applied schema version; 0 for a new or pre-migration database."""
+    from ..cell_storage.models import AppConfig
+    try:
+        value = db.session.execute(
+            select(AppConfig.value).where(AppConfig.key == SCHEMA_VERSION_KEY)
+        ).scalar()
+    except SQLAlchemyError:
+        db.session.rollback()
+        return 0
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def pending_migrations():
+    version = current_version()
+    return [entry for entry in MIGRATIONS if entry[0] > version]
+
+
+def migrate(echo=None):
+    """Run every pending migration, committing the version after each one."""
+    from ..cell_storage.models import AppConfig
+    applied = []
+    for version, description, func in pending_migrations():
+        if echo:
+            echo(f'Applying {version}: {description}')
+        try:
+            func()
+        except Exception:
+            db.session.rollback()
+            raise
+        row = AppConfig.query.filter_by(key=SCHEMA_VERSION_KEY).first()
+        if row is None:
+            row = AppConfig(key=SCHEMA_VERSION_KEY, description='Applied database schema version')
+            db.session.add(row)
+        row.value = str(version)
+        db.session.commit()
+        applied.append(version)
+    return applied
+
+
+def check_schema(app):
+    """Startup check: one query, no DDL unless ``AUTO_MIGRATE`` is enabled."""
+    version = current_version()
+    if version >= latest_version():
+        return
+    if app.config.get('AUTO_MIGRATE'):
+        migrate(echo=app.logger.info)
+        return
+    message = (
+        f'Database schema is at version {version}, expected {latest_version()}. '
+        f'Run "flask --app run migrate-db".'
+    )
+    if click.get_current_context(silent=True) is not None:
+        # Loaded by a CLI command, which must still be able to run migrate-db
+        app.logger.warning(message)
+        return
+    raise SchemaOutOfDateError(message)
+
+
+def register_commands(app):
+    @app.cli.command('migrate-db')
+    @click.option('--status', is_flag=True, help='Show the schema version without migrating.')
+    def migrate_db_command(status):
+        """Create missing tables and apply pending schema migrations."""
+        if status:
+            click.echo(f'Schema version: {current_version()} (latest {latest_version()})')
+            for version, description, _ in pending_migrations():
+                click.echo(f'  pending {version}: {description}')
+            return
+        try:
+            applied = migrate(echo=click.echo)
+        except MigrationError as e:
+            raise click.ClickException(str(e))
+        click.echo(f'Applied {len(applied)} migration(s); schema version {current_version()}.')
+
+
+def _column_exists(table, column):
+    return any(col['name'] == column for col in inspect(db.engine).get_columns(table))
+
+
+@migration(1, 'Baseline: create tables, users.password_plain, occupied-slot index, batch counter')
+def _baseline():
+    from ..cell_storage import models as cell_models  # noqa: F401 (registers the tables)
+    from ..inventory import models as inventory_models  # noqa: F401
+    from .batch_ids import batch_id_allocator
+
+    db.create_all()
+    if not _column_exists('users', 'password_plain'):
+        db.session.execute(text('ALTER TABLE users ADD COLUMN password_plain VARCHAR(128)'))
+    # 同一位置只允许一个 Available 冻存管（部分唯一索引，旧库在此补建）。
+    # 下单与放置不再预先检查位置，索引必须存在，因此重复占用时迁移失败而不是跳过
+    duplicates = db.session.execute(text(
+        "SELECT box_id, row_in_box, col_in_box, COUNT(*) FROM cryovials "
+        "WHERE status = 'Available' AND box_id IS NOT NULL "
+        "GROUP BY box_id, row_in_box, col_in_box HAVING COUNT(*) > 1 "
+        "ORDER BY box_id, row_in_box, col_in_box"
+    )).all()
+    if duplicates:
+        slots = ', '.join(f'box {box_id} R{row}C{col} ({count} vials)' for box_id, row, col, count in duplicates[:20])
+        more = f' and {len(duplicates) - 20} more' if len(duplicates) > 20 else ''
+        raise MigrationError(
+            f'Cannot create uq_cryovials_occupied_slot: {len(duplicates)} slot(s) hold more than one '
+            f'Available vial: {slots}{more}. Move or change the status of the extra vials, then run '
+            f'migrate-db again.'
+        )
+    db.session.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_cryovials_occupied_slot "
+        "ON cryovials (box_id, row_in_box, col_in_box) WHERE status = 'Available'"
+    ))
+    db.session.commit()
+    # Ensure batch counter config exists
+    batch_id_allocator.peek()
+
+
+@migration(2, 'Change feed: updated_at on batches and boxes, change timestamp indexes, change_log table')
+def _change_feed():
+    from ..cell_storage import models as cell_models
+    from ..inventory import models as inventory_models  # noqa: F401
+    from .change_feed import LOCK_KEY
+
+    db.create_all()  # tables added since the baseline, including change_log
+    for table in ('vial_batches', 'boxes'):
+        if not _column_exists(table, 'updated_at'):
+            db.session.execute(text(f'ALTER TABLE {table} ADD COLUMN updated_at TIMESTAMP'))
+    # Bound through DateTime so that SQLite stores the same text format as ORM writes
+    now = bindparam('now', datetime.utcnow(), type_=db.DateTime)
+    db.session.execute(text(
+        'UPDATE vial_batches SET updated_at = COALESCE("timestamp", :now) WHERE updated_at IS NULL'
+    ).bindparams(now))
+    db.session.execute(text('UPDATE boxes SET updated_at = :now WHERE updated_at IS NULL').bindparams(now))
+    db.session.execute(text(
+        'UPDATE cryovials SET last_updated = COALESCE(date_created, :now) WHERE last_updated IS NULL'
+    ).bindparams(now))
+    db.session.execute(text(
+        'UPDATE inventory_items SET updated_at = COALESCE(created_at, :now) WHERE updated_at IS NULL'
+    ).bindparams(now))
+    for table, column in (('cryovials', 'last_updated'), ('vial_batches', 'updated_at'),
+                          ('boxes', 'updated_at'), ('inventory_items', 'updated_at')):
+        db.session.execute(text(f'CREATE INDEX IF NOT EXISTS ix_{table}_{column} ON {table} ({column})'))
+    # 非 PostgreSQL 数据库写入 change_log 时锁定这一行
+    if cell_models.AppConfig.query.filter_by(key=LOCK_KEY).first() is None:
+        db.session.add(cell_models.AppConfig(
+            key=LOCK_KEY, value='', description='Row locked while change feed entries are written'
+        ))
+    db.session.commit()
+
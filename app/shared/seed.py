@@ -0,0 +1,371 @@
+"""
+Synthetic dataset generator (``flask seed``).
+
+Builds a production-sized dataset in the configured database: users, cell
+lines, towers/drawers/boxes (9x9 and 10x10), vial batches and vials, audit
+logs, and inventory types, suppliers, locations, items and orders.
+
+Rows are generated as plain dicts and written with bulk ``INSERT`` in chunks,
+with explicit primary keys continuing after the current maximum, so seeding
+can be repeated on top of existing data. Every ``Available`` vial gets its
+own slot (the occupied-slot index enforces that); vials in other states are
+spread over random slots, as they would have been removed from the box.
+
+Example (about one million vials):
+
+    flask --app run seed --password '<password>' --vials 1000000 --towers 80 --audit-logs 2000000
+
+Seeded users share the password given with ``--password`` (one of them is an
+admin). Seeding anything but a SQLite database needs ``--force``, so a
+production URL is not filled with fake data and known logins by mistake.
+"""
+
+import json
+import random
+import time
+from datetime import date, datetime, timedelta
+
+import click
+from sqlalchemy import func, insert, select, text
+
+from .. import db
+
+SEED_CHUNK_SIZE = 10000
+
+VIAL_STATUS_WEIGHTS = (('Available', 0.55), ('Used', 0.3), ('Depleted', 0.1), ('Discarded', 0.05))
+AUDIT_ACTIONS = (
+    'CREATE_VIAL', 'UPDATE_VIAL_STATUS', 'EDIT_VIAL', 'PICKUP_VIALS', 'DELETE_VIAL',
+    'CREATE_CELL_LINE', 'EDIT_CELL_LINE', 'LOGIN', 'BATCH_EDIT_VIALS',
+)
+SPECIES = ('Human', 'Mouse', 'Rat', 'Hamster')
+SOURCES = ('ATCC', 'DSMZ', 'ECACC', 'Gift', 'In-house')
+INVENTORY_TYPES = ('Chemical', 'Antibody', 'Consumable', 'Enzyme', 'Kit', 'Media')
+UNITS = ('mL', 'L', 'g', 'mg', 'box', 'pack', 'each', 'vial')
+ORDER_STATUSES = ('Draft', 'Submitted', 'Approved', 'Ordered', 'Received')
+
+
+def _next_id(model):
+    return (db.session.execute(select(func.max(model.id))).scalar() or 0) + 1
+
+
+def _sync_sequences(*models):
+    """PostgreSQL: move ``id`` sequences past the explicitly inserted keys."""
+    if db.engine.dialect.name != 'postgresql':
+        return
+    for model in models:
+        table = model.__tablename__
+        db.session.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+            f"GREATEST((SELECT COALESCE(MAX(id), 0) FROM {table}), 1))"
+        ))
+
+
+def _bulk_insert(model, rows, echo=None, label=None):
+    """Insert an iterable of dicts in chunks; returns the number of rows."""
+    table = model.__table__
+    total = 0
+    chunk = []
+    started = time.perf_counter()
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= SEED_CHUNK_SIZE:
+            db.session.execute(insert(table), chunk)
+            total += len(chunk)
+            chunk = []
+    if chunk:
+        db.session.execute(insert(table), chunk)
+        total += len(chunk)
+    if echo:
+        echo(f'  {label or table.name}: {total} rows in {time.perf_counter() - started:.1f}s')
+    return total
+
+
+class DatasetSeeder:
+    def __init__(self, rng, echo=None):
+        self.rng = rng
+        self.echo = echo
+        self.now = datetime.utcnow()
+
+    def _timestamp(self, days=5 * 365):
+        return self.now - timedelta(seconds=self.rng.randint(0, days * 86400))
+
+    def _status(self):
+        roll = self.rng.random()
+        for status, weight in VIAL_STATUS_WEIGHTS:
+            if roll < weight:
+                return status
+            roll -= weight
+        return VIAL_STATUS_WEIGHTS[0][0]
+
+    def users(self, count, password):
+        from ..cell_storage.models import User
+        from werkzeug.security import generate_password_hash
+        start = _next_id(User)
+        # Hashing is slow on purpose; every seeded user shares the same password
+        password_hash = generate_password_hash(password)
+        _bulk_insert(User, (
+            {'id': start + i, 'username': f'seed_user_{start + i}', 'password_hash': password_hash,
+             'role': 'admin' if i == 0 else 'user'}
+            for i in range(count)
+        ), self.echo)
+        return list(range(start, start + count))
+
+    def cell_lines(self, count, user_ids):
+        from ..cell_storage.models import CellLine
+        start = _next_id(CellLine)
+        _bulk_insert(CellLine, (
+            {'id': start + i, 'name': f'SEED-CL-{start + i}', 'species': self.rng.choice(SPECIES),
+             'source': self.rng.choice(SOURCES), 'original_passage': f'P{self.rng.randint(1, 30)}',
+             'created_by_user_id': self.rng.choice(user_ids), 'timestamp': self._timestamp()}
+            for i in range(count)
+        ), self.echo)
+        return list(range(start, start + count))
+
+    def storage(self, towers, drawers_per_tower, boxes_per_drawer, box_sizes):
+        """Create the freezer layout; returns ``[(box_id, rows, columns)]``."""
+        from ..cell_storage.models import Tower, Drawer, Box
+        tower_start, drawer_start, box_start = _next_id(Tower), _next_id(Drawer), _next_id(Box)
+        tower_rows, drawer_rows, box_rows, boxes = [], [], [], []
+        for t in range(towers):
+            tower_id = tower_start + t
+            tower_rows.append({'id': tower_id, 'name': f'SEED Tower {tower_id}',
+                               'freezer_name': f'LN2 Tank {t // 10 + 1}'})
+            for d in range(drawers_per_tower):
+                drawer_id = drawer_start + len(drawer_rows)
+                drawer_rows.append({'id': drawer_id, 'name': f'Drawer {d + 1}', 'tower_id': tower_id})
+                for b in range(boxes_per_drawer):
+                    box_id = box_start + len(box_rows)
+                    rows, columns = box_sizes[len(box_rows) % len(box_sizes)]
+                    box_rows.append({'id': box_id, 'name': f'Box {b + 1}', 'drawer_id': drawer_id,
+                                     'rows': rows, 'columns': columns})
+                    boxes.append((box_id, rows, columns))
+        _bulk_insert(Tower, tower_rows, self.echo)
+        _bulk_insert(Drawer, drawer_rows, self.echo)
+        _bulk_insert(Box, box_rows, self.echo)
+        return boxes
+
+    def vials(self, count, per_batch, boxes, cell_line_ids, user_ids):
+        from ..cell_storage.models import VialBatch, CryoVial
+        statuses = [self._status() for _ in range(count)]
+        available = statuses.count('Available')
+        capacity = sum(rows * columns for _, rows, columns in boxes)
+        if available > capacity:
+            raise click.ClickException(
+                f'{available} Available vials need {available} free slots, the new boxes have {capacity}. '
+                f'Add towers/drawers/boxes.'
+            )
+        # Available vials fill the new boxes in order, like real freezing does
+        free_slots = (
+            (box_id, r, c)
+            for box_id, rows, columns in boxes
+            for r in range(1, rows + 1)
+            for c in range(1, columns + 1)
+        )
+
+        batch_start = _next_id(VialBatch)
+        batch_count = (count + per_batch - 1) // per_batch
+        batches = []
+        for i in range(batch_count):
+            batches.append({
+                'id': batch_start + i,
+                'name': f'SEED batch {batch_start + i}',
+                'created_by_user_id': self.rng.choice(user_ids),
+                'timestamp': self._timestamp(),
+            })
+        _bulk_insert(VialBatch, batches, self.echo)
+
+        vial_start = _next_id(CryoVial)
+
+        def rows():
+            for i, status in enumerate(statuses):
+                batch = batches[i // per_batch]
+                if i % per_batch == 0:
+                    cell_line_id = self.rng.choice(cell_line_ids)
+                    frozen = batch['timestamp'].date()
+                    passage = f'P{self.rng.randint(2, 40)}'
+                if status == 'Available':
+                    box_id, row, col = next(free_slots)
+                else:
+                    box_id, rows_, columns_ = self.rng.choice(boxes)
+                    row, col = self.rng.randint(1, rows_), self.rng.randint(1, columns_)
+                yield {
+                    'id': vial_start + i,
+                    'unique_vial_id_tag': f'SEED-{batch["id"]}-{i % per_batch + 1}',
+                    'batch_id': batch['id'],
+                    'cell_line_id': cell_line_id,
+                    'box_id': box_id,
+                    'row_in_box': row,
+                    'col_in_box': col,
+                    'passage_number': passage,
+                    'date_frozen': frozen,
+                    'frozen_by_user_id': batch['created_by_user_id'],
+                    'volume_ml': 1.0,
+                    'concentration': f'{self.rng.randint(1, 10)}e6 cells/mL',
+                    'status': status,
+                    'date_created': batch['timestamp'],
+                    'last_updated': batch['timestamp'],
+                }
+        _bulk_insert(CryoVial, rows(), self.echo)
+        return vial_start, count
+
+    def audit_logs(self, count, user_ids, vial_range):
+        from ..cell_storage.models import AuditLog
+        vial_start, vial_count = vial_range
+        _bulk_insert(AuditLog, (
+            {'timestamp': self._timestamp(), 'user_id': self.rng.choice(user_ids),
+             'action': self.rng.choice(AUDIT_ACTIONS), 'target_type': 'CryoVial',
+             'target_id': vial_start + self.rng.randrange(vial_count) if vial_count else None,
+             'details': json.dumps({'seeded': True})}
+            for _ in range(count)
+        ), self.echo)
+
+    def inventory(self, item_count, order_count, supplier_count, user_ids):
+        from ..inventory.models import InventoryType, Supplier, Location, InventoryItem, Order, OrderItem
+        existing_types = dict(db.session.execute(select(InventoryType.name, InventoryType.id)).all())
+        missing = [name for name in INVENTORY_TYPES if name not in existing_types]
+        if missing:
+            _bulk_insert(InventoryType, ({'name': name} for name in missing), self.echo)
+            existing_types = dict(db.session.execute(select(InventoryType.name, InventoryType.id)).all())
+        type_ids = [existing_types[name] for name in INVENTORY_TYPES]
+
+        supplier_start = _next_id(Supplier)
+        _bulk_insert(Supplier, (
+            {'id': supplier_start + i, 'name': f'SEED Supplier {supplier_start + i}'}
+            for i in range(supplier_count)
+        ), self.echo)
+        supplier_ids = list(range(supplier_start, supplier_start + supplier_count))
+
+        # Rooms > fridges > shelves
+        location_start = _next_id(Location)
+        locations = []
+        for room in range(5):
+            room_id = location_start + len(locations)
+            locations.append({'id': room_id, 'name': f'SEED Room {room + 1}', 'parent_id': None})
+            for fridge in range(4):
+                fridge_id = location_start + len(locations)
+                locations.append({'id': fridge_id, 'name': f'Fridge {fridge + 1}', 'parent_id': room_id})
+                for shelf in range(5):
+                    locations.append({'id': location_start + len(locations), 'name': f'Shelf {shelf + 1}',
+                                      'parent_id': fridge_id})
+        _bulk_insert(Location, locations, self.echo)
+        shelf_ids = [row['id'] for row in locations if row['name'].startswith('Shelf')]
+
+        item_start = _next_id(InventoryItem)
+        _bulk_insert(InventoryItem, (
+            {'id': item_start + i, 'name': f'SEED item {item_start + i}',
+             'catalog_number': f'CAT-{self.rng.randint(10000, 99999)}',
+             'barcode': f'SEED-INV-{item_start + i}',
+             'type_id': self.rng.choice(type_ids), 'supplier_id': self.rng.choice(supplier_ids),
+             'location_id': self.rng.choice(shelf_ids),
+             'current_quantity': float(self.rng.randint(0, 50)), 'minimum_quantity': float(self.rng.randint(0, 5)),
+             'unit': self.rng.choice(UNITS), 'unit_price': round(self.rng.uniform(5, 500), 2),
+             'expiration_date': date.today() + timedelta(days=self.rng.randint(-60, 720)),
+             'status': 'Available', 'created_by_user_id': self.rng.choice(user_ids),
+             'created_at': self._timestamp(), 'updated_at': self.now}
+            for i in range(item_count)
+        ), self.echo)
+
+        order_start = _next_id(Order)
+        order_items = []
+        orders = []
+        for i in range(order_count):
+            order_id = order_start + i
+            lines = self.rng.randint(1, 5)
+            total = 0.0
+            for _ in range(lines):
+                quantity = float(self.rng.randint(1, 10))
+                price = round(self.rng.uniform(5, 500), 2)
+                total += quantity * price
+                order_items.append({
+                    'order_id': order_id,
+                    'inventory_item_id': item_start + self.rng.randrange(item_count) if item_count else None,
+                    'item_name': f'SEED order line {order_id}',
+                    'quantity_requested': quantity, 'unit_price': price, 'total_price': quantity * price,
+                })
+            orders.append({
+                'id': order_id, 'order_number': f'SEED-PO-{order_id}',
+                'status': self.rng.choice(ORDER_STATUSES),
+                'requested_by_user_id': self.rng.choice(user_ids),
+                'supplier_id': self.rng.choice(supplier_ids), 'total_cost': round(total, 2),
+                'justification': f'Restock for project {self.rng.randint(1, 40)}',
+                'requested_date': self._timestamp(days=730),
+            })
+        _bulk_insert(Order, orders, self.echo)
+        _bulk_insert(OrderItem, order_items, self.echo)
+
+
+    def finish(self):
+        """Keep key generators ahead of the explicit IDs used by the seed."""
+        from ..cell_storage.models import User, CellLine, Tower, Drawer, Box, VialBatch, CryoVial
+        from ..inventory.models import Supplier, Location, InventoryItem, Order
+        from .batch_ids import batch_id_allocator
+        _sync_sequences(User, CellLine, Tower, Drawer, Box, VialBatch, CryoVial,
+                        Supplier, Location, InventoryItem, Order)
+        db.session.commit()
+        next_batch_id = _next_id(VialBatch)
+        if batch_id_allocator.peek() < next_batch_id:
+            batch_id_allocator.reset(next_batch_id)
+
+
+def _parse_box_sizes(value):
+    sizes = []
+    for part in value.split(','):
+        rows, _, columns = part.strip().lower().partition('x')
+        try:
+            sizes.append((int(rows), int(columns)))
+        except ValueError:
+            raise click.BadParameter(f'expected ROWSxCOLUMNS, got {part!r}')
+    return sizes
+
+
+def register_seed_command(app):
+    @app.cli.command('seed')
+    @click.option('--vials', default=100000, show_default=True)
+    @click.option('--vials-per-batch', default=12, show_default=True)
+    @click.option('--towers', default=20, show_default=True)
+    @click.option('--drawers-per-tower', default=10, show_default=True)
+    @click.option('--boxes-per-drawer', default=10, show_default=True)
+    @click.option('--box-sizes', default='9x9,10x10', show_default=True, help='box layouts used in turn')
+    @click.option('--cell-lines', default=200, show_default=True)
+    @click.option('--users', default=20, show_default=True)
+    @click.option('--audit-logs', default=200000, show_default=True)
+    @click.option('--inventory-items', default=5000, show_default=True)
+    @click.option('--suppliers', default=50, show_default=True)
+    @click.option('--orders', default=2000, show_default=True)
+    @click.option('--random-seed', default=42, show_default=True)
+    @click.option('--password', prompt='Password for the seeded users', hide_input=True,
+                  help='password of every seeded user')
+    @click.option('--force', is_flag=True, help='allow seeding a database other than SQLite')
+    def seed_command(vials, vials_per_batch, towers, drawers_per_tower, boxes_per_drawer, box_sizes,
+                     cell_lines, users, audit_logs, inventory_items, suppliers, orders, random_seed,
+                     password, force):
+        """Fill the database with a synthetic production-sized dataset."""
+        from .schema import migrate
+
+        if db.engine.dialect.name != 'sqlite' and not force:
+            raise click.ClickException(
+                f'Refusing to seed a {db.engine.dialect.name} database without --force.'
+            )
+        if not password:
+            raise click.BadParameter('must not be empty', param_hint='--password')
+        migrate(echo=click.echo)
+        seeder = DatasetSeeder(random.Random(random_seed), echo=click.echo)
+        started = time.perf_counter()
+        if db.engine.dialect.name == 'sqlite':
+            # Bulk load: skip fsync for this connection only
+            db.session.execute(text('PRAGMA synchronous = OFF'))
+
+        click.echo('Seeding users and cell lines...')
+        user_ids = seeder.users(max(users, 1), password)
+        cell_line_ids = seeder.cell_lines(max(cell_lines, 1), user_ids)
+        click.echo('Seeding storage layout...')
+        boxes = seeder.storage(towers, drawers_per_tower, boxes_per_drawer, _parse_box_sizes(box_sizes))
+        click.echo('Seeding vials...')
+        vial_range = seeder.vials(vials, max(vials_per_batch, 1), boxes, cell_line_ids, user_ids)
+        click.echo('Seeding audit logs...')
+        seeder.audit_logs(audit_logs, user_ids, vial_range)
+        click.echo('Seeding inventory...')
+        seeder.inventory(inventory_items, orders, max(suppliers, 1), user_ids)
+        seeder.finish()
+        db.session.commit()
+        click.echo(f'Done in {time.perf_counter() - started:.1f}s. Seeded users log in with the given password.')
@@ -0,0 +1,340 @@
+"""
+Live freezer-map updates over Server-Sent Events.
+
+Every committed change to a vial's position or status is published as a
+compact slot event::
+
+    {"box": 3, "row": 2, "col": 5, "vial": 812, "batch": 40, "status": "Available"}
+
+``status`` is ``null`` when the vial left the slot (moved away or deleted).
+ORM inserts, updates and deletes of ``CryoVial`` are picked up by session
+hooks; the set-based writes in ``VialMutationService`` call ``record_slots()``
+themselves. Events wait in the session until the commit, so a rolled-back
+transaction publishes nothing.
+
+``GET /api/slots/stream`` is an ``text/event-stream`` of ``slots`` events, one
+per commit, with the slot events as ``data``. Event ids are ``<space>:<n>``,
+where the space names the sequence they come from (one worker process with the
+``memory`` backend, the event file with ``sqlite``). Reconnecting browsers send
+``Last-Event-ID`` and get what they missed from a ring buffer; when events of
+the same space were already dropped they receive a ``reset`` event and should
+reload. An id from another space (the reconnect reached another worker) just
+starts a fresh stream. Streams end after ``SLOT_EVENTS_STREAM_SECONDS`` and
+``EventSource`` reconnects by itself.
+
+Two backends are available, like the stats cache:
+
+* ``memory`` fans events out to the streams of the same process.
+* ``sqlite`` appends them to a local SQLite file that a background thread in
+  each worker process polls, so streams on every gunicorn worker of the host
+  see every commit.
+
+Live updates are off by default (``SLOT_EVENTS_ENABLED``). Each open stream
+holds a worker thread, so streams are refused (503) on servers that handle one
+request per process at a time, such as gunicorn's default sync worker; use
+``--worker-class gthread --threads N`` (as in ``app.yaml``) or gevent.
+"""
+
+import json
+import logging
+import os
+import secrets
+import sqlite3
+import sys
+import threading
+import time
+from collections import deque
+
+from flask import current_app, jsonify, request
+from sqlalchemy import event, inspect
+
+logger = logging.getLogger(__name__)
+
+_SLOT_ATTRS = ('box_id', 'row_in_box', 'col_in_box', 'batch_id', 'status')
+
+# Rows of the sqlite backend are pruned after this many seconds
+SQLITE_RETENTION = 300
+
+
+def slot_event(box_id, row, col, vial_id, batch_id, status):
+    return {'box': box_id, 'row': row, 'col': col, 'vial': vial_id, 'batch': batch_id, 'status': status}
+
+
+def _is_vial(obj):
+    table = getattr(obj, '__table__', None)
+    return table is not None and table.name == 'cryovials'
+
+
+def _changed_slots(vial):
+    """Slot events for a flushed update of ``vial``: the slot it left, if any, and its current slot."""
+    state = inspect(vial)
+    history = {name: state.attrs[name].history for name in _SLOT_ATTRS}
+    if not any(h.has_changes() for h in history.values()):
+        return []
+
+    def old(name):
+        deleted = history[name].deleted
+        return deleted[0] if deleted else getattr(vial, name)
+
+    slots = []
+    moved = any(history[name].has_changes() for name in ('box_id', 'row_in_box', 'col_in_box'))
+    if moved and old('box_id') is not None:
+        slots.append(slot_event(old('box_id'), old('row_in_box'), old('col_in_box'), vial.id, old('batch_id'), None))
+    if vial.box_id is not None:
+        slots.append(slot_event(vial.box_id, vial.row_in_box, vial.col_in_box, vial.id, vial.batch_id, vial.status))
+    return slots
+
+
+def record_slots(session, slots):
+    """Queue slot events for set-based writes; they are published when ``session`` commits."""
+    if slots:
+        session.info.setdefault('slot_events', []).extend(slots)
+
+
+def register_slot_hooks(session):
+    """Publish the slot changes of ``CryoVial`` rows once the transaction commits."""
+
+    @event.listens_for(session, 'after_flush')
+    def _track_flush(sess, flush_context):
+        slots = []
+        for obj in sess.new:
+            if _is_vial(obj) and obj.box_id is not None:
+                slots.append(slot_event(obj.box_id, obj.row_in_box, obj.col_in_box, obj.id, obj.batch_id, obj.status))
+        for obj in sess.dirty:
+            if _is_vial(obj):
+                slots.extend(_changed_slots(obj))
+        for obj in sess.deleted:
+            if _is_vial(obj) and obj.box_id is not None:
+                slots.append(slot_event(obj.box_id, obj.row_in_box, obj.col_in_box, obj.id, obj.batch_id, None))
+        record_slots(sess, slots)
+
+    @event.listens_for(session, 'after_commit')
+    def _publish(sess):
+        if sess.in_nested_transaction():
+            return  # savepoint released; wait for the outer commit
+        slots = sess.info.pop('slot_events', None)
+        if slots:
+            try:
+                slot_events.publish(slots)
+            except Exception as exc:  # the write itself already succeeded
+                current_app.logger.warning(f'Publishing slot events failed: {exc}')
+
+    @event.listens_for(session, 'after_rollback')
+    def _discard(sess):
+        if sess.in_nested_transaction():
+            return  # savepoint rolled back; keep the events queued by the outer transaction
+        sess.info.pop('slot_events', None)
+
+
+class SQLiteEventLog:
+    """Event log shared by all worker processes on one host through a SQLite file."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._connect().execute(
+            'CREATE TABLE IF NOT EXISTS slot_events ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, payload TEXT NOT NULL, created_at REAL NOT NULL)'
+        )
+        self._connect().execute('CREATE TABLE IF NOT EXISTS slot_events_space (token TEXT NOT NULL)')
+        self._space = None
+
+    @property
+    def space(self):
+        """Token of this event file; a recreated file starts a new id space."""
+        if self._space is None:
+            conn = self._connect()
+            conn.execute(
+                'INSERT INTO slot_events_space (token) SELECT ? WHERE NOT EXISTS (SELECT 1 FROM slot_events_space)',
+                (secrets.token_hex(4),),
+            )
+            self._space = 's' + conn.execute('SELECT token FROM slot_events_space').fetchone()[0]
+        return self._space
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def append(self, slots):
+        conn = self._connect()
+        now = time.time()
+        event_id = conn.execute(
+            'INSERT INTO slot_events (payload, created_at) VALUES (?, ?)',
+            (json.dumps(slots, separators=(',', ':')), now),
+        ).lastrowid
+        if event_id % 100 == 0:
+            conn.execute('DELETE FROM slot_events WHERE created_at < ?', (now - SQLITE_RETENTION,))
+
+    def last_id(self):
+        return self._connect().execute('SELECT COALESCE(MAX(id), 0) FROM slot_events').fetchone()[0]
+
+    def read_after(self, last_id, limit=1000):
+        rows = self._connect().execute(
+            'SELECT id, payload FROM slot_events WHERE id > ? ORDER BY id LIMIT ?', (last_id, limit)
+        ).fetchall()
+        return [(event_id, json.loads(payload)) for event_id, payload in rows]
+
+
+class SlotEventBroker:
+    """Ring buffer of recent slot events that open streams wait on."""
+
+    def __init__(self):
+        self.enabled = False
+        self.keepalive = 15
+        self.stream_seconds = 300
+        self.poll_interval = 0.5
+        self.log = None  # SQLiteEventLog with the sqlite backend
+        self._events = deque(maxlen=1000)  # (id, slots)
+        self._last_id = 0
+        self._condition = threading.Condition()
+        self._poller = None
+        self._token = secrets.token_hex(4)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('SLOT_EVENTS_ENABLED', False)
+        self.keepalive = app.config.get('SLOT_EVENTS_KEEPALIVE', 15)
+        self.stream_seconds = app.config.get('SLOT_EVENTS_STREAM_SECONDS', 300)
+        self.poll_interval = app.config.get('SLOT_EVENTS_POLL_INTERVAL', 0.5)
+        self._events = deque(maxlen=app.config.get('SLOT_EVENTS_BUFFER', 1000))
+        backend = app.config.get('SLOT_EVENTS_BACKEND', 'memory')
+        if backend == 'sqlite':
+            self.log = SQLiteEventLog(app.config['SLOT_EVENTS_PATH'])
+        elif backend == 'memory':
+            self.log = None
+        else:
+            raise ValueError(f'Unknown SLOT_EVENTS_BACKEND: {backend}')
+        app.extensions['slot_events'] = self
+        app.add_url_rule('/api/slots/stream', 'slot_events', self._stream_view)
+
+    # -- publishing --------------------------------------------------------
+
+    def publish(self, slots):
+        if not self.enabled:
+            return
+        if self.log is not None:
+            self.log.append(slots)  # delivered by the poller of every worker
+            return
+        with self._condition:
+            self._last_id += 1
+            self._events.append((self._last_id, slots))
+            self._condition.notify_all()
+
+    def _poll(self):
+        while True:
+            try:
+                events = self.log.read_after(self._last_id)
+            except sqlite3.Error as exc:
+                logger.warning(f'Reading slot events failed: {exc}')
+                events = []
+            if events:
+                with self._condition:
+                    self._events.extend(events)
+                    self._last_id = events[-1][0]
+                    self._condition.notify_all()
+            else:
+                time.sleep(self.poll_interval)
+
+    def _ensure_poller(self):
+        # Started on the first stream, i.e. after gunicorn has forked the worker
+        if self.log is None or self._poller is not None:
+            return
+        with self._condition:
+            if self._poller is None:
+                self._last_id = self.log.last_id()
+                self._poller = threading.Thread(target=self._poll, name='slot-events-poller', daemon=True)
+                self._poller.start()
+
+    # -- subscribing -------------------------------------------------------
+
+    def current_id(self):
+        with self._condition:
+            return self._last_id
+
+    @property
+    def space(self):
+        if self.log is not None:
+            return self.log.space
+        # pid: workers forked from a preloaded app share the token but not the sequence
+        return f'm{os.getpid()}.{self._token}'
+
+    def _start_id(self, last_event_id):
+        """Sequence number to resume after, ``None`` when ``Last-Event-ID`` is from another space."""
+        space, _, number = (last_event_id or '').rpartition(':')
+        if space != self.space:
+            return None
+        try:
+            return int(number)
+        except ValueError:
+            return None
+
+    def wait(self, last_id, timeout):
+        """``(events, complete)`` after ``last_id``, waiting up to ``timeout`` seconds for the first.
+
+        ``complete`` is false when events after ``last_id`` were already
+        dropped from the buffer, or ``last_id`` is from before a restart.
+        """
+        with self._condition:
+            if self._last_id <= last_id:
+                self._condition.wait(timeout)
+            if last_id > self._last_id:
+                return [], False
+            events = [(event_id, slots) for event_id, slots in self._events if event_id > last_id]
+            return events, not events or events[0][0] == last_id + 1
+
+    def _stream_view(self):
+        from flask_login import current_user
+
+        if not current_user.is_authenticated:
+            return jsonify({'error': 'Authentication required'}), 401
+        if not self.enabled:
+            return jsonify({'error': 'Live updates are disabled'}), 404
+        if not _can_stream(request.environ):
+            # EventSource does not retry after an error status, so the page simply stays static
+            return jsonify({'error': 'Live updates need a threaded or async server'}), 503
+
+        self._ensure_poller()
+        space = self.space
+        start = self._start_id(request.headers.get('Last-Event-ID') or request.args.get('last_event_id'))
+        if start is None:
+            start = self.current_id()
+
+        def generate():
+            last_id = start
+            deadline = time.monotonic() + self.stream_seconds
+            yield f'retry: 3000\nid: {space}:{last_id}\n\n'
+            while time.monotonic() < deadline:
+                events, complete = self.wait(last_id, self.keepalive)
+                if not complete:
+                    last_id = self.current_id()
+                    yield f'event: reset\nid: {space}:{last_id}\ndata: {{}}\n\n'
+                    continue
+                if not events:
+                    yield ': keepalive\n\n'
+                    continue
+                for event_id, slots in events:
+                    data = json.dumps(slots, separators=(',', ':'))
+                    yield f'event: slots\nid: {space}:{event_id}\ndata: {data}\n\n'
+                last_id = events[-1][0]
+
+        response = current_app.response_class(generate(), mimetype='text/event-stream')
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['X-Accel-Buffering'] = 'no'  # nginx: do not buffer the stream
+        return response
+
+
+def _can_stream(environ):
+    """Whether a long-lived response leaves the server able to serve other requests."""
+    if environ.get('wsgi.multithread'):
+        return True
+    gevent_monkey = sys.modules.get('gevent.monkey')
+    if gevent_monkey is not None and gevent_monkey.is_module_patched('socket'):
+        return True
+    eventlet_patcher = sys.modules.get('eventlet.patcher')
+    return eventlet_patcher is not None and eventlet_patcher.is_monkey_patched('socket')
+
+
+slot_events = SlotEventBroker()
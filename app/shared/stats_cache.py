@@ -0,0 +1,302 @@
+"""
+TTL cache for dashboard headline statistics.
+
+Metrics are registered in ``METRICS`` with a time-to-live and the tables they
+are computed from. Any committed write touching one of those tables
+invalidates the metric, so cached numbers never outlive a change made through
+the ORM. Statements issued with plain ``text()`` SQL must call
+``mark_written()`` before the commit themselves.
+
+Two backends are available:
+
+* ``memory`` (default) keeps values in the worker process.
+* ``sqlite`` stores values in a local SQLite file so that several gunicorn
+  workers on the same host share values and invalidations.
+
+Either way the invalidation only reaches the processes of one host. Metrics
+registered with ``versioned=True`` (long-lived reference data) are also
+checked against a version per table kept in ``app_config``: a commit writing
+the table stores a new version in the same transaction, and a cached value
+built under an older version is recomputed by every worker. That costs one
+primary-key lookup per read.
+"""
+
+import json
+import secrets
+import sqlite3
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import event, insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+from .metrics import metrics
+
+# name -> (ttl in seconds, tables the metric is computed from)
+METRICS = {
+    'cell_storage.vial_count': (30, ('cryovials',)),
+    'cell_storage.summary_stats': (60, ('cryovials', 'vial_batches', 'cell_lines')),
+    'inventory.dashboard_totals': (60, ('inventory_items', 'orders')),
+}
+
+DEFAULT_TTL = 60
+
+# app_config key prefix of the table versions behind ``versioned`` metrics
+VERSION_KEY_PREFIX = 'cache_version.'
+
+_MISSING = object()
+
+
+class MemoryBackend:
+    """Process-local backend."""
+
+    def __init__(self):
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                return _MISSING
+            value, expires_at = entry
+            if expires_at <= time.time():
+                del self._values[key]
+                return _MISSING
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._values[key] = (value, time.time() + ttl)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._values.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class SQLiteBackend:
+    """Backend shared by all worker processes on one host through a SQLite file.
+
+    Values are stored as JSON, so cached metrics must be JSON serializable.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS stats_cache ('
+                'key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)'
+            )
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._connect().execute(
+            'SELECT value, expires_at FROM stats_cache WHERE key = ?', (key,)
+        ).fetchone()
+        if row is None or row[1] <= time.time():
+            return _MISSING
+        return json.loads(row[0])
+
+    def set(self, key, value, ttl):
+        self._connect().execute(
+            'INSERT OR REPLACE INTO stats_cache (key, value, expires_at) VALUES (?, ?, ?)',
+            (key, json.dumps(value, default=str), time.time() + ttl),
+        )
+
+    def delete(self, *keys):
+        if keys:
+            placeholders = ','.join('?' for _ in keys)
+            self._connect().execute(
+                f'DELETE FROM stats_cache WHERE key IN ({placeholders})', keys
+            )
+
+    def clear(self):
+        self._connect().execute('DELETE FROM stats_cache')
+
+
+class StatsCache:
+    """Per-metric TTL cache with table-based invalidation and hit/miss counters."""
+
+    def __init__(self, backend=None, metrics=None):
+        self.backend = backend or MemoryBackend()
+        self.metrics = dict(METRICS if metrics is None else metrics)
+        self.versioned = set()
+        self.enabled = True
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        backend = app.config.get('STATS_CACHE_BACKEND', 'memory')
+        if backend == 'sqlite':
+            self.backend = SQLiteBackend(app.config['STATS_CACHE_PATH'])
+        elif backend == 'memory':
+            self.backend = MemoryBackend()
+        else:
+            raise ValueError(f'Unknown STATS_CACHE_BACKEND: {backend}')
+        self.enabled = app.config.get('STATS_CACHE_ENABLED', True)
+        for name, ttl in app.config.get('STATS_CACHE_TTLS', {}).items():
+            _, tables = self.metrics.get(name, (DEFAULT_TTL, ()))
+            self.metrics[name] = (ttl, tables)
+        app.extensions['stats_cache'] = self
+
+    def register(self, name, ttl=DEFAULT_TTL, tables=(), versioned=False):
+        self.metrics[name] = (ttl, tuple(tables))
+        if versioned:
+            self.versioned.add(name)
+
+    def get_or_compute(self, name, compute, key=None, ttl=None):
+        """Return the cached value of ``name``, calling ``compute()`` on a miss.
+
+        ``key`` caches one entry per argument (e.g. per user) under the
+        metric's TTL, counters and versions; ``ttl`` overrides the TTL. Table
+        invalidation only drops the unkeyed entry, so keyed entries of an
+        unversioned metric live until their TTL expires.
+        """
+        if not self.enabled:
+            return compute()
+        cache_key = name if key is None else f'{name}.{key}'
+        version = self._version(name) if name in self.versioned else None
+        entry = self.backend.get(cache_key)
+        if version is not None and entry is not _MISSING:
+            entry = entry['value'] if isinstance(entry, dict) and entry.get('version') == version else _MISSING
+        if entry is not _MISSING:
+            self._count(name, 'hits')
+            return entry
+        self._count(name, 'misses')
+        value = compute()
+        if ttl is None:
+            ttl, _ = self.metrics.get(name, (DEFAULT_TTL, ()))
+        self.backend.set(cache_key, value if version is None else {'version': version, 'value': value}, ttl)
+        return value
+
+    def invalidate(self, *names):
+        self.backend.delete(*names)
+
+    def invalidate_tables(self, *tables):
+        """Drop every metric computed from any of ``tables``."""
+        tables = set(tables)
+        stale = [name for name, (_, deps) in self.metrics.items() if tables & set(deps)]
+        if stale:
+            self.invalidate(*stale)
+
+    def clear(self):
+        self.backend.clear()
+
+    def versioned_tables(self):
+        return {table for name in self.versioned for table in self.metrics[name][1]}
+
+    def _version(self, name):
+        from .. import db
+        from ..cell_storage.models import AppConfig
+        keys = [f'{VERSION_KEY_PREFIX}{table}' for table in sorted(self.metrics[name][1])]
+        values = dict(db.session.execute(
+            select(AppConfig.key, AppConfig.value).where(AppConfig.key.in_(keys))
+        ).all())
+        return '|'.join(values.get(key) or '' for key in keys)
+
+    def bump_versions(self, session, tables):
+        """Store new versions of ``tables`` in the session's transaction (not committed)."""
+        from ..cell_storage.models import AppConfig
+        for table in sorted(tables):
+            key = f'{VERSION_KEY_PREFIX}{table}'
+            version = secrets.token_hex(8)
+            result = session.execute(
+                update(AppConfig).where(AppConfig.key == key).values(value=version)
+                .execution_options(synchronize_session=False)
+            )
+            if result.rowcount:
+                continue
+            try:
+                with session.begin_nested():
+                    session.execute(insert(AppConfig).values(
+                        key=key, value=version, description=f'Cache version of {table}'
+                    ))
+            except IntegrityError:  # inserted by a concurrent commit
+                session.execute(
+                    update(AppConfig).where(AppConfig.key == key).values(value=version)
+                    .execution_options(synchronize_session=False)
+                )
+
+    def counters(self):
+        """Hit/miss counters of this worker process, per metric and in total."""
+        with self._lock:
+            per_metric = {name: dict(values) for name, values in self._counters.items()}
+        hits = sum(values['hits'] for values in per_metric.values())
+        misses = sum(values['misses'] for values in per_metric.values())
+        return {'hits': hits, 'misses': misses, 'metrics': per_metric}
+
+    def _count(self, name, kind):
+        with self._lock:
+            values = self._counters.setdefault(name, {'hits': 0, 'misses': 0})
+            values[kind] += 1
+        metrics.inc('cellstorage_stats_cache_requests_total', metric=name, result='hit' if kind == 'hits' else 'miss')
+
+
+stats_cache = StatsCache()
+
+
+def _touched(sess):
+    return sess.info.setdefault('stats_cache_tables', set())
+
+
+def mark_written(session, *tables):
+    """Record tables written with plain ``text()`` SQL in the session's transaction."""
+    _touched(session).update(tables)
+
+
+def register_invalidation_hooks(session):
+    """Invalidate cached metrics when a transaction writing their tables commits."""
+
+    @event.listens_for(session, 'after_flush')
+    def _track_flush(sess, flush_context):
+        for obj in list(sess.new) + list(sess.dirty) + list(sess.deleted):
+            table = getattr(obj, '__table__', None)
+            if table is not None:
+                _touched(sess).add(table.name)
+
+    @event.listens_for(session, 'do_orm_execute')
+    def _track_bulk(orm_execute_state):
+        if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+            table = getattr(orm_execute_state.statement, 'table', None)
+            if table is not None:
+                _touched(orm_execute_state.session).add(table.name)
+
+    @event.listens_for(session, 'before_commit')
+    def _bump_versions(sess):
+        if sess.in_nested_transaction() or not stats_cache.enabled:
+            return
+        sess.flush()  # 先 flush，最后一次 autoflush 写入的表也要计入
+        tables = _touched(sess) & stats_cache.versioned_tables()
+        if tables:
+            stats_cache.bump_versions(sess, tables)
+
+    @event.listens_for(session, 'after_commit')
+    def _invalidate(sess):
+        if sess.in_nested_transaction():
+            return  # savepoint released; the outer commit invalidates
+        tables = sess.info.pop('stats_cache_tables', None)
+        if tables:
+            try:
+                stats_cache.invalidate_tables(*tables)
+            except Exception as exc:  # the write itself already succeeded
+                current_app.logger.warning(f'Stats cache invalidation failed: {exc}')
+
+    @event.listens_for(session, 'after_rollback')
+    def _discard(sess):
+        if sess.in_nested_transaction():
+            return  # savepoint rolled back; the outer transaction may still commit its writes
+        sess.info.pop('stats_cache_tables', None)
@@ -0,0 +1,120 @@
+"""
+Server-side theming.
+
+``base.html`` gets the logged-in user's theme from a context processor
+instead of calling ``/api/theme/current`` after every page load:
+
+* the user's theme settings are cached per user in the stats cache as a
+  versioned metric: a commit writing ``theme_config`` stores a new version in
+  ``app_config``, so every worker reloads the theme on its next page, whatever
+  the cache backend. Rendering never writes; a user without a saved theme
+  gets the default one;
+* the CSS variables of each theme are served from
+  ``/theme/<theme_name>.<hash>.css``, where the hash is taken from the CSS
+  itself, so the file can be cached by browsers for a year and a changed
+  theme gets a new URL.
+"""
+
+import hashlib
+import threading
+
+from flask import current_app, url_for
+
+from .stats_cache import stats_cache
+
+_METRIC = 'theme.user'
+
+stats_cache.register(_METRIC, tables=('theme_config',), versioned=True)
+
+
+class ThemeCache:
+    def __init__(self):
+        self.enabled = True
+        self.ttl = 3600
+        self._stylesheets = {}  # css -> digest
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.enabled = app.config.get('THEME_CACHE_ENABLED', True)
+        self.ttl = app.config.get('THEME_CACHE_TTL', 3600)
+        app.extensions['theme_cache'] = self
+        app.add_url_rule('/theme/<theme_name>.<digest>.css', 'theme_stylesheet', self._stylesheet_view)
+        app.context_processor(self._inject_theme)
+
+    # -- per-user settings -------------------------------------------------
+
+    def get(self, user_id):
+        """Theme settings of ``user_id`` (``ThemeConfig.to_dict()``)."""
+        from .utils import get_user_theme
+
+        def compute():
+            return get_user_theme(user_id, create=False)
+
+        if not self.enabled:
+            return compute()
+        return stats_cache.get_or_compute(_METRIC, compute, key=user_id, ttl=self.ttl)
+
+    def invalidate(self, user_id):
+        stats_cache.invalidate(f'{_METRIC}.{user_id}')
+
+    # -- stylesheets -------------------------------------------------------
+
+    def stylesheet(self, theme):
+        """``(css, digest)`` for a theme dict with the colour keys of ``get_available_themes()``."""
+        from .utils import get_theme_css_variables
+
+        css = get_theme_css_variables(theme)
+        with self._lock:
+            digest = self._stylesheets.get(css)
+            if digest is None:
+                digest = self._stylesheets[css] = hashlib.sha256(css.encode('utf-8')).hexdigest()[:12]
+        return css, digest
+
+    def stylesheet_url(self, theme):
+        """URL of the theme's stylesheet, or ``None`` when it is not a built-in theme."""
+        from .utils import get_available_themes
+
+        name = theme.get('theme_name')
+        themes = get_available_themes()
+        if name not in themes:
+            return None
+        _, digest = self.stylesheet(themes[name])
+        return url_for('theme_stylesheet', theme_name=name, digest=digest)
+
+    def _stylesheet_view(self, theme_name, digest):
+        from .utils import get_available_themes
+
+        theme = get_available_themes().get(theme_name)
+        if theme is None:
+            return current_app.response_class('Theme not found', status=404, mimetype='text/plain')
+        css, current_digest = self.stylesheet(theme)
+        response = current_app.response_class(css, mimetype='text/css')
+        if digest == current_digest:
+            response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+        else:
+            # Old URL from a cached page: serve the current CSS, but do not pin it
+            response.headers['Cache-Control'] = 'no-cache'
+        return response
+
+    # -- template context --------------------------------------------------
+
+    def _inject_theme(self):
+        from flask_login import current_user
+
+        if not current_user.is_authenticated:
+            return {}
+        try:
+            theme = self.get(current_user.id)
+        except Exception as e:
+            # 主题加载失败时使用 base.html 中的默认配色, 不影响页面渲染
+            current_app.logger.warning(f'Failed to load theme for user {current_user.id}: {e}')
+            return {}
+        url = self.stylesheet_url(theme)
+        return {
+            'user_theme': theme,
+            'user_theme_css_url': url,
+            'user_theme_css': None if url else self.stylesheet(theme)[0],
+        }
+
+
+theme_cache = ThemeCache()
@@ -1,7 +1,9 @@
 from datetime import datetime, timedelta
 import json
 from .. import db
-from ..cell_storage.models import AuditLog, AppConfig, VialBatch
+from ..cell_storage.models import AuditLog
+from .batch_ids import batch_id_allocator
+from .metrics import metrics
 
 def log_audit(user_id, action, target_type=None, target_id=None, details=None, **extra):
     """Create an ``AuditLog`` entry.
@@ -61,45 +63,28 @@ def clear_database_except_admin():
         db.session.query(model).delete()
 
     db.session.query(User).filter(User.role != 'admin').delete()
+    from app.shared.change_feed import record_reset
+    record_reset()
     db.session.commit()
 
 
 def get_batch_counter():
-    """Return current batch counter as int, initializing if missing."""
-    setting = AppConfig.query.filter_by(key='batch_counter').first()
-    if not setting:
-        # initialize based on current max batch id
-        max_id = db.session.query(db.func.max(VialBatch.id)).scalar() or 0
-        setting = AppConfig(key='batch_counter', value=str(max_id + 1))
-        db.session.add(setting)
-        db.session.commit()
-    try:
-        return int(setting.value)
-    except (ValueError, TypeError):
-        return 1
+    """Return the next batch ID as int, initializing the counter if missing."""
+    return batch_id_allocator.peek()
 
 
 def set_batch_counter(value):
-    setting = AppConfig.query.filter_by(key='batch_counter').first()
-    if not setting:
-        setting = AppConfig(key='batch_counter')
-        db.session.add(setting)
-    setting.value = str(int(value))
-    db.session.commit()
+    batch_id_allocator.reset(value)
 
 
 def get_next_batch_id(auto_commit=True):
-    """Retrieve and increment the batch counter atomically."""
-    setting = AppConfig.query.filter_by(key='batch_counter').with_for_update().first()
-    if not setting:
-        max_id = db.session.query(db.func.max(VialBatch.id)).scalar() or 0
-        setting = AppConfig(key='batch_counter', value=str(max_id + 1))
-        db.session.add(setting)
-    current = int(setting.value)
-    setting.value = str(current + 1)
-    if auto_commit:
-        db.session.commit()
-    return current
+    """Allocate a batch ID.
+
+    The allocation always commits on its own short transaction (see
+    ``app/shared/batch_ids.py``), so ``auto_commit`` no longer matters and the
+    caller's transaction never holds the counter lock.
+    """
+    return batch_id_allocator.next_id()
 
 
 # =============================================================================
@@ -277,7 +262,8 @@ def check_old_samples_alerts():
         CellLine.name.label('cell_line_name'),
         db.func.min(CryoVial.date_frozen).label('oldest_date'),
         db.func.count(CryoVial.id).label('vial_count')
-    ).join(CryoVial).join(CellLine)\
+    ).join(CryoVial, CryoVial.batch_id == VialBatch.id)\
+     .join(CellLine, CellLine.id == CryoVial.cell_line_id)\
      .filter(CryoVial.date_frozen <= cutoff_date)\
      .filter(CryoVial.status == 'Available')\
      .group_by(VialBatch.id, VialBatch.name, CellLine.name).all()
@@ -331,6 +317,8 @@ def generate_all_alerts():
         for alert in alerts:
             db.session.add(alert)
         db.session.commit()
+        for alert in alerts:
+            metrics.inc('cellstorage_alerts_generated_total', alert_type=alert.alert_type)
     
     return len(alerts)
 
@@ -503,14 +491,24 @@ def get_available_themes():
         }
     }
 
-def get_user_theme(user_id):
-    """Get user's current theme configuration"""
+def get_user_theme(user_id, create=True):
+    """Get user's current theme configuration
+
+    With ``create=False`` (page rendering) nothing is written: a user without
+    a saved theme gets the default one.
+    """
     from app.cell_storage.models import ThemeConfig
     
     theme_config = ThemeConfig.query.filter_by(user_id=user_id).first()
     if not theme_config:
         # Create default theme configuration
         default_theme = get_available_themes()['professional_blue']
+        if not create:
+            theme = {'id': None, 'theme_name': 'professional_blue'}
+            theme.update({key: default_theme[key] for key in (
+                'primary_color', 'secondary_color', 'accent_color', 'background_color', 'text_color', 'navbar_style'
+            )})
+            return theme
         theme_config = ThemeConfig(
             user_id=user_id,
             theme_name='professional_blue',
@@ -552,6 +550,8 @@ def update_user_theme(user_id, theme_name):
         theme_config.navbar_style = theme_data['navbar_style']
         
         db.session.commit()
+        from app.shared.theme_cache import theme_cache
+        theme_cache.invalidate(user_id)
         return True, "Theme updated successfully"
     except Exception as e:
         db.session.rollback()
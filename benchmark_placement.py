@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Placement Engine Benchmark
+Times every registered placement strategy against a synthetic freezer of
+1,000 boxes. Runs fully in memory; no database is needed.
+
+Usage: python benchmark_placement.py [--boxes 1000] [--fill 0.6] [--repeat 50]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app.cell_storage.placement import STRATEGIES, OccupancySnapshot, box_priority_key, plan_placement
+
+
+def build_snapshot(box_count, fill_ratio, seed=42):
+    """Synthetic freezer: 10 boxes per drawer, 10 drawers per tower, 9x9 boxes."""
+    rng = random.Random(seed)
+    boxes = []
+    occupied = {}
+    for i in range(box_count):
+        box = {
+            'id': i + 1,
+            'name': f'Box {i % 10 + 1}',
+            'rows': 9,
+            'columns': 9,
+            'drawer_id': i // 10 + 1,
+            'drawer_name': f'Drawer {i // 10 % 10 + 1}',
+            'tower_name': f'Tower {i // 100 + 1}',
+        }
+        boxes.append(box)
+        slots = [(r, c) for r in range(1, 10) for c in range(1, 10)]
+        count = int(len(slots) * min(max(rng.gauss(fill_ratio, 0.25), 0.0), 1.0))
+        taken = rng.sample(slots, count)
+        occupied[box['id']] = set(taken)
+    boxes.sort(key=lambda box: (box_priority_key(box['name']), box['id']))
+    return boxes, occupied
+
+
+def benchmark(box_count, fill_ratio, repeat):
+    boxes, occupied = build_snapshot(box_count, fill_ratio)
+    counts = {box_id: len(taken) for box_id, taken in occupied.items()}
+    total_free = sum(81 - counts[box['id']] for box in boxes)
+    print(f"Boxes: {box_count}, free slots: {total_free}, repeat: {repeat}")
+    print(f"{'strategy':<12} {'quantity':>8} {'boxes used':>10} {'avg ms':>10}")
+
+    for name in sorted(STRATEGIES):
+        for quantity in (1, 10, 40, 200):
+            elapsed = 0.0
+            used = 0
+            for _ in range(repeat):
+                # A fresh snapshot per plan, as each request loads its own
+                snapshot = OccupancySnapshot(boxes, counts, occupied)
+                start = time.perf_counter()
+                placements, used_boxes = plan_placement(quantity, strategy=name, snapshot=snapshot)
+                elapsed += time.perf_counter() - start
+                used = len(used_boxes)
+                if len(placements) != quantity:
+                    print(f"[ERROR] {name} could not place {quantity} vials")
+                    break
+            print(f"{name:<12} {quantity:>8} {used:>10} {elapsed / repeat * 1000:>10.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark placement strategies")
+    parser.add_argument('--boxes', type=int, default=1000)
+    parser.add_argument('--fill', type=float, default=0.6, help="Average fill ratio of boxes")
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    print("=== CellStorage Placement Benchmark ===")
+    benchmark(args.boxes, args.fill, args.repeat)
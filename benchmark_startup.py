@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Startup Time Benchmark
+Measures the cold start of a worker: ``import app`` plus ``create_app()``,
+each in a fresh interpreter, and reports the SQL statements run during
+startup and which heavy optional modules were loaded.
+
+By default a temporary SQLite database is created and migrated first, so the
+numbers reflect a deployed (already migrated) database. Pass --url to
+measure against another database.
+
+Usage: python benchmark_startup.py [--runs 5] [--url sqlite:////path/to/app.db]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+HEAVY_MODULES = ('pandas', 'openpyxl', 'boto3', 'botocore', 'google.cloud.sql.connector', 'pg8000')
+
+PROBE = r'''
+import json, sys, time
+start = time.perf_counter()
+import app as app_package
+from config import Config
+imported = time.perf_counter()
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+statements = []
+event.listen(Engine, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+application = app_package.create_app(Config)
+created = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - start) * 1000,
+    'create_app_ms': (created - imported) * 1000,
+    'statements': statements,
+    'heavy_modules': [name for name in HEAVY if name in sys.modules],
+}))
+'''
+
+
+def run_probe(env):
+    code = f'HEAVY = {HEAVY_MODULES!r}\n' + PROBE
+    result = subprocess.run(
+        [sys.executable, '-c', code], cwd=BASE_DIR, env=env,
+        capture_output=True, text=True, check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def migrate(env):
+    subprocess.run(
+        [sys.executable, '-m', 'flask', '--app', 'run', 'migrate-db'],
+        cwd=BASE_DIR, env=env, capture_output=True, check=True,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure application cold start time.')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--url', help='database URL (default: a fresh migrated SQLite file)')
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env.pop('INSTANCE_CONNECTION_NAME', None)
+    env['AUTO_MIGRATE'] = '0'
+    tmpdir = None
+    if args.url:
+        env['DATABASE_URL'] = args.url
+    else:
+        tmpdir = tempfile.TemporaryDirectory()
+        env['DATABASE_URL'] = 'sqlite:///' + os.path.join(tmpdir.name, 'startup.db')
+        migrate(env)
+
+    print("=== CellStorage Startup Benchmark ===")
+    print(f"Database: {env['DATABASE_URL']}, runs: {args.runs}")
+    results = [run_probe(env) for _ in range(args.runs)]
+
+    import_ms = [r['import_ms'] for r in results]
+    create_ms = [r['create_app_ms'] for r in results]
+    total_ms = [a + b for a, b in zip(import_ms, create_ms)]
+    print(f"import app      median {statistics.median(import_ms):8.1f} ms  min {min(import_ms):8.1f} ms")
+    print(f"create_app()    median {statistics.median(create_ms):8.1f} ms  min {min(create_ms):8.1f} ms")
+    print(f"total           median {statistics.median(total_ms):8.1f} ms  min {min(total_ms):8.1f} ms")
+    print(f"SQL statements during startup: {len(results[-1]['statements'])}")
+    for statement in results[-1]['statements']:
+        print(f"    {' '.join(statement.split())[:100]}")
+    heavy = results[-1]['heavy_modules']
+    print(f"Heavy modules loaded: {', '.join(heavy) if heavy else 'none'}")
+
+    if tmpdir is not None:
+        tmpdir.cleanup()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Import Time Check
+Runs ``python -X importtime`` on the application start-up path (import the
+package and call ``create_app()``) and fails if a heavy optional dependency
+is imported eagerly or the total import time exceeds the budget.
+
+pandas/openpyxl are only needed for spreadsheet import/export, boto3 for RDS
+snapshots and the Cloud SQL connector for the first Cloud SQL connection;
+none of them should be loaded when a worker starts.
+
+Usage: python check_import_time.py [--budget-ms 1500] [--top 15]
+Exit code 1 on failure, so the script can run in CI.
+"""
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+import tempfile
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+FORBIDDEN_MODULES = ('pandas', 'openpyxl', 'boto3', 'botocore', 'google.cloud.sql.connector')
+
+# import time: self [us] | cumulative | imported package
+LINE_RE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+
+def run_importtime(database_url):
+    env = dict(os.environ)
+    env.pop('INSTANCE_CONNECTION_NAME', None)
+    env.update(DATABASE_URL=database_url, SCHEMA_CHECK_ON_STARTUP='0')
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import app; app.create_app()'],
+        cwd=BASE_DIR, env=env, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        sys.stderr.write(result.stderr)
+        raise SystemExit('Application failed to start.')
+    return parse(result.stderr)
+
+
+def parse(output):
+    """Return ``[(module, self_us, cumulative_us, depth)]``."""
+    entries = []
+    for line in output.splitlines():
+        match = LINE_RE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            entries.append((module, int(self_us), int(cumulative_us), len(indent) // 2))
+    return entries
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check application import time.')
+    parser.add_argument('--budget-ms', type=float, default=1500.0,
+                        help='maximum total import time in milliseconds')
+    parser.add_argument('--top', type=int, default=15, help='number of slowest top-level imports to show')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        entries = run_importtime('sqlite:///' + os.path.join(tmpdir, 'importtime.db'))
+
+    top_level = [entry for entry in entries if entry[3] == 0]
+    total_ms = sum(entry[2] for entry in top_level) / 1000
+    loaded = {entry[0] for entry in entries}
+    forbidden = sorted(
+        name for name in loaded
+        if any(name == module or name.startswith(module + '.') for module in FORBIDDEN_MODULES)
+    )
+
+    print("=== CellStorage Import Time Check ===")
+    print(f"Total import time: {total_ms:.1f} ms (budget {args.budget_ms:.0f} ms), modules: {len(entries)}")
+    print("Slowest top-level imports:")
+    for module, _, cumulative_us, _ in sorted(top_level, key=lambda entry: -entry[2])[:args.top]:
+        print(f"  {cumulative_us / 1000:8.1f} ms  {module}")
+
+    failed = False
+    if forbidden:
+        failed = True
+        roots = sorted({name for name in forbidden if not any(
+            name.startswith(other + '.') for other in forbidden)})
+        print(f"FAIL: heavy optional modules imported at start-up: {', '.join(roots)}")
+    if total_ms > args.budget_ms:
+        failed = True
+        print(f"FAIL: import time {total_ms:.1f} ms exceeds budget {args.budget_ms:.0f} ms")
+    if not failed:
+        print("OK")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
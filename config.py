@@ -1,16 +1,112 @@
 import os
+import threading
 from dotenv import load_dotenv
-from google.cloud.sql.connector import Connector
+from sqlalchemy.engine import URL, make_url
 
 # 加载 .env 文件中的环境变量 (如果存在)
 basedir = os.path.abspath(os.path.dirname(__file__))
 load_dotenv(os.path.join(basedir, '.env'))
 
-# 仅当在 GAE 环境中时才初始化 connector 和 getconn
-if os.environ.get("INSTANCE_CONNECTION_NAME"):
-    connector = Connector()
-    
+# 数据库连接配置档 (DB_PROFILE)
+# 语句超时和空闲事务超时只在 PostgreSQL 上生效
+DB_PROFILES = {
+    # App Engine 等无服务器环境: 实例多、每个实例并发低, 连接池保持小, 避免占满 Cloud SQL 连接数
+    'serverless': {
+        'pool_size': 2,
+        'max_overflow': 3,
+        'pool_timeout': 10,
+        'pool_recycle': 1800,
+        'statement_timeout_ms': 30000,
+        'idle_in_transaction_timeout_ms': 60000,
+    },
+    # 常驻的 gunicorn 多线程 worker
+    'standard': {
+        'pool_size': 10,
+        'max_overflow': 10,
+        'pool_timeout': 30,
+        'pool_recycle': 3600,
+        'statement_timeout_ms': 60000,
+        'idle_in_transaction_timeout_ms': 120000,
+    },
+    # 导入/迁移等批处理脚本: 连接少, 允许长语句
+    'batch': {
+        'pool_size': 1,
+        'max_overflow': 1,
+        'pool_timeout': 60,
+        'pool_recycle': 3600,
+        'statement_timeout_ms': 0,
+        'idle_in_transaction_timeout_ms': 0,
+    },
+}
+
+POSTGRES_DRIVERS = ('psycopg', 'psycopg2', 'pg8000')
+
+
+def resolve_postgres_driver(name=None):
+    """DB_DRIVER 为 'auto' 时优先使用 C 实现的 psycopg / psycopg2, 都未安装时回退到 pg8000"""
+    name = (name or os.environ.get('DB_DRIVER') or 'auto').lower()
+    if name != 'auto':
+        if name not in POSTGRES_DRIVERS:
+            raise ValueError(f'Unknown DB_DRIVER: {name}')
+        return name
+    for candidate in ('psycopg', 'psycopg2'):
+        try:
+            __import__(candidate)
+            return candidate
+        except ImportError:
+            continue
+    return 'pg8000'
+
+
+def normalize_database_url(url, driver=None):
+    """为未指定驱动的 postgres:// / postgresql:// 地址补上所选驱动"""
+    parsed = make_url(url.replace('postgres://', 'postgresql://', 1) if url.startswith('postgres://') else url)
+    if parsed.drivername == 'postgresql':
+        parsed = parsed.set(drivername=f'postgresql+{resolve_postgres_driver(driver)}')
+    return parsed.render_as_string(hide_password=False)
+
+
+def cloud_sql_socket_url(driver):
+    """通过 App Engine 挂载的 /cloudsql 套接字直连 Cloud SQL (psycopg / psycopg2)"""
+    return URL.create(
+        f'postgresql+{driver}',
+        username=os.environ['DB_USER'],
+        password=os.environ['DB_PASS'],
+        database=os.environ['DB_NAME'],
+        query={'host': os.path.join(os.environ.get('DB_SOCKET_DIR', '/cloudsql'),
+                                    os.environ['INSTANCE_CONNECTION_NAME'])},
+    ).render_as_string(hide_password=False)
+
+
+def build_engine_options(profile_name, creator=None):
+    """按配置档生成 SQLALCHEMY_ENGINE_OPTIONS, 环境变量 DB_POOL_SIZE 等可覆盖单项"""
+    if profile_name not in DB_PROFILES:
+        raise ValueError(f'Unknown DB_PROFILE: {profile_name}')
+    profile = DB_PROFILES[profile_name]
+    options = {
+        'pool_pre_ping': os.environ.get('DB_POOL_PRE_PING', '1') != '0',
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', profile['pool_size'])),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', profile['max_overflow'])),
+        'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', profile['pool_timeout'])),
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', profile['pool_recycle'])),
+    }
+    if creator is not None:
+        options['creator'] = creator
+    return options
+
+
+# 仅当在 GAE 环境中且使用 pg8000 时才使用 connector; connector 在第一次建立连接时才导入和初始化
+if os.environ.get("INSTANCE_CONNECTION_NAME") and resolve_postgres_driver(os.environ.get('DB_DRIVER', 'pg8000')) == 'pg8000':
+    connector = None
+    _connector_lock = threading.Lock()
+
     def getconn():
+        global connector
+        if connector is None:
+            with _connector_lock:
+                if connector is None:
+                    from google.cloud.sql.connector import Connector
+                    connector = Connector()
         conn = connector.connect(
             os.environ["INSTANCE_CONNECTION_NAME"],
             "pg8000",
@@ -19,6 +115,9 @@ if os.environ.get("INSTANCE_CONNECTION_NAME"):
             db=os.environ["DB_NAME"]
         )
         return conn
+else:
+    getconn = None
+
 
 class Config:
     # 密钥，非常重要，用于保护会话和CSRF令牌等。
@@ -26,25 +125,93 @@ class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'your-very-secret-and-hard-to-guess-key'  # 请务必修改这个默认值
 
     # 数据库配置
+    # 连接配置档: 'serverless'（GAE 默认）, 'standard'（其他 PostgreSQL 默认）, 'batch'
+    DB_PROFILE = os.environ.get('DB_PROFILE') or \
+        ('serverless' if os.environ.get("INSTANCE_CONNECTION_NAME") else 'standard')
+    DB_STATEMENT_TIMEOUT_MS = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS',
+                                                 DB_PROFILES[DB_PROFILE]['statement_timeout_ms']))
+    DB_IDLE_IN_TRANSACTION_TIMEOUT_MS = int(os.environ.get('DB_IDLE_IN_TRANSACTION_TIMEOUT_MS',
+                                                           DB_PROFILES[DB_PROFILE]['idle_in_transaction_timeout_ms']))
+
     # 优先从环境变量获取，用于连接Google Cloud SQL
     if os.environ.get("INSTANCE_CONNECTION_NAME"):
-        SQLALCHEMY_DATABASE_URI = "postgresql+pg8000://"
-        SQLALCHEMY_ENGINE_OPTIONS = {
-            "creator": getconn,
-            # 增加连接池配置，以适应无服务器环境
-            "pool_size": 5,
-            "max_overflow": 2,
-            "pool_timeout": 30,
-            "pool_recycle": 1800,
-        }
+        if getconn is not None:
+            # 默认通过 Cloud SQL connector + pg8000（纯 Python 驱动）
+            SQLALCHEMY_DATABASE_URI = "postgresql+pg8000://"
+            SQLALCHEMY_ENGINE_OPTIONS = build_engine_options(DB_PROFILE, creator=getconn)
+        else:
+            # DB_DRIVER=psycopg/psycopg2 时经 unix 套接字直连
+            SQLALCHEMY_DATABASE_URI = cloud_sql_socket_url(resolve_postgres_driver())
+            SQLALCHEMY_ENGINE_OPTIONS = build_engine_options(DB_PROFILE)
+    elif os.environ.get('DATABASE_URL'):
+        SQLALCHEMY_DATABASE_URI = normalize_database_url(os.environ['DATABASE_URL'])
+        SQLALCHEMY_ENGINE_OPTIONS = (
+            build_engine_options(DB_PROFILE)
+            if SQLALCHEMY_DATABASE_URI.startswith('postgresql') else {'pool_pre_ping': True}
+        )
     else:
         # 本地开发时回退到SQLite
-        SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
-                                  'sqlite:///' + os.path.join(basedir, 'app.db')
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(basedir, 'app.db')
+
+    # 数据库结构由 `flask --app run migrate-db` 创建和升级; 启动时只读取 schema_version
+    # AUTO_MIGRATE=1 时启动时自动执行待执行的迁移 (本地开发用)
+    AUTO_MIGRATE = os.environ.get('AUTO_MIGRATE', '0') == '1'
+    SCHEMA_CHECK_ON_STARTUP = os.environ.get('SCHEMA_CHECK_ON_STARTUP', '1') != '0'
 
     # SQLAlchemy 配置项，可以关闭一些不必要的通知，提升性能
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+    # 仪表盘统计缓存: 'memory' 为进程内缓存, 'sqlite' 使多个 gunicorn worker 共享同一本地缓存文件
+    STATS_CACHE_BACKEND = os.environ.get('STATS_CACHE_BACKEND', 'memory')
+    STATS_CACHE_PATH = os.environ.get('STATS_CACHE_PATH') or os.path.join(basedir, 'stats_cache.db')
+
+    # 用户主题缓存 (与统计缓存使用同一后端), 主题切换时立即失效
+    THEME_CACHE_ENABLED = os.environ.get('THEME_CACHE_ENABLED', '1') != '0'
+    THEME_CACHE_TTL = int(os.environ.get('THEME_CACHE_TTL', 3600))
+
+    # 高级搜索分面计数的缓存时间 (秒), 0 为不缓存; 写入不会使其失效
+    SEARCH_FACET_CACHE_TTL = int(os.environ.get('SEARCH_FACET_CACHE_TTL', 30))
+
+    # 增量变更接口 /api/changes: 设置令牌后外部工具可用 Authorization: Bearer <token> 访问;
+    # 变更记录保留天数, 更早的记录会被清理, 过期游标需从头同步
+    CHANGE_FEED_TOKEN = os.environ.get('CHANGE_FEED_TOKEN')
+    CHANGE_FEED_RETENTION_DAYS = int(os.environ.get('CHANGE_FEED_RETENTION_DAYS', 30))
+
+    # 冻存盒实时更新 (SSE, /api/slots/stream), 默认关闭: 'memory' 只通知本进程的连接,
+    # 'sqlite' 通过本地文件在多个 gunicorn worker 之间共享事件; 每个连接占用一个线程,
+    # 需使用 gthread/gevent worker, 同步 worker 上会拒绝连接
+    SLOT_EVENTS_ENABLED = os.environ.get('SLOT_EVENTS_ENABLED', '0') == '1'
+    SLOT_EVENTS_BACKEND = os.environ.get('SLOT_EVENTS_BACKEND', STATS_CACHE_BACKEND)
+    SLOT_EVENTS_PATH = os.environ.get('SLOT_EVENTS_PATH') or os.path.join(basedir, 'slot_events.db')
+    SLOT_EVENTS_STREAM_SECONDS = int(os.environ.get('SLOT_EVENTS_STREAM_SECONDS', 300))
+
+    # JSON 编码: 安装了 orjson 时使用 orjson (更快), 否则使用标准库; 日期统一输出 ISO 8601
+    JSON_USE_ORJSON = os.environ.get('JSON_USE_ORJSON', '1') != '0'
+
+    # 请求级 SQL 分析: 响应头 X-Query-Count / Server-Timing, 慢查询与 N+1 日志, 汇总见 /admin/perf
+    QUERY_PROFILER_ENABLED = os.environ.get('QUERY_PROFILER_ENABLED', '1') != '0'
+    SLOW_QUERY_MS = int(os.environ.get('SLOW_QUERY_MS', 200))
+    # 同一请求中相同结构的语句出现次数达到该值时记为疑似 N+1
+    N_PLUS_ONE_THRESHOLD = int(os.environ.get('N_PLUS_ONE_THRESHOLD', 5))
+
+    # Prometheus 指标 (/metrics); 多个 gunicorn worker 时设置 METRICS_DIR 为本机共享目录
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') != '0'
+    METRICS_DIR = os.environ.get('METRICS_DIR')
+    METRICS_FLUSH_SECONDS = float(os.environ.get('METRICS_FLUSH_SECONDS', 1))
+    # 设置后 /metrics 需要 Authorization: Bearer <token>, 否则仅管理员登录后可访问
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+    # 服务器端选择集（拾取列表、待确认的放置方案）的有效期
+    SELECTION_TTL_HOURS = int(os.environ.get('SELECTION_TTL_HOURS', 12))
+
+    # 批次ID分配: 'auto' 在 PostgreSQL 上使用序列, 其他数据库使用计数器;
+    # BATCH_ID_BLOCK_SIZE > 1 时每个 worker 一次预留一段ID (hi/lo)
+    BATCH_ID_STRATEGY = os.environ.get('BATCH_ID_STRATEGY', 'auto')
+    BATCH_ID_BLOCK_SIZE = int(os.environ.get('BATCH_ID_BLOCK_SIZE', 1))
+
+    # 新冻存管自动放置策略: 'first_fit'（默认）, 'best_fit', 'same_drawer'
+    PLACEMENT_STRATEGY = os.environ.get('PLACEMENT_STRATEGY', 'first_fit')
+
     # CSRF 保护配置
     WTF_CSRF_ENABLED = True
     WTF_CSRF_TIME_LIMIT = 3600  # CSRF token 有效期 1 小时
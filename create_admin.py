@@ -9,6 +9,7 @@
 import os
 from app import create_app, db
 from app.cell_storage.models import User
+from app.shared.schema import migrate
 
 def setup_admin_user():
     # 为了能在 Cloud Shell 或类似环境中运行，需要手动设置环境变量
@@ -23,6 +24,8 @@ def setup_admin_user():
 
     app = create_app()
     with app.app_context():
+        # 新数据库需要先建表（与 `flask --app run migrate-db` 相同）
+        migrate(echo=print)
         admin_user = User.query.filter_by(username='admin').first()
         
         new_password = '111111' # 您可以按需修改这个密码
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+Load Test Harness
+Drives the main pages with concurrent clients and reports p50/p95/p99 latency
+and SQL query counts (from the X-Query-Count header) per endpoint.
+
+Two modes:
+  * in-process (default): Flask test clients against the configured database
+    (DATABASE_URL), logged in directly as --username without a password;
+  * HTTP: --base-url http://127.0.0.1:8000 against a running server
+    (e.g. gunicorn), logged in through the login form with --password.
+
+Seed a realistic dataset first, e.g.:
+    flask --app run seed --password '<password>' --vials 1000000 --towers 80
+
+Usage:
+    python loadtest.py --username seed_user_1 [--threads 8] [--requests 20]
+    python loadtest.py --base-url http://127.0.0.1:8000 --username seed_user_1 --password '<password>'
+    [--paths /cell-storage/,/inventory/] [--json results.json]
+"""
+
+import argparse
+import http.cookiejar
+import json
+import os
+import re
+import statistics
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_PATHS = (
+    '/cell-storage/',
+    '/cell-storage/inventory',
+    '/cell-storage/inventory/summary',
+    '/cell-storage/audit_logs',
+    '/cell-storage/locations',
+    '/cell-storage/api/search/suggestions?q=SEED',
+    '/cell-storage/api/search/advanced?q=SEED',
+    '/inventory/',
+    '/inventory/items',
+    '/inventory/orders',
+)
+
+_CSRF_RE = re.compile(r'name="csrf_token"[^>]*value="([^"]+)"')
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+class TestClientSession:
+    """In-process client logged in by writing the Flask-Login session directly."""
+
+    def __init__(self, app, user_id):
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess['_user_id'] = str(user_id)
+            sess['_fresh'] = True
+
+    def get(self, path):
+        response = self.client.get(path)
+        return response.status_code, response.headers.get('X-Query-Count'), len(response.get_data())
+
+
+class HTTPSession:
+    """Client for a running server, logged in through the login form."""
+
+    def __init__(self, base_url, username, password):
+        self.base_url = base_url.rstrip('/')
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar())
+        )
+        page = self.opener.open(f'{self.base_url}/auth/login').read().decode('utf-8', 'replace')
+        token = _CSRF_RE.search(page)
+        data = {'username': username, 'password': password}
+        if token:
+            data['csrf_token'] = token.group(1)
+        self.opener.open(f'{self.base_url}/auth/login', urllib.parse.urlencode(data).encode())
+
+    def get(self, path):
+        try:
+            response = self.opener.open(f'{self.base_url}{path}')
+            body = response.read()
+            return response.status, response.headers.get('X-Query-Count'), len(body)
+        except urllib.error.HTTPError as exc:
+            return exc.code, exc.headers.get('X-Query-Count'), 0
+
+
+def make_in_process_app(username):
+    from config import Config
+    from app import create_app
+    from app.cell_storage.models import User
+
+    class LoadTestConfig(Config):
+        WTF_CSRF_ENABLED = False
+
+    app = create_app(LoadTestConfig)
+    with app.app_context():
+        user = User.query.filter_by(username=username).first()
+        if user is None:
+            raise SystemExit(f'User {username!r} not found; run "flask --app run seed" or pass --username.')
+        return app, user.id
+
+
+def worker(make_session, paths, count, results, lock):
+    session = make_session()
+    for i in range(count):
+        path = paths[i % len(paths)]
+        start = time.perf_counter()
+        status, queries, size = session.get(path)
+        elapsed = time.perf_counter() - start
+        with lock:
+            entry = results.setdefault(path, {'latencies': [], 'queries': [], 'errors': 0, 'bytes': 0})
+            entry['latencies'].append(elapsed)
+            entry['bytes'] += size
+            if queries is not None:
+                entry['queries'].append(int(queries))
+            if status >= 400:
+                entry['errors'] += 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Concurrent load test of the main routes.')
+    parser.add_argument('--base-url', help='test a running server instead of an in-process app')
+    parser.add_argument('--username', default='admin')
+    parser.add_argument('--password', help='password (HTTP mode only)')
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=len(DEFAULT_PATHS) * 2,
+                        help='requests per thread (paths are cycled)')
+    parser.add_argument('--paths', default=','.join(DEFAULT_PATHS))
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    paths = [path for path in args.paths.split(',') if path]
+    if args.base_url:
+        if not args.password:
+            parser.error('--password is required with --base-url')
+        make_session = lambda: HTTPSession(args.base_url, args.username, args.password)  # noqa: E731
+        target = args.base_url
+    else:
+        app, user_id = make_in_process_app(args.username)
+        make_session = lambda: TestClientSession(app, user_id)  # noqa: E731
+        target = 'in-process test client'
+        # Warm-up so one-off start-up work (caches, first connections) is not measured
+        warm = make_session()
+        for path in paths:
+            warm.get(path)
+
+    print("=== CellStorage Load Test ===")
+    print(f"Target: {target}, threads: {args.threads}, requests per thread: {args.requests}")
+
+    results = {}
+    lock = threading.Lock()
+    threads = [
+        threading.Thread(target=worker, args=(make_session, paths, args.requests, results, lock))
+        for _ in range(args.threads)
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    report = {}
+    print(f"{'path':<46} {'n':>5} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'queries':>8} {'max q':>6} {'err':>4}")
+    for path in paths:
+        entry = results.get(path)
+        if not entry:
+            continue
+        latencies = sorted(entry['latencies'])
+        queries = entry['queries']
+        row = {
+            'requests': len(latencies),
+            'p50_ms': percentile(latencies, 0.50) * 1000,
+            'p95_ms': percentile(latencies, 0.95) * 1000,
+            'p99_ms': percentile(latencies, 0.99) * 1000,
+            'avg_queries': statistics.mean(queries) if queries else None,
+            'max_queries': max(queries) if queries else None,
+            'errors': entry['errors'],
+            'avg_bytes': entry['bytes'] / len(latencies),
+        }
+        report[path] = row
+        avg_q = f"{row['avg_queries']:.1f}" if queries else '-'
+        max_q = str(row['max_queries']) if queries else '-'
+        print(f"{path[:46]:<46} {row['requests']:>5} {row['p50_ms']:>8.1f} {row['p95_ms']:>8.1f} "
+              f"{row['p99_ms']:>8.1f} {avg_q:>8} {max_q:>6} {row['errors']:>4}")
+
+    total = sum(len(entry['latencies']) for entry in results.values())
+    print(f"Total: {total} requests in {elapsed:.1f}s ({total / elapsed:.1f} req/s)")
+
+    if args.json:
+        with open(args.json, 'w') as fh:
+            json.dump({'target': target, 'threads': args.threads, 'elapsed_s': elapsed,
+                       'endpoints': report}, fh, indent=2)
+        print(f"Results written to {args.json}")
+
+
+if __name__ == '__main__':
+    main()